@@ -0,0 +1,91 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+import time
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from billing_server.billing import app, divide_time_range
+from billing_server.billing.buckets import BucketCalendar
+
+# Compares generating daily bucket boundaries over several years with the bucket calendar, cold and once its
+# boundaries are cached, against stepping through them with relativedelta and localize as get_bucket_functions did.
+#
+# Usage: PYTHONPATH=. python benchmarks/bench_bucket_calendar.py --years 1 5 10
+
+
+def legacy_boundaries(start_date, end_date):
+    boundaries = []
+    current_date = start_date
+    while current_date < end_date:
+        new_date = current_date + relativedelta(days=+1)
+        current_date = app.timezone.localize(datetime(year=new_date.year, month=new_date.month, day=new_date.day))
+        boundaries.append(current_date)
+
+    return boundaries[:-1]
+
+
+def timed(func, *args, repeat=5):
+    # Best of a few runs, to keep noise from other processes out of the numbers
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        retval = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, retval
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bucket calendar')
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--start-year', type=int, default=2013)
+    args = parser.parse_args()
+
+    print('{:>6} {:>8} {:>12} {:>12} {:>12} {:>9} {:>16}'.format(
+        'years', 'buckets', 'legacy (s)', 'cold (s)', 'cached (s)', 'speedup', 'divide (s)'))
+
+    for years in args.years:
+        start_date = app.timezone.localize(datetime(args.start_year, 1, 1))
+        end_date = app.timezone.localize(datetime(args.start_year + years, 1, 1))
+
+        legacy_time, legacy = timed(legacy_boundaries, start_date, end_date)
+        cold_time, cold = timed(lambda: BucketCalendar(app.timezone).boundaries('daily', start_date, end_date))
+        calendar = BucketCalendar(app.timezone)
+        calendar.boundaries('daily', start_date, end_date)
+        cached_time, cached = timed(calendar.boundaries, 'daily', start_date, end_date)
+
+        if not legacy == cold == cached:
+            raise AssertionError('Calendars differ over {} years'.format(years))
+
+        # The whole range as /reports would divide it with a page per year of days
+        divide_time, date_ranges = timed(divide_time_range, start_date, end_date, 'daily', 366 * years)
+
+        print('{:>6} {:>8} {:>12.4f} {:>12.4f} {:>12.6f} {:>8.0f}x {:>16.4f}'.format(
+            years,
+            len(cached) + 1,
+            legacy_time,
+            cold_time,
+            cached_time,
+            legacy_time / cached_time,
+            divide_time,
+        ))
+
+
+if __name__ == '__main__':
+    main()
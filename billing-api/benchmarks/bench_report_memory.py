@@ -0,0 +1,184 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+import gc
+import random
+import tracemalloc
+from datetime import datetime
+
+from billing_server.billing import add_bucket_usage, app, divide_time_range, merge_usage
+from billing_server.billing.utils import parsing
+
+# Measures the memory an admin report of synthetic usage takes on its way from query rows to report entries, with
+# rows as UsageRecords against the annotated dicts they replaced.
+#
+# Usage: PYTHONPATH=. python benchmarks/bench_report_memory.py --rows 100000
+
+
+class Directory:
+    # Stands in for the Collaboratory's username lookups
+    def get_username(self, user_id):
+        return 'name of ' + user_id
+
+
+def make_rows(rows, projects, users_per_project, date_ranges, seed):
+    # {[bucket index]: [[core hours], [volume hours], [object storage], [images]]}, like the bucketed queries return
+    generator = random.Random(seed)
+    buckets = {index: ([], [], [], []) for index in range(len(date_ranges))}
+
+    for _ in range(rows):
+        usage = buckets[generator.randrange(len(date_ranges))]
+        project_id = 'project-{}'.format(generator.randrange(projects))
+        user = 'user-{}-{}'.format(project_id, generator.randrange(users_per_project))
+        kind = generator.randrange(4)
+
+        if kind == 0:
+            usage[0].append({'user': user, 'projectId': project_id, 'cpu': generator.randrange(1, 1000)})
+
+        elif kind == 1:
+            usage[1].append({'user': user, 'projectId': project_id, 'volume': generator.randrange(1, 1000)})
+
+        elif kind == 2:
+            usage[2].append({'projectId': project_id, 'objects': generator.random() * 100})
+
+        else:
+            usage[3].append({'image': generator.randrange(1, 1000), 'projectId': project_id})
+
+    return buckets
+
+
+def legacy_add_bucket_usage(responses, database, bucket, core_hours, volume_hours, object_storage, images):
+    for usage in core_hours:
+        usage['fromDate'] = bucket.start_date
+        usage['toDate'] = bucket.end_date
+        usage['cpuPrice'] = bucket.period.cpu_price
+        usage['username'] = database.get_username(usage['user'])
+        responses.append(usage)
+
+    for usage in volume_hours:
+        usage['fromDate'] = bucket.start_date
+        usage['toDate'] = bucket.end_date
+        usage['volumePrice'] = bucket.period.volume_price
+        usage['username'] = database.get_username(usage['user'])
+        responses.append(usage)
+
+    for usage in object_storage:
+        usage['fromDate'] = bucket.start_date
+        usage['toDate'] = bucket.end_date
+        usage['objectsPrice'] = bucket.period.object_storage_price
+        usage['user'] = None
+        responses.append(usage)
+
+    for image in images:
+        image['fromDate'] = bucket.start_date
+        image['toDate'] = bucket.end_date
+        image['imagePrice'] = bucket.period.image_price
+        image['user'] = None
+        responses.append(image)
+
+
+def legacy_merge_usage(responses, next_bucket, start_of_bucket):
+    # The dict based merge, as it was before UsageRecord
+    report = dict()
+    bucket_bounds = dict()
+
+    for item in responses:
+        from_date = item['fromDate']
+
+        if from_date not in bucket_bounds:
+            bucket_start = start_of_bucket(from_date)
+            bucket_bounds[from_date] = (bucket_start, bucket_start.isoformat(), next_bucket(from_date).isoformat())
+
+        bucket_start, bucket_from_date, bucket_to_date = bucket_bounds[from_date]
+        key = (item['user'], item['projectId'], bucket_start)
+        report_item = report.get(key)
+
+        if report_item is None:
+            report_item = {'fromDate': bucket_from_date, 'toDate': bucket_to_date, 'user': item['user'],
+                           'projectId': item['projectId']}
+            report[key] = report_item
+
+            if item['user'] is not None:
+                report_item['username'] = item['username']
+
+        for kind in (('cpu', 'volume') if item['user'] is not None else ('image', 'objects')):
+            if item.get(kind) is not None:
+                report_item.setdefault(kind, 0)
+                report_item.setdefault(kind + 'Cost', 0)
+                report_item[kind] += item[kind]
+                report_item[kind + 'Cost'] += round(parsing.parse_decimal(item[kind]) * item[kind + 'Price'], 4)
+
+    return list(report.values())
+
+
+def measure(add_usage, merge, args, date_ranges, next_bucket, start_of_bucket):
+    gc.collect()
+    tracemalloc.start()
+
+    rows = make_rows(args.rows, args.projects, args.users_per_project, date_ranges, args.seed)
+    rows_size = tracemalloc.get_traced_memory()[0]
+
+    responses = []
+    for index, bucket in enumerate(date_ranges):
+        add_usage(responses, Directory(), bucket, *rows[index])
+
+    # Whatever the rows still hold once they've been turned into responses is part of the report's footprint
+    del rows
+    gc.collect()
+    responses_size = tracemalloc.get_traced_memory()[0]
+
+    report = merge(responses, next_bucket, start_of_bucket)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return rows_size, responses_size, peak, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the memory of the /reports pipeline')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--projects', type=int, default=400)
+    parser.add_argument('--users-per-project', type=int, default=3)
+    parser.add_argument('--bucket', default='daily', choices=app.valid_bucket_sizes)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    date_ranges, bucket_size, same_bucket, next_bucket, start_of_bucket = divide_time_range(
+        app.timezone.localize(datetime(2016, 9, 1)),
+        app.timezone.localize(datetime(2016, 11, 1)),
+        args.bucket
+    )
+
+    legacy = measure(legacy_add_bucket_usage, legacy_merge_usage, args, date_ranges, next_bucket, start_of_bucket)
+    current = measure(add_bucket_usage, merge_usage, args, date_ranges, next_bucket, start_of_bucket)
+
+    if legacy[3] != current[3]:
+        raise AssertionError('Reports differ')
+
+    print('{} rows, {} entries'.format(args.rows, len(current[3])))
+    print('{:>14} {:>16} {:>16} {:>12}'.format('', 'query rows (MB)', 'responses (MB)', 'peak (MB)'))
+
+    for name, (rows_size, responses_size, peak, report) in (('dicts', legacy), ('UsageRecord', current)):
+        print('{:>14} {:>16.1f} {:>16.1f} {:>12.1f}'.format(
+            name,
+            rows_size / 2 ** 20,
+            responses_size / 2 ** 20,
+            peak / 2 ** 20
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+import random
+import time
+from datetime import datetime
+from functools import reduce
+
+from dateutil.parser import parse
+
+from billing_server.billing import app, divide_time_range, merge_usage
+from billing_server.billing.usage import UsageRecord
+from billing_server.billing.utils import parsing
+
+# Compares the hash-indexed report merge with the linear scan reduce it replaced.
+#
+# Usage: PYTHONPATH=. python benchmarks/bench_report_merge.py --rows 10000 100000
+
+
+def legacy_merge(responses, same_bucket, next_bucket, start_of_bucket):
+    def sort_results_into_buckets(report, item):
+        # Try to match a row to a previous row so that they can be put together
+        for report_item in report:
+            if (
+                report_item['user'] == item['user'] and
+                report_item['projectId'] == item['projectId'] and
+                same_bucket(parse(report_item['fromDate']), parse(item['fromDate']))
+            ):
+                if 'user' in report_item and report_item['user'] is not None:
+                    if 'cpu' in item and item['cpu'] is not None:
+                        if 'cpu' not in report_item:
+                            report_item['cpu'] = 0
+                            report_item['cpuCost'] = 0
+
+                        report_item['cpu'] += item['cpu']
+                        report_item['cpuCost'] += round(parsing.parse_decimal(item['cpu']) * item['cpuPrice'], 4)
+
+                    if 'volume' in item and item['volume'] is not None:
+                        if 'volume' not in report_item:
+                            report_item['volume'] = 0
+                            report_item['volumeCost'] = 0
+
+                        report_item['volume'] += item['volume']
+                        report_item['volumeCost'] += round(parsing.parse_decimal(item['volume']) * item['volumePrice'], 4)
+
+                else:
+                    if 'image' in item and item['image'] is not None:
+                        if 'image' not in report_item:
+                            report_item['image'] = 0
+                            report_item['imageCost'] = 0
+
+                        report_item['image'] += item['image']
+                        report_item['imageCost'] += round(parsing.parse_decimal(item['image']) * item['imagePrice'], 4)
+
+                    if 'objects' in item and item['objects'] is not None:
+                        if 'objects' not in report_item:
+                            report_item['objects'] = 0
+                            report_item['objectsCost'] = 0
+
+                        report_item['objects'] += item['objects']
+                        report_item['objectsCost'] += round(parsing.parse_decimal(item['objects']) * item['objectsPrice'], 4)
+
+                return report
+
+        # If it couldn't find a match to merge the item on to, create a new one
+        # Regardless of where the data is, we always want to show our information according to the bucket boundaries
+        # If we're looking at weekly, it doesn't make sense for the last period to cover only 3 days
+        new_item = {
+            'fromDate': start_of_bucket(parse(item['fromDate'])).isoformat(),
+            'toDate': next_bucket(parse(item['fromDate'])).isoformat(),
+            'user': item['user'],
+            'projectId': item['projectId']
+        }
+
+        if 'user' in new_item and new_item['user'] is not None:
+            new_item['username'] = item['username']
+
+            if 'cpu' in item and item['cpu'] is not None:
+                new_item['cpu'] = parsing.parse_decimal(item['cpu'])
+                new_item['cpuCost'] = round(parsing.parse_decimal(item['cpu']) * item['cpuPrice'], 4)
+
+            if 'volume' in item and item['volume'] is not None:
+                new_item['volume'] = parsing.parse_decimal(item['volume'])
+                new_item['volumeCost'] = round(parsing.parse_decimal(item['volume']) * item['volumePrice'], 4)
+
+        else:
+            if 'image' in item and item['image'] is not None:
+                new_item['image'] = item['image']
+                new_item['imageCost'] = round(parsing.parse_decimal(item['image']) * item['imagePrice'], 4)
+
+            if 'objects' in item and item['objects'] is not None:
+                new_item['objects'] = item['objects']
+                new_item['objectsCost'] = round(parsing.parse_decimal(item['objects']) * item['objectsPrice'], 4)
+
+        report.append(new_item)
+
+        return report
+
+    # app.logger.info(responses)
+
+
+    return reduce(sort_results_into_buckets, responses, list())
+
+
+def make_responses(rows, projects, users_per_project, bucket_size, seed):
+    generator = random.Random(seed)
+    start_date = app.timezone.localize(datetime(2016, 9, 1))
+    end_date = app.timezone.localize(datetime(2016, 11, 1))
+    date_ranges = divide_time_range(start_date, end_date, bucket_size)[0]
+
+    # The legacy merge reads annotated dicts, the current one UsageRecords; both are built from the same draws
+    responses = []
+    records = []
+    while len(responses) < rows:
+        bucket = generator.choice(date_ranges)
+        project_id = 'project-{}'.format(generator.randrange(projects))
+        user = 'user-{}-{}'.format(project_id, generator.randrange(users_per_project))
+        kind = generator.choice(('cpu', 'volume', 'image', 'objects'))
+
+        usage = {
+            'projectId': project_id,
+            'fromDate': bucket.bounds()[0],
+            'toDate': bucket.bounds()[1],
+        }
+
+        if kind in ('cpu', 'volume'):
+            usage['user'] = user
+            usage['username'] = user
+            usage[kind] = generator.randrange(1, 1000)
+            usage[kind + 'Price'] = getattr(bucket.period, kind + '_price')
+
+        elif kind == 'image':
+            usage['user'] = None
+            usage['image'] = generator.randrange(1, 1000)
+            usage['imagePrice'] = bucket.period.image_price
+
+        else:
+            usage['user'] = None
+            usage['objects'] = generator.random() * 100
+            usage['objectsPrice'] = bucket.period.object_storage_price
+
+        responses.append(usage)
+        records.append(UsageRecord(bucket, kind, usage['user'], project_id, usage.get('username'), usage[kind]))
+
+    return responses, records
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    retval = func(*args)
+
+    return time.perf_counter() - started, retval
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /reports bucket merge')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--projects', type=int, default=400)
+    parser.add_argument('--users-per-project', type=int, default=3)
+    parser.add_argument('--bucket', default='daily', choices=app.valid_bucket_sizes)
+    parser.add_argument('--skip-legacy', action='store_true', help='Only time the indexed merge')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    bucket_functions = divide_time_range(
+        app.timezone.localize(datetime(2016, 9, 1)),
+        app.timezone.localize(datetime(2016, 9, 2)),
+        args.bucket
+    )[2:]
+    same_bucket, next_bucket, start_of_bucket = bucket_functions
+
+    print('{:>8} {:>10} {:>12} {:>12} {:>9}'.format('rows', 'entries', 'indexed (s)', 'legacy (s)', 'speedup'))
+
+    for rows in args.rows:
+        responses, records = make_responses(rows, args.projects, args.users_per_project, args.bucket, args.seed)
+        indexed_time, indexed_report = timed(merge_usage, records, next_bucket, start_of_bucket)
+
+        if args.skip_legacy:
+            print('{:>8} {:>10} {:>12.3f} {:>12} {:>9}'.format(rows, len(indexed_report), indexed_time, '-', '-'))
+            continue
+
+        legacy_time, legacy_report = timed(legacy_merge, responses, same_bucket, next_bucket, start_of_bucket)
+
+        if legacy_report != indexed_report:
+            raise AssertionError('Merged reports differ for {} rows'.format(rows))
+
+        print('{:>8} {:>10} {:>12.3f} {:>12.3f} {:>8.1f}x'.format(
+            rows,
+            len(indexed_report),
+            indexed_time,
+            legacy_time,
+            legacy_time / indexed_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,29 +14,34 @@
 # IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import hashlib
 import json
 import pytz
-from datetime import datetime
-from functools import wraps
+import time
+from datetime import datetime, timedelta
+from functools import partial, wraps
 
 from dateutil.parser import parse
-from dateutil.relativedelta import relativedelta, MO
 from flask import Flask, request, Response, abort, jsonify, make_response
 
+from . import fanout, metrics, pool, query_log, user_directory
 from .auth import sessions
+from .auth.token_cache import TokenCache
+from .buckets import Bucket, BucketCalendar
 from .config import default
 from .error import APIError, AuthenticationError, BadRequestError
+from .pricing import DiscountIndex, PricingIndex, as_datetime, config_hash, prices
+from .report_cache import ReportCache, ReportCacheKey
+from .rollup import RollupStore
+from .usage import UsageRecord
 from .usage_queries import Collaboratory
 from .service import projects
 from .utils import parsing
-from copy import deepcopy
 from flask_cors import CORS
+from itsdangerous import BadData, URLSafeSerializer
 
-from functools import reduce
 import requests
 
-import calendar
-
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -49,8 +54,47 @@ app.config.from_object(default)
 app.secret_key = app.config['SECRET_KEY']
 
 app.valid_bucket_sizes = app.config['VALID_BUCKET_SIZES']
-app.pricing_periods = app.config['PRICING_PERIODS']
-app.discounts = app.config['DISCOUNTS']
+app.calendar = BucketCalendar(app.timezone, max_years=app.config['BUCKET_CALENDAR_MAX_YEARS'])
+app.pricing = PricingIndex(app.config['PRICING_PERIODS'], app.timezone)
+app.discounts = DiscountIndex(app.config['DISCOUNTS'], app.timezone)
+app.pricing_hash = config_hash(app.config['PRICING_PERIODS'], app.config['DISCOUNTS'])
+
+user_directory.configure(
+    ttl=app.config['USER_DIRECTORY_TTL'],
+    full_refresh=app.config['USER_DIRECTORY_FULL_REFRESH'],
+)
+
+pool.configure(
+    pool_size=app.config['MYSQL_POOL_SIZE'],
+    max_overflow=app.config['MYSQL_MAX_OVERFLOW'],
+    pool_timeout=app.config['MYSQL_POOL_TIMEOUT'],
+    pool_recycle=app.config['MYSQL_POOL_RECYCLE'],
+    pool_pre_ping=app.config['MYSQL_POOL_PRE_PING'],
+)
+
+fanout.configure(max_workers=app.config['REPORT_QUERY_WORKERS'])
+
+query_log.configure(threshold=app.config['SLOW_QUERY_THRESHOLD'], path=app.config['SLOW_QUERY_LOG_FILE'])
+
+if app.config['USAGE_ROLLUP_PATH']:
+    app.rollup = RollupStore(app.config['USAGE_ROLLUP_PATH'], app.timezone, app.logger)
+
+else:
+    app.rollup = None
+
+app.report_cache = ReportCache(
+    max_entries=app.config['REPORT_CACHE_SIZE'],
+    max_rows=app.config['REPORT_CACHE_MAX_ROWS'],
+)
+app.report_cache_checked_at = time.time()  # Rollup changes up to here have been applied to the report cache
+
+metrics.init_app(app)
+
+app.token_cache = TokenCache(
+    ttl=app.config['TOKEN_CACHE_TTL'],
+    renew_margin=app.config['TOKEN_RENEW_MARGIN'],
+    max_entries=app.config['TOKEN_CACHE_SIZE'],
+)
 
 handler = RotatingFileHandler(app.config['FLASK_LOG_FILE'], maxBytes=100000, backupCount=3)
 
@@ -63,6 +107,9 @@ else:
 app.logger.addHandler(handler)
 
 
+# Bucket sizes from finest to coarsest
+BUCKET_SIZE_ORDER = ['daily', 'weekly', 'monthly', 'yearly']
+
 # defaults
 INVOICE_API_PREFIX = ''
 EMAIL_NEW_INVOICE_PATH = INVOICE_API_PREFIX + '/emailNewInvoice'
@@ -70,10 +117,33 @@ GET_ALL_INVOICES = INVOICE_API_PREFIX + '/getAllInvoices'
 EMAIL_INVOICE_PATH = INVOICE_API_PREFIX + '/emailInvoice'
 LAST_INVOICE_PATH = INVOICE_API_PREFIX + '/getLastInvoiceNumber'
 
-# Init pricing periods from strings to datetime
-for period in app.pricing_periods:
-    period['period_start'] = parse(period['period_start']).astimezone(app.timezone)
-    period['period_end'] = parse(period['period_end']).astimezone(app.timezone)
+
+def open_session(token):
+    # Returns (client, renewed token), from the token cache when the token was renewed recently enough
+    cached = app.token_cache.get(token)
+
+    if cached is None:
+        client = sessions.validate_token(app.config['AUTH_URI'], token)
+        new_token = sessions.renew_token(app.config['AUTH_URI'], token)
+        app.token_cache.put(token, client, new_token)
+
+        return client, new_token
+
+    client, new_token, revalidate = cached
+
+    if revalidate:
+        # The renewed token is kept until it nears expiry, but Keystone is asked every TOKEN_CACHE_TTL whether
+        # it's still valid, so a revoked or logged out token stops working
+        try:
+            sessions.check_token(app.config['AUTH_URI'], new_token['token'])
+
+        except AuthenticationError:
+            app.token_cache.discard(token)
+            raise
+
+        app.token_cache.revalidated(token)
+
+    return client, new_token
 
 
 def authenticate(func):
@@ -90,23 +160,29 @@ def authenticate(func):
                 app.logger.error('Cannot parse authorization token')
                 raise AuthenticationError('Cannot parse authorization token')
 
-            client = sessions.validate_token(app.config['AUTH_URI'], token)
-            new_token = sessions.renew_token(app.config['AUTH_URI'], token)
+            client, new_token = open_session(token)
 
             database = Collaboratory(
                 app.config['MYSQL_URI'],
                 app.config['GRAPHITE_URI'],
                 app.logger,
                 app.config['BILLING_ROLE'],
+                rollup=app.rollup,
+                engine=app.config['USAGE_ENGINE'],
             )
 
-            retval = func(client, new_token['user_id'], database, *args, **kwargs)
+            try:
+                retval = func(client, new_token['user_id'], database, *args, **kwargs)
+
+            finally:
+                database.close()
 
             response = make_response(jsonify(retval), 200)
 
             response.headers['Authorization'] = new_token['token']
 
             app.logger.info('Authorization successful!')
+            app.logger.debug('Token cache: {}'.format(app.token_cache.stats()))
 
             return response
 
@@ -122,15 +198,19 @@ def api_error_handler(e):
     return Response(e.response_body, status=e.code, content_type='application/json')
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Port 5000 is reachable without nginx, so only the configured scrapers are answered
+    if request.remote_addr not in app.config['METRICS_ALLOWED_ADDRESSES']:
+        abort(403)
+
+    body, content_type = metrics.render()
+
+    return Response(body, status=200, content_type=content_type)
+
+
 @app.route('/login', methods=['POST'])
 def login():
-    database = Collaboratory(
-        app.config['MYSQL_URI'],
-        app.config['GRAPHITE_URI'],
-        app.logger,
-        app.config['BILLING_ROLE']
-    )
-
     if 'username' not in request.json or 'password' not in request.json:
         app.logger.error('Username or password not found in the request')
         raise BadRequestError('Please provide username and password in the body of your request')
@@ -140,7 +220,7 @@ def login():
         username=request.json['username'],
         password=request.json['password']
     )
-    database.refresh_user_id_map()
+    # New users don't need a directory refresh here; get_username looks up ids it hasn't seen yet
     response = Response(status=200, content_type='application/json')
     response.headers['Authorization'] = token['token']
 
@@ -194,11 +274,7 @@ def get_billing_projects(client, user_id, database):
 
 @app.route('/price', methods=['GET'])
 def get_price():
-    if request.args.get('date') is None:
-        date = (datetime.today()).astimezone(app.timezone)
-
-    else:
-        date = parse(request.args.get('date')).astimezone(app.timezone)
+    date = parse_price_date(request.args.get('date'))
 
     if request.args.get('projects') is not None:
         projects = request.args.get('projects').split(",")
@@ -209,22 +285,79 @@ def get_price():
         return get_price_period(date)
 
 
+def parse_price_date(value):
+    # Shared by /price and /prices so both read a date the same way: like the compiled price periods, a date
+    # without an offset is in the report timezone, and no date at all means now
+    if value is None:
+        return datetime.now(app.timezone)
+
+    try:
+        return as_datetime(value, app.timezone)
+
+    except ValueError:
+        app.logger.error('Please define dates in the format YYYY-MM-DD')
+        raise BadRequestError('Please define dates in the format YYYY-MM-DD')
+
+
+@app.route('/prices', methods=['GET'])
+def get_prices():
+    # Prices and discounts for every combination of the given dates and projects. The answer only depends on the
+    # query and the pricing config, so it's versioned with a hash of both and can be cached until the config changes.
+    if request.args.get('dates') is None:
+        raise BadRequestError('Please define dates as a comma separated list of dates')
+
+    dates = request.args.get('dates').split(',')
+    projects = request.args.get('projects').split(',') if request.args.get('projects') else []
+
+    parsed_dates = [parse_price_date(date) for date in dates]
+
+    retval = {
+        'dates': dates,
+        'projects': projects,
+        'prices': [prices(app.pricing.lookup(date)) for date in parsed_dates],
+        # discounts[i][j] is the discount of projects[j] on dates[i]
+        'discounts': [[app.discounts.lookup(project, date) for project in projects] for date in parsed_dates],
+    }
+
+    response = make_response(jsonify(retval), 200)
+
+    query = json.dumps({'dates': dates, 'projects': projects})
+    response.set_etag(hashlib.sha256((app.pricing_hash + query).encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(app.config['PRICE_CACHE_MAX_AGE'])
+
+    return response.make_conditional(request)
+
+
 @app.route('/reports', methods=['GET'])
 @authenticate
 def generate_report_data(client, user_id, database):
-    projects = request.args.get('projects')
-    user = request.args.get('user')
-    bucket_size = request.args.get('bucket')
+    page_size = parse_page_size(request.args.get('pageSize'))
+
+    if 'cursor' in request.args:
+        # The cursor carries the rest of the report's parameters, so a client only has to pass it back
+        report_args = load_cursor(request.args.get('cursor'))
+        start_date = parse(report_args['next']).astimezone(app.timezone)
+
+        if page_size is None:
+            page_size = report_args['pageSize']
+
+    else:
+        report_args = request.args
+        start_date = None
+
+    projects = report_args.get('projects')
+    user = report_args.get('user')
+    bucket_size = report_args.get('bucket')
 
     try:
-        if 'fromDate' in request.args:
-            original_start_date = parse(request.args.get('fromDate')).astimezone(app.timezone)
+        if 'fromDate' in report_args:
+            original_start_date = parse(report_args.get('fromDate')).astimezone(app.timezone)
 
         else:
             original_start_date = (datetime(year=datetime.today().year, month=datetime.today().month, day=1)).astimezone(app.timezone)
 
-        if 'toDate' in request.args:
-            original_end_date = parse(request.args.get('toDate')).astimezone(app.timezone)
+        if 'toDate' in report_args:
+            original_end_date = parse(report_args.get('toDate')).astimezone(app.timezone)
 
         else:
             original_end_date = (datetime.today()).astimezone(app.timezone)
@@ -233,7 +366,18 @@ def generate_report_data(client, user_id, database):
         app.logger.error('Please define fromDate and toDate in the format YYYY-MM-DD')
         raise BadRequestError('Please define fromDate and toDate in the format YYYY-MM-DD')
 
-    start_date = original_start_date
+    if start_date is None:
+        start_date = original_start_date
+
+        # A cursor already carries the bucket size chosen for the first page
+        if is_enabled(request.args.get('adaptive'), app.config['REPORT_ADAPTIVE_BUCKETS']):
+            bucket_size = choose_bucket_size(
+                original_start_date,
+                original_end_date,
+                bucket_size,
+                app.config['REPORT_BUCKET_BUDGET']
+            )
+
     end_date = original_end_date
 
     if projects is not None:
@@ -270,14 +414,253 @@ def generate_report_data(client, user_id, database):
     date_ranges, bucket_size, same_bucket, next_bucket, start_of_bucket = divide_time_range(
         start_date,
         end_date,
-        bucket_size
+        bucket_size,
+        page_size
     )
 
+    # Taken before querying, since the queries append to the project lists
+    report_key = (user_id, tuple(billing_projects), tuple(user_projects), user, bucket_size)
+
     # Generate list of responses
+    responses = get_cached_usage(database, date_ranges, billing_projects, user_projects, user, report_key)
+
+    report = merge_usage(responses, next_bucket, start_of_bucket)
+
+    retval = {
+        'bucket': bucket_size,
+        'entries': report,
+        'fromDate': original_start_date.isoformat(' '),
+        'toDate': original_end_date.isoformat(' '),
+    }
+
+    if page_size is not None:
+        next_start_date = date_ranges[-1].end_date if date_ranges else end_date
+
+        if next_start_date < end_date:
+            retval['cursor'] = dump_cursor({
+                'projects': projects,
+                'user': report_args.get('user'),
+                'bucket': bucket_size,
+                'fromDate': original_start_date.isoformat(),
+                'toDate': original_end_date.isoformat(),
+                'next': next_start_date.isoformat(),
+                'pageSize': page_size,
+            })
+
+        else:
+            retval['cursor'] = None
+
+    return retval
+
+
+def is_enabled(flag, default):
+    if flag is None:
+        return default
+
+    return flag.lower() in ('1', 'true', 'yes')
+
+
+def choose_bucket_size(start_date, end_date, bucket_size, budget):
+    # Coarsens the bucket size, in the order of BUCKET_SIZE_ORDER, until the range fits in the budget, so a long range
+    # gets coarser buckets instead of losing its oldest ones. Falls back to the coarsest size allowed.
+    sizes = [size for size in BUCKET_SIZE_ORDER if size in app.valid_bucket_sizes]
+
+    if bucket_size not in sizes:
+        bucket_size = 'daily' if 'daily' in sizes else sizes[0]
+
+    for size in sizes[sizes.index(bucket_size):]:
+        if count_buckets(start_date, end_date, size, budget + 1) <= budget:
+            return size
+
+    return sizes[-1]
+
+
+def count_buckets(start_date, end_date, bucket_size, stop_at):
+    # Stops counting at stop_at, since only whether the range fits matters
+    same_bucket, next_bucket, start_of_bucket = get_bucket_functions(bucket_size)
+
+    count = 0
+    while start_date < end_date and count < stop_at:
+        start_date = next_bucket(start_date)
+        count += 1
+
+    return count
+
+
+def parse_page_size(page_size):
+    if page_size is None:
+        return None
+
+    try:
+        page_size = int(page_size)
+
+    except ValueError:
+        raise BadRequestError('pageSize must be a number of buckets')
+
+    if page_size < 1:
+        raise BadRequestError('pageSize must be at least 1')
+
+    return min(page_size, app.config['REPORT_MAX_BUCKETS'])
+
+
+def cursor_serializer():
+    return URLSafeSerializer(app.secret_key, salt='reports-cursor')
+
+
+def dump_cursor(report_args):
+    return cursor_serializer().dumps(report_args)
+
+
+def load_cursor(cursor):
+    try:
+        return cursor_serializer().loads(cursor)
+
+    except BadData:
+        app.logger.error('Invalid report cursor')
+        raise BadRequestError('Invalid report cursor')
+
+
+def merge_usage(responses, next_bucket, start_of_bucket):
+    # Put together every record that shares a user, project and bucket. Entries are indexed on that key, so each
+    # record is merged in constant time, and the bounds of each distinct bucket are only worked out once.
+    report = dict()
+    bucket_bounds = dict()
+
+    for record in responses:
+        from_date = record.bucket.start_date
+
+        if from_date not in bucket_bounds:
+            bucket_start = start_of_bucket(from_date)
+            bucket_bounds[from_date] = (bucket_start, bucket_start.isoformat(), next_bucket(from_date).isoformat())
+
+        bucket_start, bucket_from_date, bucket_to_date = bucket_bounds[from_date]
+        key = (record.user, record.project_id, bucket_start)
+
+        if key in report:
+            add_to_report_entry(report[key], record)
+
+        else:
+            report[key] = new_report_entry(record, bucket_from_date, bucket_to_date)
+
+    # Entries keep the order in which they were first seen
+    return list(report.values())
+
+
+def new_report_entry(record, from_date, to_date):
+    # Regardless of where the data is, we always want to show our information according to the bucket boundaries
+    # If we're looking at weekly, it doesn't make sense for the last period to cover only 3 days
+    new_item = {
+        'fromDate': from_date,
+        'toDate': to_date,
+        'user': record.user,
+        'projectId': record.project_id
+    }
+
+    if record.user is not None:
+        new_item['username'] = record.username
+
+        # Instances and volumes are billed per user
+        if record.resource in ('cpu', 'volume') and record.quantity is not None:
+            new_item[record.resource] = parsing.parse_decimal(record.quantity)
+            new_item[record.resource + 'Cost'] = round(parsing.parse_decimal(record.quantity) * record.price, 4)
+
+    else:
+        # Images and object storage are billed per project
+        if record.resource in ('image', 'objects') and record.quantity is not None:
+            new_item[record.resource] = record.quantity
+            new_item[record.resource + 'Cost'] = round(parsing.parse_decimal(record.quantity) * record.price, 4)
+
+    return new_item
+
+
+def add_to_report_entry(report_item, record):
+    if report_item['user'] is not None:
+        resources = ('cpu', 'volume')
+
+    else:
+        resources = ('image', 'objects')
+
+    if record.resource in resources and record.quantity is not None:
+        if record.resource not in report_item:
+            report_item[record.resource] = 0
+            report_item[record.resource + 'Cost'] = 0
+
+        report_item[record.resource] += record.quantity
+        report_item[record.resource + 'Cost'] += round(parsing.parse_decimal(record.quantity) * record.price, 4)
+
+
+def get_cached_usage(database, date_ranges, billing_projects, user_projects, user, report_key):
+    # Usage of a bucket that ended long enough ago doesn't change any more, so it's served from the report cache
+    # and only the buckets that aren't cached yet, or are still open, go to the database
+    if app.config['REPORT_CACHE_SIZE'] <= 0:
+        return get_usage(database, date_ranges, billing_projects, user_projects, user)
+
+    invalidate_changed_buckets()
+
+    final_before = datetime.now(app.timezone) - timedelta(seconds=app.config['REPORT_CACHE_SAFETY_MARGIN'])
+
+    keys = [
+        ReportCacheKey(*report_key, bucket.start_date, bucket.end_date)
+        for bucket in date_ranges
+    ]
+    cached = [app.report_cache.get(key) for key in keys]
+    missing = [bucket for bucket, rows in zip(date_ranges, cached) if rows is None]
+
+    metrics.REPORT_CACHE_LOOKUPS.labels(result='hit').inc(len(keys) - len(missing))
+    metrics.REPORT_CACHE_LOOKUPS.labels(result='miss').inc(len(missing))
+
+    fresh = dict()
+
+    if missing:
+        for record in get_usage(database, missing, billing_projects, user_projects, user):
+            fresh.setdefault(record.bucket.start_date, []).append(record)
+
+    responses = []
+    for key, bucket, rows in zip(keys, date_ranges, cached):
+        if rows is None:
+            rows = fresh.get(bucket.start_date, [])
+
+            if bucket.end_date <= final_before:
+                metrics.REPORT_CACHE_EVICTIONS.inc(app.report_cache.put(key, rows))
+
+        responses += rows
+
+    stats = app.report_cache.stats()
+    metrics.REPORT_CACHE_ROWS.set(stats['rows'])
+    app.logger.debug('Report cache: {}'.format(stats))
+
+    return responses
+
+
+def invalidate_changed_buckets():
+    # Drops cached buckets overlapping the days `rollup.py` has re-rated since the last check, so usage that landed
+    # late shows up in reports without waiting for the buckets to be evicted
+    if app.rollup is None:
+        return
+
+    days, changed_at = app.rollup.changed_days(app.report_cache_checked_at)
+    app.report_cache_checked_at = max(app.report_cache_checked_at, changed_at)
+
+    for day in days:
+        start_date = app.timezone.localize(parse(day))
+        end_date = app.timezone.localize(parse(day) + timedelta(days=1))
+        metrics.REPORT_CACHE_INVALIDATIONS.inc(app.report_cache.invalidate_range(start_date, end_date))
+
+
+def get_usage(database, date_ranges, billing_projects, user_projects, user):
+    if app.config['REPORT_QUERY_MODE'] == 'per_bucket':
+        return get_usage_per_bucket(database, date_ranges, billing_projects, user_projects, user)
+
+    if app.config['REPORT_QUERY_MODE'] == 'concurrent':
+        return get_usage_concurrent(database, date_ranges, billing_projects, user_projects, user)
+
+    return get_usage_bucketed(database, date_ranges, billing_projects, user_projects, user)
+
+
+def get_usage_per_bucket(database, date_ranges, billing_projects, user_projects, user):
     responses = []
-    for bucket_range in date_ranges:
-        start_date = bucket_range['start_date']
-        end_date = bucket_range['end_date']
+    for bucket in date_ranges:
+        start_date, end_date = bucket.bounds()
 
         core_hours = database.get_instance_core_hours(
             start_date,
@@ -287,13 +670,6 @@ def generate_report_data(client, user_id, database):
             user
         )
 
-        for usage in core_hours:
-            usage['fromDate'] = start_date
-            usage['toDate'] = end_date
-            usage['cpuPrice'] = bucket_range['cpu_price']
-            usage['username'] = database.get_username(usage['user'])
-            responses.append(usage)
-
         volume_hours = database.get_volume_gigabyte_hours(
             start_date,
             end_date,
@@ -302,127 +678,157 @@ def generate_report_data(client, user_id, database):
             user
         )
 
-        for usage in volume_hours:
-            usage['fromDate'] = start_date
-            usage['toDate'] = end_date
-            usage['volumePrice'] = bucket_range['volume_price']
-            usage['username'] = database.get_username(usage['user'])
-            responses.append(usage)
-
         object_storage = database.get_object_storage_by_project(
             start_date,
             end_date,
             billing_projects,
         )
 
-        for usage in object_storage:
-            usage['fromDate'] = start_date
-            usage['toDate'] = end_date
-            usage['objectsPrice'] = bucket_range['object_storage_price']
-            usage['user'] = None
-            responses.append(usage)
-
         images = database.get_image_storage_gigabyte_hours_by_project(
             start_date,
             end_date,
             billing_projects
         )
 
-        for image in images:
-            image['fromDate'] = start_date
-            image['toDate'] = end_date
-            image['imagePrice'] = bucket_range['image_price']
-            image['user'] = None
-            responses.append(image)
-
-    def sort_results_into_buckets(report, item):
-        # Try to match a row to a previous row so that they can be put together
-        for report_item in report:
-            if (
-                report_item['user'] == item['user'] and
-                report_item['projectId'] == item['projectId'] and
-                same_bucket(parse(report_item['fromDate']), parse(item['fromDate']))
-            ):
-                if 'user' in report_item and report_item['user'] is not None:
-                    if 'cpu' in item and item['cpu'] is not None:
-                        if 'cpu' not in report_item:
-                            report_item['cpu'] = 0
-                            report_item['cpuCost'] = 0
-
-                        report_item['cpu'] += item['cpu']
-                        report_item['cpuCost'] += round(parsing.parse_decimal(item['cpu']) * item['cpuPrice'], 4)
-
-                    if 'volume' in item and item['volume'] is not None:
-                        if 'volume' not in report_item:
-                            report_item['volume'] = 0
-                            report_item['volumeCost'] = 0
-
-                        report_item['volume'] += item['volume']
-                        report_item['volumeCost'] += round(parsing.parse_decimal(item['volume']) * item['volumePrice'], 4)
-
-                else:
-                    if 'image' in item and item['image'] is not None:
-                        if 'image' not in report_item:
-                            report_item['image'] = 0
-                            report_item['imageCost'] = 0
-
-                        report_item['image'] += item['image']
-                        report_item['imageCost'] += round(parsing.parse_decimal(item['image']) * item['imagePrice'], 4)
-
-                    if 'objects' in item and item['objects'] is not None:
-                        if 'objects' not in report_item:
-                            report_item['objects'] = 0
-                            report_item['objectsCost'] = 0
-
-                        report_item['objects'] += item['objects']
-                        report_item['objectsCost'] += round(parsing.parse_decimal(item['objects']) * item['objectsPrice'], 4)
-
-                return report
-
-        # If it couldn't find a match to merge the item on to, create a new one
-        # Regardless of where the data is, we always want to show our information according to the bucket boundaries
-        # If we're looking at weekly, it doesn't make sense for the last period to cover only 3 days
-        new_item = {
-            'fromDate': start_of_bucket(parse(item['fromDate'])).isoformat(),
-            'toDate': next_bucket(parse(item['fromDate'])).isoformat(),
-            'user': item['user'],
-            'projectId': item['projectId']
-        }
-
-        if 'user' in new_item and new_item['user'] is not None:
-            new_item['username'] = item['username']
-
-            if 'cpu' in item and item['cpu'] is not None:
-                new_item['cpu'] = parsing.parse_decimal(item['cpu'])
-                new_item['cpuCost'] = round(parsing.parse_decimal(item['cpu']) * item['cpuPrice'], 4)
-
-            if 'volume' in item and item['volume'] is not None:
-                new_item['volume'] = parsing.parse_decimal(item['volume'])
-                new_item['volumeCost'] = round(parsing.parse_decimal(item['volume']) * item['volumePrice'], 4)
+        add_bucket_usage(responses, database, bucket, core_hours, volume_hours, object_storage, images)
+
+    return responses
+
+
+def get_usage_concurrent(database, date_ranges, billing_projects, user_projects, user):
+    # Every resource of every bucket is queried at once, each on its own pooled connection, so a report takes
+    # about as long as its slowest query. The queries append to the project lists they're given, so every task
+    # gets its own copies.
+    tasks = []
+    for bucket in date_ranges:
+        start_date, end_date = bucket.bounds()
+
+        tasks += [
+            partial(
+                query_on_own_connection,
+                'get_instance_core_hours',
+                start_date,
+                end_date,
+                list(billing_projects),
+                list(user_projects),
+                user
+            ),
+            partial(
+                query_on_own_connection,
+                'get_volume_gigabyte_hours',
+                start_date,
+                end_date,
+                list(billing_projects),
+                list(user_projects),
+                user
+            ),
+            # Graphite doesn't need a database connection, so the request's own Collaboratory can make the call
+            partial(database.get_object_storage_by_project, start_date, end_date, list(billing_projects)),
+            partial(
+                query_on_own_connection,
+                'get_image_storage_gigabyte_hours_by_project',
+                start_date,
+                end_date,
+                list(billing_projects)
+            ),
+        ]
+
+    results = fanout.run_all(tasks, app.config['REPORT_REQUEST_CONCURRENCY'])
 
-        else:
-            if 'image' in item and item['image'] is not None:
-                new_item['image'] = item['image']
-                new_item['imageCost'] = round(parsing.parse_decimal(item['image']) * item['imagePrice'], 4)
+    responses = []
+    for index, bucket in enumerate(date_ranges):
+        core_hours, volume_hours, object_storage, images = results[index * 4:index * 4 + 4]
+        add_bucket_usage(responses, database, bucket, core_hours, volume_hours, object_storage, images)
 
-            if 'objects' in item and item['objects'] is not None:
-                new_item['objects'] = item['objects']
-                new_item['objectsCost'] = round(parsing.parse_decimal(item['objects']) * item['objectsPrice'], 4)
+    return responses
 
-        report.append(new_item)
 
-        return report
+def query_on_own_connection(method, *args):
+    database = Collaboratory(
+        app.config['MYSQL_URI'],
+        app.config['GRAPHITE_URI'],
+        app.logger,
+        app.config['BILLING_ROLE'],
+        initialized=False,
+        rollup=app.rollup,
+        engine=app.config['USAGE_ENGINE'],
+    )
 
-    # app.logger.info(responses)
+    try:
+        return getattr(database, method)(*args)
 
-    report = reduce(sort_results_into_buckets, responses, list())
+    finally:
+        database.close()
 
-    return {
-        'bucket': bucket_size,
-        'entries': report,
-        'fromDate': original_start_date.isoformat(' '),
-        'toDate': original_end_date.isoformat(' '),
-    }
+
+def get_usage_bucketed(database, date_ranges, billing_projects, user_projects, user):
+    # One statement per resource and one Graphite request for the whole report, instead of one of each per bucket
+    buckets = [bucket.bounds() for bucket in date_ranges]
+
+    core_hours = group_by_bucket(database.get_instance_core_hours_by_bucket(
+        buckets,
+        billing_projects,
+        user_projects,
+        user
+    ))
+
+    volume_hours = group_by_bucket(database.get_volume_gigabyte_hours_by_bucket(
+        buckets,
+        billing_projects,
+        user_projects,
+        user
+    ))
+
+    images = group_by_bucket(database.get_image_storage_gigabyte_hours_by_bucket(
+        buckets,
+        billing_projects
+    ))
+
+    object_storage = group_by_bucket(database.get_object_storage_by_bucket(
+        buckets,
+        billing_projects
+    ))
+
+    responses = []
+    for index, bucket in enumerate(date_ranges):
+        add_bucket_usage(
+            responses,
+            database,
+            bucket,
+            core_hours.get(index, []),
+            volume_hours.get(index, []),
+            object_storage.get(index, []),
+            images.get(index, [])
+        )
+
+    return responses
+
+
+def group_by_bucket(rows):
+    buckets = dict()
+    for row in rows:
+        buckets.setdefault(row.pop('bucket'), []).append(row)
+
+    return buckets
+
+
+def add_bucket_usage(responses, database, bucket, core_hours, volume_hours, object_storage, images):
+    # The query rows are only read here; from now on each is a UsageRecord pointing at its bucket
+    for usage in core_hours:
+        responses.append(UsageRecord(
+            bucket, 'cpu', usage['user'], usage['projectId'], database.get_username(usage['user']), usage['cpu']
+        ))
+
+    for usage in volume_hours:
+        responses.append(UsageRecord(
+            bucket, 'volume', usage['user'], usage['projectId'], database.get_username(usage['user']), usage['volume']
+        ))
+
+    for usage in object_storage:
+        responses.append(UsageRecord(bucket, 'objects', None, usage['projectId'], None, usage['objects']))
+
+    for image in images:
+        responses.append(UsageRecord(bucket, 'image', None, image['projectId'], None, image['image']))
 
 
 @app.route('/emailNewInvoice', methods=['POST'])
@@ -438,7 +844,8 @@ def email_new_invoice(client, user_id, database):
         request_payload = request.json
         request_payload["user"] = {'username': user_name, "email": user_email}
 
-        retval = requests.post(url, json=request_payload)
+        with metrics.dependency('invoice_api', 'email_new_invoice'):
+            retval = requests.post(url, json=request_payload)
 
         if str(retval.content, 'utf-8').find("error") >= 0:
             app.logger.error(retval.content)
@@ -470,11 +877,12 @@ def get_all_invoices(client, user_id, database):
         abort(403)
         return
 
-    retval = requests.post(
-        url,
-        json={"user": user_info},
-        params=request.args,
-    )
+    with metrics.dependency('invoice_api', 'get_all_invoices'):
+        retval = requests.post(
+            url,
+            json={"user": user_info},
+            params=request.args,
+        )
 
     if str(retval.content, 'utf-8').find("error") >= 0:
         app.logger.error(retval.content)
@@ -489,10 +897,11 @@ def email_me_invoice(client, user_id, database):
     url = app.config['INVOICE_API'] + EMAIL_INVOICE_PATH
     user_email = projects.get_user_email(user_id, database)
 
-    retval = requests.get(url, params={
-        'email': user_email,
-        'invoice': request.args.get('invoice'),
-    })
+    with metrics.dependency('invoice_api', 'email_invoice'):
+        retval = requests.get(url, params={
+            'email': user_email,
+            'invoice': request.args.get('invoice'),
+        })
 
     if str(retval.content, 'utf-8').find("error") >= 0:
         app.logger.error(retval.content)
@@ -515,11 +924,12 @@ def get_last_invoice_number(client, user_id, database):
         if(request.json is not None):
             request_payload = request.json
 
-        retval = requests.get(url, params={
-            'email': user_email,
-            'invoicePrefix': request.args.get('invoicePrefix'),
-            'username': user_name,
-        })
+        with metrics.dependency('invoice_api', 'get_last_invoice_number'):
+            retval = requests.get(url, params={
+                'email': user_email,
+                'invoicePrefix': request.args.get('invoicePrefix'),
+                'username': user_name,
+            })
 
         if str(retval.content, 'utf-8').find("error") >= 0:
             app.logger.error(retval.content)
@@ -531,63 +941,52 @@ def get_last_invoice_number(client, user_id, database):
         abort(403)
 
 
-def divide_time_range(start_date, end_date, bucket_size):
+def divide_time_range(start_date, end_date, bucket_size, page_size=None):
     if bucket_size not in app.valid_bucket_sizes:
         bucket_size = 'daily'
 
     same_bucket, next_bucket, start_of_bucket = get_bucket_functions(bucket_size)
 
-    pricing_periods = iter(app.pricing_periods)
-    next_period = next(pricing_periods, None)
-    period = next_period
-
-    while (start_date >= period['period_end']
-            and next_period is not None):
-
-        next_period = next(pricing_periods, None)
+    period = app.pricing.lookup(start_date)
 
-        if next_period is not None:
-            period = next_period
-
-    # We only want to report on 62 time periods at max. For each time period, 3 queries are made, so we're
-    # limiting the number of time periods to 62 in order to prevent the database from taking too much load and
-    # in order to maintain a reasonable run time. We want to be able to display around 2 months of data if going daily
-    # and 62 is the maximum number of days that 2 months can take.
-    query_periods = 62  # refactor to make this configurable
+    # We only want to report on REPORT_MAX_BUCKETS (62 by default) time periods at max. For each time period, 3
+    # queries are made, so we're limiting the number of time periods in order to prevent the database from taking too
+    # much load and in order to maintain a reasonable run time. We want to be able to display around 2 months of data
+    # if going daily and 62 is the maximum number of days that 2 months can take.
+    # Without a page size the oldest periods are dropped; with one, the range is cut after page_size buckets and the
+    # rest is left for the next page. The bucket boundaries come from the worker's bucket calendar.
+    boundaries = app.calendar.boundaries(bucket_size, start_date, end_date)
     date_ranges = []
+    page_buckets = 0
 
-    while not start_date == end_date:
-        next_bucket_date = next_bucket(start_date)
-
-        if start_date >= period['period_end'] and next_period is not None:
-            next_period = next(pricing_periods, None)
-
-            if next_period is not None:
-                period = next_period
+    for bucket_start, bucket_end in zip([start_date] + boundaries, boundaries + [end_date]):
+        if page_size is not None and page_buckets == page_size:
+            break
 
-        if start_date < period['period_end']:
-            period_end_date = min(next_bucket_date, period['period_end'], end_date)
+        # A pricing period can end inside a bucket, which then becomes one range per period
+        while not bucket_start == bucket_end:
+            # Consecutive buckets share their period; it's only looked up again once a bucket starts past its end
+            if bucket_start >= period.period_end:
+                period = app.pricing.lookup(bucket_start)
 
-        else:
-            period_end_date = min(next_bucket_date, end_date)
+            if bucket_start < period.period_end:
+                period_end_date = min(bucket_end, period.period_end)
 
-        bucket = dict()
-        bucket['start_date'] = start_date.isoformat(' ')
-        bucket['end_date'] = period_end_date.isoformat(' ')
-        bucket['cpu_price'] = period['cpu_price']
-        bucket['volume_price'] = period['volume_price']
-        bucket['image_price'] = period['image_price']
-        bucket['object_storage_price'] = period['object_storage_price']
+            else:
+                period_end_date = bucket_end
 
-        date_ranges.append(bucket)
+            date_ranges.append((bucket_start, period_end_date, period))
+            bucket_start = period_end_date
 
-        if query_periods > 0:
-            query_periods -= 1
+        page_buckets += 1
 
-        else:
-            date_ranges.pop(0)
+    if page_size is None:
+        date_ranges = date_ranges[-app.config['REPORT_MAX_BUCKETS']:]
 
-        start_date = period_end_date
+    date_ranges = [
+        Bucket(index, bucket_start, bucket_end, period)
+        for index, (bucket_start, bucket_end, period) in enumerate(date_ranges)
+    ]
 
     return date_ranges, bucket_size, same_bucket, next_bucket, start_of_bucket
 
@@ -604,26 +1003,20 @@ def get_bucket_functions(bucket_size):
             )
 
         def start_of_bucket(current_date):
-            new_date = current_date + relativedelta(weekday=MO(-1))
-
-            return app.timezone.localize(datetime(year=new_date.year, month=new_date.month, day=new_date.day))
+            return app.calendar.start_of('weekly', current_date)
 
         def next_bucket(current_date):
-            new_date = current_date + relativedelta(days=+1, weekday=MO(+1))
-
-            return app.timezone.localize(datetime(year=new_date.year, month=new_date.month, day=new_date.day))
+            return app.calendar.next_boundary('weekly', current_date)
 
     elif bucket_size == 'yearly':
         def same_bucket(start_date, end_date):
             return start_date.year == end_date.year
 
         def start_of_bucket(current_date):
-            return app.timezone.localize(datetime(year=current_date.year, month=1, day=1))
+            return app.calendar.start_of('yearly', current_date)
 
         def next_bucket(current_date):
-            new_date = current_date + relativedelta(years=+1)
-
-            return app.timezone.localize(datetime(year=new_date.year, month=1, day=1))
+            return app.calendar.next_boundary('yearly', current_date)
 
     elif bucket_size == 'monthly':
         def same_bucket(start_date, end_date):
@@ -633,12 +1026,10 @@ def get_bucket_functions(bucket_size):
             )
 
         def start_of_bucket(current_date):
-            return app.timezone.localize(datetime(year=current_date.year, month=current_date.month, day=1))
+            return app.calendar.start_of('monthly', current_date)
 
         def next_bucket(current_date):
-            new_date = current_date + relativedelta(months=+1)
-
-            return app.timezone.localize(datetime(year=new_date.year, month=new_date.month, day=1))
+            return app.calendar.next_boundary('monthly', current_date)
 
     else:
         # Daily bucket size
@@ -651,92 +1042,37 @@ def get_bucket_functions(bucket_size):
             )
 
         def start_of_bucket(current_date):
-            return app.timezone.localize(datetime(year=current_date.year, month=current_date.month, day=current_date.day))
+            return app.calendar.start_of('daily', current_date)
 
         def next_bucket(current_date):
-            new_date = current_date + relativedelta(days=+1)
-
-            return app.timezone.localize(datetime(year=new_date.year, month=new_date.month, day=new_date.day))
+            return app.calendar.next_boundary('daily', current_date)
 
     return same_bucket, next_bucket, start_of_bucket
 
 
 def get_per_project_price(date, projects):
     # get price for all projects as price is independent of projects
-    all_projects_pricing = get_price_period(date)
-    all_projects_pricing = json.loads(all_projects_pricing)
+    all_projects_pricing = prices(app.pricing.lookup(date))
 
-    # get discounts specific to the projects
+    # get discounts specific to the projects; projects with the same discount share one price dict
     output = dict()
+    discounted = dict()
     for project_name in projects:
-        output[project_name] = add_project_discount(project_name, deepcopy(all_projects_pricing), date)
+        discount = app.discounts.lookup(project_name, date)
 
-    return json.dumps(output)
+        if discount not in discounted:
+            discounted[discount] = dict(all_projects_pricing, discount=discount)
 
+        output[project_name] = discounted[discount]
 
-def get_price_period(date):
-    pricing_periods = iter(app.pricing_periods)
-    next_period = next(pricing_periods, None)
-    retval = next_period
-
-    while date >= retval['period_end'] and next_period is not None:
-        next_period = next(pricing_periods, None)
+    return json.dumps(output)
 
-        if next_period is not None:
-            retval = next_period
 
-    return json.dumps({
-        'cpuPrice': retval['cpu_price'],
-        'imagePrice': retval['image_price'],
-        'volumePrice': retval['volume_price'],
-        'objectsPrice': retval['object_storage_price'],
-    })
+def get_price_period(date):
+    return app.pricing.lookup_json(date)
 
 
 def add_project_discount(project_name, price, date):
-    price['discount'] = 0  # default discount amount
-
-    if project_name not in app.discounts.keys():
-        return price
-
-    # get discount value from config
-    project_discounts = app.discounts[project_name]
-
-    if len(project_discounts) == 1 and 'period_start' not in project_discounts[0].keys():
-        # this means that there is a discount value that is always applicable regardless of the dates
-        price['discount'] = project_discounts[0]['discount']
-        return price
-
-    # compute discount value based on the dates
-    discount_periods = iter(project_discounts)
-    next_period = next(discount_periods, None)
-    retval = next_period
-
-    while next_period is not None:
-        if 'period_end' not in next_period.keys():
-            # if we find a discount without any period; set that as target discount
-            # this will get overriden in the loop below if there is a discount specific to a period
-            price['discount'] = next_period['discount']
-            next_period = next(discount_periods, None)
-
-            if next_period is not None:
-                retval = next_period
-
-        elif date <= parse_period_end(retval['period_end']):
-            # this is time period specific discount; no need to iterate further
-            price['discount'] = next_period['discount']
-            break
-
-        else:
-            next_period = next(discount_periods, None)
-            if next_period is not None:
-                retval = next_period
+    price['discount'] = app.discounts.lookup(project_name, date)
 
     return price
-
-
-def parse_period_end(period_end_str):
-    period_end = period_end_str.split("-")
-    month_range = calendar.monthrange(int(period_end[0]), int(period_end[1]))
-
-    return parse(period_end_str+"-"+str(month_range[1]))
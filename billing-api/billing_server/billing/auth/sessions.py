@@ -19,6 +19,7 @@ from keystoneauth1.identity import v3 as auth_identity
 from keystoneclient.auth import token_endpoint
 from keystoneauth1 import session
 from keystoneclient.v3 import client
+from .. import metrics
 from ..error import AuthenticationError, APIError
 
 
@@ -37,7 +38,8 @@ def get_new_token(auth_url=None, username=None, password=None):
             }
         }
     }
-    return token_request(auth_url, request_json)
+    with metrics.dependency('keystone', 'get_new_token'):
+        return token_request(auth_url, request_json)
 
 
 def renew_token(auth_url=None, token=None):
@@ -52,7 +54,8 @@ def renew_token(auth_url=None, token=None):
             "scope": "unscoped"
         }
     }
-    return token_request(auth_url, request_json)
+    with metrics.dependency('keystone', 'renew_token'):
+        return token_request(auth_url, request_json)
 
 
 def token_request(auth_url=None, request_json=None):
@@ -62,20 +65,37 @@ def token_request(auth_url=None, request_json=None):
         raise AuthenticationError('Token expired. Please login again.')
     elif response.status_code == 200 or response.status_code == 201:
         token = {'token': response.headers.get('X-Subject-Token'),
-                 'user_id': response_json['token']['user']['id']}
+                 'user_id': response_json['token']['user']['id'],
+                 'expires_at': response_json['token'].get('expires_at')}
         return token
     else:
         raise APIError(response.status_code,
                        response_json['error']['title'], response_json['error']['message'])
 
 
+# Asks Keystone whether a token is still valid; raises AuthenticationError once it has expired or been revoked.
+# Building a client (validate_token below) doesn't contact Keystone, so this is what catches revocations.
+def check_token(auth_url=None, token=None):
+    with metrics.dependency('keystone', 'check_token'):
+        response = requests.get(auth_url + '/auth/tokens',
+                                headers={'X-Auth-Token': token, 'X-Subject-Token': token})
+
+    if response.status_code in (401, 404):
+        raise AuthenticationError('Token expired. Please login again.')
+    elif response.status_code != 200:
+        response_json = json.loads(response.content)
+        raise APIError(response.status_code,
+                       response_json['error']['title'], response_json['error']['message'])
+
+
 # Returns a client
 def validate_token(auth_url=None, token=None):
     try:
-        auth = auth_identity.Token(
-            auth_url=auth_url, token=token, unscoped=True)
-        sess = session.Session(auth=auth)
-        c = client.Client(session=sess)
+        with metrics.dependency('keystone', 'validate_token'):
+            auth = auth_identity.Token(
+                auth_url=auth_url, token=token, unscoped=True)
+            sess = session.Session(auth=auth)
+            c = client.Client(session=sess)
         return c
     except Unauthorized:
         # Take their error and resend it as mine
@@ -83,4 +103,5 @@ def validate_token(auth_url=None, token=None):
 
 
 def list_projects(client, user_id):
-    return client.projects.list(user=user_id)
+    with metrics.dependency('keystone', 'list_projects'):
+        return client.projects.list(user=user_id)
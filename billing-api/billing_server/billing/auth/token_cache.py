@@ -0,0 +1,127 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import hashlib
+import threading
+import time
+
+from dateutil.parser import parse
+
+
+# Remembers which tokens Keystone has already validated and renewed, so repeated calls from the same session
+# don't have to go back to Keystone. A renewed token is reused until it nears expiry; in between, it's only
+# re-validated every ttl seconds so revocations still take effect. Tokens are only ever stored as hashes.
+class TokenCache:
+
+    def __init__(self, ttl=300, renew_margin=600, max_entries=10000):
+        self.ttl = ttl  # How long Keystone's validation is trusted before the token is checked again
+        self.renew_margin = renew_margin  # Renew when the token has less than this many seconds left
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        # Returns (client, renewed token, whether it needs validating again), or None if it needs renewing
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(hash_token(token))
+
+            if entry is None or entry['renew_at'] <= now:
+                self.misses += 1
+                return None
+
+            if entry['validated_until'] <= now:
+                self.revalidations += 1
+                return entry['client'], entry['token'], True
+
+            self.hits += 1
+            return entry['client'], entry['token'], False
+
+    def put(self, token, client, new_token):
+        if new_token.get('expires_at') is None:
+            # Without an expiry we can't tell how long the token stays valid
+            return
+
+        now = time.time()
+        renew_at = parse(new_token['expires_at']).timestamp() - self.renew_margin
+
+        if renew_at <= now:
+            return
+
+        entry = {
+            'client': client,
+            'token': new_token,
+            'validated_until': now + self.ttl,
+            'renew_at': renew_at,
+        }
+
+        with self.lock:
+            # Each session takes two entries, one for the token and one for its renewal
+            if len(self.entries) + 2 > self.max_entries:
+                self.evict(now)
+
+            # The caller is handed the renewed token, so that's what it will send next time
+            self.entries[hash_token(token)] = entry
+            self.entries[hash_token(new_token['token'])] = entry
+
+    def revalidated(self, token):
+        # Keystone still accepts the token; trust it for another ttl without renewing it
+        with self.lock:
+            entry = self.entries.get(hash_token(token))
+
+            if entry is not None:
+                entry['validated_until'] = time.time() + self.ttl
+
+    def discard(self, token):
+        # Forgets a session, e.g. when Keystone no longer accepts its token
+        with self.lock:
+            entry = self.entries.pop(hash_token(token), None)
+
+            if entry is not None:
+                self.entries.pop(hash_token(entry['token']['token']), None)
+
+    def evict(self, now):
+        expired = [key for key, entry in self.entries.items() if entry['renew_at'] <= now]
+
+        for key in expired:
+            del self.entries[key]
+
+        # Still full of live sessions; drop the ones that need renewing soonest
+        if len(self.entries) + 2 > self.max_entries:
+            renew_first = sorted(self.entries, key=lambda key: self.entries[key]['renew_at'])
+
+            for key in renew_first[:len(self.entries) - self.max_entries // 2]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+            }
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
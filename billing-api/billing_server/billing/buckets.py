@@ -0,0 +1,115 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from dateutil.relativedelta import relativedelta, MO
+
+
+# One bucket of a report: its position in the report, its timezone-aware bounds and the pricing period it's billed
+# in. Buckets stay datetimes throughout the report; they're only formatted where they leave the process.
+class Bucket(namedtuple('Bucket', ['index', 'start_date', 'end_date', 'period'])):
+    __slots__ = ()
+
+    def bounds(self):
+        # The bounds as the usage queries and Graphite expect them
+        return format_date(self.start_date), format_date(self.end_date)
+
+
+def format_date(date):
+    return date.isoformat(' ')
+
+
+# Bucket boundaries (local midnights starting each day, week, month or year) for whole years at a time, worked out
+# once per worker and served by bisecting and slicing. Boundaries are localized one by one, so days around a DST
+# change are 23 or 25 hours long as they should be. Each bucket size's calendar covers at most max_years years, so
+# reports on far apart or very long ranges can't grow it without limit; past that it starts over from the years asked
+# for, and a range longer than max_years on its own is worked out without being kept.
+class BucketCalendar:
+
+    def __init__(self, timezone, max_years=100):
+        self.timezone = timezone
+        self.max_years = max_years
+        self.calendars = {}  # {[bucket_size]: (first_year, last_year, boundaries)}
+        self.lock = threading.Lock()
+
+    def boundaries(self, bucket_size, start_date, end_date):
+        # The boundaries strictly between start_date and end_date
+        boundaries = self.calendar(bucket_size, start_date.year - 1, end_date.year + 1)
+
+        return boundaries[bisect_right(boundaries, start_date):bisect_left(boundaries, end_date)]
+
+    def next_boundary(self, bucket_size, current_date):
+        boundaries = self.calendar(bucket_size, current_date.year - 1, current_date.year + 1)
+
+        return boundaries[bisect_right(boundaries, current_date)]
+
+    def start_of(self, bucket_size, current_date):
+        boundaries = self.calendar(bucket_size, current_date.year - 1, current_date.year + 1)
+
+        return boundaries[bisect_right(boundaries, current_date) - 1]
+
+    def calendar(self, bucket_size, first_year, last_year):
+        cached = self.calendars.get(bucket_size)
+
+        if cached is not None and cached[0] <= first_year and last_year <= cached[1]:
+            return cached[2]
+
+        if last_year - first_year + 1 > self.max_years:
+            return generate_boundaries(bucket_size, first_year, last_year, self.timezone)
+
+        with self.lock:
+            cached = self.calendars.get(bucket_size)
+
+            if cached is not None and max(last_year, cached[1]) - min(first_year, cached[0]) + 1 <= self.max_years:
+                first_year = min(first_year, cached[0])
+                last_year = max(last_year, cached[1])
+
+            boundaries = generate_boundaries(bucket_size, first_year, last_year, self.timezone)
+
+            # Replaced in one assignment, so readers never see a calendar half built
+            self.calendars[bucket_size] = (first_year, last_year, boundaries)
+
+            return boundaries
+
+
+def generate_boundaries(bucket_size, first_year, last_year, timezone):
+    # Every boundary from the first one in first_year up to and including January 1st after last_year
+    current = date(first_year, 1, 1)
+    last = date(last_year + 1, 1, 1)
+
+    if bucket_size == 'weekly':
+        current += relativedelta(weekday=MO(+1))
+        step = relativedelta(weeks=+1)
+
+    elif bucket_size == 'monthly':
+        step = relativedelta(months=+1)
+
+    elif bucket_size == 'yearly':
+        step = relativedelta(years=+1)
+
+    else:
+        # Daily bucket size, also the default
+        step = timedelta(days=1)
+
+    boundaries = []
+    while current <= last:
+        boundaries.append(timezone.localize(datetime(year=current.year, month=current.month, day=current.day)))
+        current += step
+
+    return boundaries
@@ -18,12 +18,45 @@ import config
 DEBUG = config.DEBUG  # Debug mode for flask
 SECRET_KEY = config.SECRET_KEY
 AUTH_URI = config.AUTH_URI  # Keystone/Identity API endpoint
+TOKEN_CACHE_TTL = getattr(config, 'TOKEN_CACHE_TTL', 300)  # Seconds before a cached token is validated again
+TOKEN_RENEW_MARGIN = getattr(config, 'TOKEN_RENEW_MARGIN', 600)  # Renew tokens with less than this many seconds left
+TOKEN_CACHE_SIZE = getattr(config, 'TOKEN_CACHE_SIZE', 10000)  # Max cached tokens per worker
 INVOICE_API = config.INVOICE_API #
 MYSQL_URI = config.MYSQL_URI  # Mysql URI
 GRAPHITE_URI = config.GRAPHITE_URI  # Mysql URI
 TEST_MYSQL_URI = config.TEST_MYSQL_URI # Mysql URI for test
+# Connection pool shared by every request within a worker
+MYSQL_POOL_SIZE = getattr(config, 'MYSQL_POOL_SIZE', 5)  # Connections kept open per worker
+MYSQL_MAX_OVERFLOW = getattr(config, 'MYSQL_MAX_OVERFLOW', 10)  # Extra connections allowed under load
+MYSQL_POOL_TIMEOUT = getattr(config, 'MYSQL_POOL_TIMEOUT', 30)  # Seconds to wait for a free connection
+MYSQL_POOL_RECYCLE = getattr(config, 'MYSQL_POOL_RECYCLE', 3600)  # Seconds before a connection is replaced
+MYSQL_POOL_PRE_PING = getattr(config, 'MYSQL_POOL_PRE_PING', True)  # Test connections before handing them out
 TEST_GRAPHITE_URI = config.TEST_GRAPHITE_URI
+USER_DIRECTORY_TTL = getattr(config, 'USER_DIRECTORY_TTL', 300)  # Seconds before new usernames are picked up
+USER_DIRECTORY_FULL_REFRESH = getattr(config, 'USER_DIRECTORY_FULL_REFRESH', 3600)  # Seconds between full reloads
+# Statements taking at least SLOW_QUERY_THRESHOLD seconds are logged as JSON, to SLOW_QUERY_LOG_FILE if set or
+# else to the Flask log; None turns the slow query log off
+SLOW_QUERY_THRESHOLD = getattr(config, 'SLOW_QUERY_THRESHOLD', 2.0)
+SLOW_QUERY_LOG_FILE = getattr(config, 'SLOW_QUERY_LOG_FILE', None)
 VALID_BUCKET_SIZES = config.VALID_BUCKET_SIZES  # Bucketing options for query.
+USAGE_ROLLUP_PATH = getattr(config, 'USAGE_ROLLUP_PATH', None)  # SQLite file of daily usage, filled by rollup.py
+# 'bucketed' runs one query per resource for a whole report, 'per_bucket' runs one per resource per bucket, and
+# 'concurrent' runs the per bucket queries in parallel
+REPORT_QUERY_MODE = getattr(config, 'REPORT_QUERY_MODE', 'bucketed')
+# 'sql' rates bucketed usage in MySQL, 'sweep' fetches the lifetimes once and rates every bucket with NumPy
+USAGE_ENGINE = getattr(config, 'USAGE_ENGINE', 'sql')
+REPORT_QUERY_WORKERS = getattr(config, 'REPORT_QUERY_WORKERS', 8)  # Queries running at once across all requests
+REPORT_REQUEST_CONCURRENCY = getattr(config, 'REPORT_REQUEST_CONCURRENCY', 4)  # Queries running at once per request
+REPORT_MAX_BUCKETS = getattr(config, 'REPORT_MAX_BUCKETS', 62)  # Buckets per report, or per page with pageSize
+# With adaptive buckets (or adaptive=true on /reports), a report that would need more than REPORT_BUCKET_BUDGET
+# buckets is given weekly, monthly or yearly buckets instead
+REPORT_ADAPTIVE_BUCKETS = getattr(config, 'REPORT_ADAPTIVE_BUCKETS', False)
+REPORT_BUCKET_BUDGET = getattr(config, 'REPORT_BUCKET_BUDGET', REPORT_MAX_BUCKETS)
+BUCKET_CALENDAR_MAX_YEARS = getattr(config, 'BUCKET_CALENDAR_MAX_YEARS', 100)  # Years of bucket boundaries kept per size
+REPORT_CACHE_SIZE = getattr(config, 'REPORT_CACHE_SIZE', 10000)  # Finished report buckets kept in memory, 0 to disable
+REPORT_CACHE_MAX_ROWS = getattr(config, 'REPORT_CACHE_MAX_ROWS', 200000)  # Usage rows kept across those buckets
+# Buckets that ended less than this many seconds ago are always recomputed, to let late usage data arrive
+REPORT_CACHE_SAFETY_MARGIN = getattr(config, 'REPORT_CACHE_SAFETY_MARGIN', 86400)
 #FLASK_LOG_FILE = '/srv/billing-api/logs/billing.log'
 FLASK_LOG_FILE = config.FLASK_LOG_FILE
 BILLING_ROLE = config.BILLING_ROLE
@@ -51,3 +84,5 @@ PRICING_PERIODS = config.PRICING_PERIODS
 # 4. Discounts are only applicable to Invoice; the billing application UI will never have to show it
 # 5. Invoice periods and discount periods will always align
 DISCOUNTS = config.DISCOUNTS
+PRICE_CACHE_MAX_AGE = getattr(config, 'PRICE_CACHE_MAX_AGE', 3600)  # Seconds clients may reuse a /prices response
+METRICS_ALLOWED_ADDRESSES = getattr(config, 'METRICS_ALLOWED_ADDRESSES', ['127.0.0.1', '::1'])  # Who may scrape /metrics
@@ -0,0 +1,156 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import math
+import os
+import re
+from datetime import date, datetime
+
+import records
+from sqlalchemy import bindparam, event, text
+
+# The usage queries are written for MySQL. On SQLite, which is used to test and benchmark them without a
+# MySQL server, every connection gets the OpenStack databases attached under their MySQL names and the MySQL
+# functions the queries use, and statements and their parameters are translated before they run.
+SCHEMAS = ('nova', 'cinder', 'glance', 'keystone')
+
+TIME_UNITS = {
+    'SECOND': 1,
+    'MINUTE': 60,
+    'HOUR': 3600,
+    'DAY': 86400,
+    'WEEK': 604800,
+}
+
+# Datetimes bound as strings, optionally with a UTC offset, e.g. a report bucket's '2016-09-12 00:00:00-04:00'
+DATETIME_STRING = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}:\d{2}:\d{2}(?:\.\d+)?))?(?:Z|[+-]\d{2}:?\d{2})?$'
+)
+
+
+def prepare(engine):
+    # Called on every engine the pool creates; only SQLite engines need anything
+    if engine.dialect.name != 'sqlite':
+        return
+
+    directory = None
+
+    if engine.url.database and engine.url.database != ':memory:':
+        directory = os.path.dirname(os.path.abspath(engine.url.database))
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        register_functions(dbapi_connection)
+        attach_schemas(dbapi_connection, directory)
+
+
+def attach_schemas(dbapi_connection, directory=None):
+    # Each schema is a file next to the main database, or another in-memory database for an in-memory one
+    attached = set(row[1] for row in dbapi_connection.execute('PRAGMA database_list'))
+
+    for schema in SCHEMAS:
+        if schema not in attached:
+            path = os.path.join(directory, schema + '.sqlite') if directory else ':memory:'
+            dbapi_connection.execute('ATTACH DATABASE ? AS {}'.format(schema), (path,))
+
+
+def register_functions(dbapi_connection):
+    dbapi_connection.create_function('GREATEST', -1, greatest, deterministic=True)
+    dbapi_connection.create_function('LEAST', -1, least, deterministic=True)
+    dbapi_connection.create_function('CEIL', 1, ceil, deterministic=True)
+    dbapi_connection.create_function('POWER', 2, power, deterministic=True)
+    dbapi_connection.create_function('TIMESTAMPDIFF', 3, timestampdiff, deterministic=True)
+
+
+# Like MySQL's, these return NULL when any argument is NULL. DATETIME columns and bound datetimes are both
+# stored as 'YYYY-MM-DD HH:MM:SS' text on SQLite, so comparing them as strings compares them as times.
+def greatest(*args):
+    return None if any(arg is None for arg in args) else max(args)
+
+
+def least(*args):
+    return None if any(arg is None for arg in args) else min(args)
+
+
+def ceil(value):
+    return None if value is None else math.ceil(value)
+
+
+def power(base, exponent):
+    return None if base is None or exponent is None else float(base) ** exponent
+
+
+def timestampdiff(unit, start, end):
+    # Whole units from start to end, truncated toward zero like MySQL. It's returned as a float because MySQL
+    # divides it as a decimal, e.g. TIMESTAMPDIFF(SECOND, ...) / 3600, where SQLite would divide integers.
+    if start is None or end is None:
+        return None
+
+    seconds = int((as_datetime(end) - as_datetime(start)).total_seconds())
+    units = abs(seconds) // TIME_UNITS[unit.upper()]
+
+    return float(units if seconds >= 0 else -units)
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+
+    return datetime.fromisoformat(wall_clock(value))
+
+
+def wall_clock(value):
+    # MySQL reads a bound datetime as its wall-clock time and ignores any offset, and a bare date as midnight
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat(' ')
+
+    if isinstance(value, date):
+        return value.isoformat() + ' 00:00:00'
+
+    if isinstance(value, str):
+        match = DATETIME_STRING.match(value)
+
+        if match:
+            return '{} {}'.format(match.group(1), match.group(2) or '00:00:00')
+
+    return value
+
+
+def translate(sql):
+    # SQLite would read TIMESTAMPDIFF's unit as a column name, so it's passed as a string instead
+    return re.sub(r'TIMESTAMPDIFF\(\s*(\w+)\s*,', r"TIMESTAMPDIFF('\1',", sql)
+
+
+def execute(connection, sql, params):
+    # Runs a statement on a SQLAlchemy connection and returns all its rows as a records RecordCollection. List
+    # parameters are bound as expanding parameters, so IN :projects becomes IN (?, ?, ...) on every backend.
+    if connection.dialect.name == 'sqlite':
+        sql = translate(sql)
+        params = dict((name, [wall_clock(item) for item in value] if isinstance(value, (list, tuple))
+                       else wall_clock(value)) for name, value in params.items())
+
+    statement = text(sql).bindparams(*[
+        bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, (list, tuple))
+    ])
+    cursor = connection.execute(statement, params)
+
+    if not cursor.returns_rows:
+        return records.RecordCollection(iter([]))
+
+    keys = list(cursor.keys())
+    results = records.RecordCollection(records.Record(keys, row) for row in cursor)
+    results.all()
+
+    return results
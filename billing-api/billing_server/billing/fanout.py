@@ -0,0 +1,80 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# One thread pool per worker process, shared by every request. Its size is the global limit on queries
+# running at once; a request can be held to fewer than that with the limit passed to run_all.
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+_options = {
+    'max_workers': 8,
+}
+
+
+def configure(max_workers=None):
+    # Only affects a pool created after this call, so it should be called once at startup
+    with _lock:
+        if max_workers is not None:
+            _options['max_workers'] = max_workers
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    with _lock:
+        if _executor_pid != os.getpid():
+            # Threads don't survive a fork, so a pool inherited from the parent process is unusable
+            _executor = ThreadPoolExecutor(max_workers=_options['max_workers'], thread_name_prefix='fanout')
+            _executor_pid = os.getpid()
+
+        return _executor
+
+
+def run_all(tasks, limit):
+    # Runs the callables on the shared pool with at most limit of them in flight, and returns their results
+    # in the order the tasks were given. If a task raises, the tasks that haven't started are cancelled.
+    executor = get_executor()
+    results = [None] * len(tasks)
+    queued = iter(enumerate(tasks))
+    running = dict()
+
+    def submit_next():
+        for index, task in queued:
+            running[executor.submit(task)] = index
+            return
+
+    for _ in range(max(limit, 1)):
+        submit_next()
+
+    try:
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                results[running.pop(future)] = future.result()
+                submit_next()
+
+    except BaseException:
+        for future in running:
+            future.cancel()
+
+        raise
+
+    return results
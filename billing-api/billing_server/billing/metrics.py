@@ -0,0 +1,142 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+# Report requests fan out into many queries, so the buckets reach further than the client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Every label value comes from a fixed set (route endpoints, method names, call names), never from the request
+REQUEST_LATENCY = Histogram(
+    'billing_http_request_duration_seconds',
+    'Time spent answering a request, by Flask endpoint',
+    ['endpoint', 'method'],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    'billing_http_requests_total',
+    'Requests answered, by Flask endpoint and status code',
+    ['endpoint', 'method', 'status'],
+)
+QUERY_LATENCY = Histogram(
+    'billing_query_duration_seconds',
+    'Time spent in a Collaboratory method',
+    ['method'],
+    buckets=LATENCY_BUCKETS,
+)
+QUERY_ERRORS = Counter(
+    'billing_query_errors_total',
+    'Collaboratory methods that raised',
+    ['method'],
+)
+DEPENDENCY_LATENCY = Histogram(
+    'billing_dependency_duration_seconds',
+    'Time spent waiting on another service (keystone, invoice_api, graphite)',
+    ['dependency', 'call'],
+    buckets=LATENCY_BUCKETS,
+)
+DEPENDENCY_ERRORS = Counter(
+    'billing_dependency_errors_total',
+    'Calls to another service that raised',
+    ['dependency', 'call'],
+)
+
+REPORT_CACHE_LOOKUPS = Counter(
+    'billing_report_cache_lookups_total',
+    'Report buckets looked up in the report cache, by whether they were cached',
+    ['result'],
+)
+REPORT_CACHE_EVICTIONS = Counter(
+    'billing_report_cache_evictions_total',
+    'Report buckets evicted from the report cache to stay within its size',
+)
+REPORT_CACHE_INVALIDATIONS = Counter(
+    'billing_report_cache_invalidations_total',
+    'Report buckets dropped from the report cache because the rollup changed their days',
+)
+# Summed over the live workers under gunicorn
+REPORT_CACHE_ROWS = Gauge(
+    'billing_report_cache_rows',
+    'Usage rows held in the report cache',
+    multiprocess_mode='livesum',
+)
+
+
+@contextmanager
+def timed(histogram, errors, **labels):
+    started = time.perf_counter()
+
+    try:
+        yield
+
+    except BaseException:
+        errors.labels(**labels).inc()
+        raise
+
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+def dependency(name, call):
+    # Times a call to another service, e.g. with metrics.dependency('keystone', 'validate_token'): ...
+    return timed(DEPENDENCY_LATENCY, DEPENDENCY_ERRORS, dependency=name, call=call)
+
+
+def observed(func):
+    # Decorates a Collaboratory method so its latency is recorded under the method's name
+    @wraps(func)
+    def inner(*args, **kwargs):
+        with timed(QUERY_LATENCY, QUERY_ERRORS, method=func.__name__):
+            return func(*args, **kwargs)
+
+    return inner
+
+
+def init_app(app):
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+
+        if started is not None:
+            # Unmatched URLs all share one label rather than one per path tried
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+            REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+
+        return response
+
+
+def render():
+    # Returns the Prometheus text exposition and its content type. Under gunicorn every worker writes its
+    # samples to PROMETHEUS_MULTIPROC_DIR, and any worker answering the scrape merges all of them.
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
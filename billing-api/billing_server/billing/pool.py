@@ -0,0 +1,128 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from . import dialects
+
+# One engine per database url per worker process. Gunicorn forks its workers, and pooled
+# connections must never be shared across a fork, so the engines are keyed on the pid as well.
+_engines = {}
+_engines_pid = None
+_lock = threading.Lock()
+
+_options = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+    'pool_pre_ping': True,
+}
+
+_wait_stats = {
+    'count': 0,
+    'total': 0.0,
+    'max': 0.0,
+}
+
+
+def configure(pool_size=None, max_overflow=None, pool_timeout=None, pool_recycle=None, pool_pre_ping=None):
+    # Only affects engines created after this call, so it should be called once at startup
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pool_pre_ping,
+    }
+
+    with _lock:
+        _options.update({key: value for key, value in options.items() if value is not None})
+
+
+def get_engine(database_url):
+    global _engines_pid
+
+    with _lock:
+        if _engines_pid != os.getpid():
+            # Inherited from the parent process; leave its connections alone and start fresh
+            _engines.clear()
+            _engines_pid = os.getpid()
+
+        engine = _engines.get(database_url)
+
+        if engine is None:
+            engine = create_engine(database_url, **_engine_options(database_url))
+            dialects.prepare(engine)
+            _engines[database_url] = engine
+
+        return engine
+
+
+def connect(database_url):
+    engine = get_engine(database_url)
+
+    started = time.monotonic()
+    connection = engine.connect()
+    waited = time.monotonic() - started
+
+    with _lock:
+        _wait_stats['count'] += 1
+        _wait_stats['total'] += waited
+        _wait_stats['max'] = max(_wait_stats['max'], waited)
+
+    return connection, waited
+
+
+def status(database_url):
+    engine = get_engine(database_url)
+    pool = engine.pool
+    retval = {
+        'pool': pool.status(),
+        'waits': _wait_stats['count'],
+        'wait_seconds_total': round(_wait_stats['total'], 6),
+        'wait_seconds_max': round(_wait_stats['max'], 6),
+    }
+
+    # Occupancy is only meaningful for bounded queue pools; SQLite uses a singleton pool
+    if hasattr(pool, 'checkedout'):
+        retval['size'] = pool.size()
+        retval['checked_out'] = pool.checkedout()
+        retval['overflow'] = pool.overflow()
+
+    return retval
+
+
+def dispose():
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+        _engines.clear()
+
+
+def _engine_options(database_url):
+    options = dict(_options)
+
+    if make_url(database_url).get_backend_name() == 'sqlite':
+        # SQLite engines don't use a QueuePool, so the sizing options don't apply
+        return {'pool_pre_ping': options['pool_pre_ping']}
+
+    return options
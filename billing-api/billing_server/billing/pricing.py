@@ -0,0 +1,178 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import hashlib
+import json
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime
+
+from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
+
+PRICE_FIELDS = ('cpu_price', 'volume_price', 'image_price', 'object_storage_price')
+
+PricePeriod = namedtuple('PricePeriod', ('period_start', 'period_end') + PRICE_FIELDS)
+
+
+# PRICING_PERIODS compiled once at startup: the periods sorted by date, each a shared immutable PricePeriod, and the
+# /price response of each one serialised up front
+class PricingIndex:
+
+    def __init__(self, pricing_periods, timezone):
+        self.periods = compile_periods(pricing_periods, timezone)
+        self.period_ends = [period.period_end for period in self.periods]
+        self.price_json = {period: json.dumps(prices(period)) for period in self.periods}
+
+    def lookup(self, date):
+        # The first period that ends after the date; dates past the last period keep its prices
+        index = bisect_right(self.period_ends, date)
+
+        return self.periods[min(index, len(self.periods) - 1)]
+
+    def lookup_json(self, date):
+        return self.price_json[self.lookup(date)]
+
+
+# DISCOUNTS compiled once at startup. Each project's dated discounts become sorted, non-overlapping intervals
+# running from the first of their start month to the first of the month after their end month, so a lookup is a
+# bisect. A discount without dates is the project's default outside those intervals.
+class DiscountIndex:
+
+    def __init__(self, discounts, timezone):
+        self.projects = {
+            project_id: compile_discounts(project_id, project_discounts, timezone)
+            for project_id, project_discounts in discounts.items()
+        }
+
+    def lookup(self, project_id, date):
+        project = self.projects.get(project_id)
+
+        if project is None:
+            return 0
+
+        starts, ends, amounts, default = project
+        index = bisect_right(starts, date) - 1
+
+        if index >= 0 and date < ends[index]:
+            return amounts[index]
+
+        return default
+
+
+def compile_discounts(project_id, project_discounts, timezone):
+    # (starts, ends, amounts, default) for one project
+    default = 0
+    intervals = []
+
+    for discount in project_discounts:
+        if 'discount' not in discount:
+            raise ValueError('A discount of project {} has no discount amount'.format(project_id))
+
+        if not 0 <= discount['discount'] <= 1:
+            raise ValueError('Discounts of project {} must be between 0 and 1'.format(project_id))
+
+        if 'period_start' not in discount and 'period_end' not in discount:
+            default = discount['discount']
+            continue
+
+        start = month_start(discount['period_start'], timezone) if 'period_start' in discount else None
+        end = month_start(discount['period_end'], timezone, months=1) if 'period_end' in discount else None
+        intervals.append((start, end, discount['discount']))
+
+    # Open ends stretch as far as any date can go
+    lowest = timezone.localize(datetime.min + relativedelta(days=1))
+    highest = timezone.localize(datetime.max - relativedelta(days=1))
+    intervals = sorted((start or lowest, end or highest, amount) for start, end, amount in intervals)
+
+    for (start, end, amount), (next_start, next_end, next_amount) in zip(intervals, intervals[1:]):
+        if next_start < end:
+            raise ValueError('Discount periods of project {} overlap'.format(project_id))
+
+    for start, end, amount in intervals:
+        if end <= start:
+            raise ValueError('A discount period of project {} ends before it starts'.format(project_id))
+
+    return (
+        [start for start, end, amount in intervals],
+        [end for start, end, amount in intervals],
+        [amount for start, end, amount in intervals],
+        default,
+    )
+
+
+def month_start(month, timezone, months=0):
+    # Start of a 'YYYY-MM' month, or of the month that many months after it
+    year, month = month.split('-')[:2]
+
+    return timezone.localize(datetime(year=int(year), month=int(month), day=1) + relativedelta(months=months))
+
+
+def config_hash(pricing_periods, discounts):
+    # Changes whenever the pricing or discount config does, to version cached price responses
+    config = json.dumps({'pricing_periods': pricing_periods, 'discounts': discounts}, sort_keys=True, default=str)
+
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()
+
+
+def compile_periods(pricing_periods, timezone):
+    if not pricing_periods:
+        raise ValueError('PRICING_PERIODS must have at least one period')
+
+    periods = []
+    for index, period in enumerate(pricing_periods):
+        missing = [field for field in ('period_start', 'period_end') + PRICE_FIELDS if field not in period]
+
+        if missing:
+            raise ValueError('PRICING_PERIODS[{}] is missing {}'.format(index, ', '.join(missing)))
+
+        compiled = PricePeriod(
+            period_start=as_datetime(period['period_start'], timezone),
+            period_end=as_datetime(period['period_end'], timezone),
+            **{field: float(period[field]) for field in PRICE_FIELDS}
+        )
+
+        if compiled.period_start >= compiled.period_end:
+            raise ValueError('PRICING_PERIODS[{}] ends before it starts'.format(index))
+
+        if periods and compiled.period_start < periods[-1].period_end:
+            raise ValueError(
+                'PRICING_PERIODS[{}] starts before the previous period ends; periods must be sorted and must not '
+                'overlap'.format(index)
+            )
+
+        periods.append(compiled)
+
+    return tuple(periods)
+
+
+def as_datetime(value, timezone):
+    if isinstance(value, str):
+        value = parse(value)
+
+    # Dates without an offset are in the report timezone, whatever the server's own timezone is
+    if value.tzinfo is None:
+        return timezone.localize(value)
+
+    return value.astimezone(timezone)
+
+
+def prices(period):
+    return {
+        'cpuPrice': period.cpu_price,
+        'imagePrice': period.image_price,
+        'volumePrice': period.volume_price,
+        'objectsPrice': period.object_storage_price,
+    }
@@ -0,0 +1,119 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from . import dialects
+
+# Every statement Collaboratory runs is described by an entry, which is passed to the listeners and, when it took
+# at least the threshold, written to the slow query log as one line of JSON
+_options = {
+    'threshold': 2.0,
+}
+_listeners = []
+_lock = threading.Lock()
+
+_slow_log = logging.getLogger('billing.slow_queries')
+_slow_log.setLevel(logging.INFO)
+_slow_log.propagate = False
+
+# What the slow query log keeps of an entry; the SQL and its parameters are only handed to listeners
+LOGGED_FIELDS = ('method', 'duration', 'rows', 'in_lists', 'buckets', 'start_date', 'end_date')
+
+
+def configure(threshold=2.0, path=None):
+    # threshold is in seconds, None turns the slow query log off. Without a path, slow queries go to the logger
+    # of the Collaboratory that ran them.
+    with _lock:
+        _options['threshold'] = threshold
+
+        for handler in list(_slow_log.handlers):
+            _slow_log.removeHandler(handler)
+            handler.close()
+
+        if path:
+            _slow_log.addHandler(RotatingFileHandler(path, maxBytes=10000000, backupCount=3))
+
+
+def add_listener(listener):
+    # listener(entry) is called after every statement, on the thread that ran it
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _lock:
+        _listeners.remove(listener)
+
+
+def execute(method, connection, sql, params, logger=None):
+    # Runs a statement through the dialect layer and records it under the given name. The rows are fetched before
+    # returning, so the time includes reading them.
+    started = time.perf_counter()
+    results = dialects.execute(connection, sql, params)
+    duration = time.perf_counter() - started
+
+    record(describe(method, sql, params, duration, len(results)), logger)
+
+    return results
+
+
+def describe(method, sql, params, duration, rows):
+    # Summarises the shape of a statement: how long its IN lists were, how many report buckets it covered
+    # and the date range it was bound to
+    in_lists = {name: len(value) for name, value in params.items() if isinstance(value, (list, tuple))}
+    bucket_starts = [value for name, value in params.items() if name.startswith('bucket_start_')]
+    bucket_ends = [value for name, value in params.items() if name.startswith('bucket_end_')]
+
+    return {
+        'method': method,
+        'duration': round(duration, 4),
+        'rows': rows,
+        'in_lists': in_lists,
+        'buckets': len(bucket_starts) or None,
+        'start_date': params.get('start_date', min(bucket_starts, default=None)),
+        'end_date': params.get('end_date', max(bucket_ends, default=None)),
+        'sql': sql,
+        'params': params,
+    }
+
+
+def record(entry, logger=None):
+    with _lock:
+        listeners = list(_listeners)
+        threshold = _options['threshold']
+
+    for listener in listeners:
+        listener(entry)
+
+    if threshold is None or entry['duration'] < threshold:
+        return
+
+    line = dict((field, entry[field]) for field in LOGGED_FIELDS)
+    line['time'] = datetime.now().isoformat()
+    line['pid'] = os.getpid()
+    line = json.dumps(line, default=str, sort_keys=True)
+
+    if _slow_log.handlers or logger is None:
+        _slow_log.info(line)
+
+    else:
+        logger.warning('Slow query: ' + line)
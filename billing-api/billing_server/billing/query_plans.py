@@ -0,0 +1,201 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import re
+
+from . import dialects, query_log
+
+# Indexes that would serve the usage queries' filters: the project IN lists first, then the lifetime range.
+# One is only suggested for a table the plan scans in full and that has no index starting with the same column.
+SUGGESTED_INDEXES = {
+    'nova.instances': ('project_id', 'created_at', 'deleted_at'),
+    'cinder.volumes': ('project_id', 'created_at', 'deleted_at'),
+    'glance.images': ('owner', 'created_at', 'deleted_at'),
+    'keystone.assignment': ('actor_id', 'role_id'),
+}
+
+# The plan columns shown in the report. Row estimates are left out since they move with the data, which would
+# make two reports of the same plans differ.
+PLAN_COLUMNS = ('id', 'select_type', 'table', 'type', 'key', 'ref', 'Extra')
+
+# What is flagged in a plan, by kind
+FINDINGS = {
+    'full_scan': 'full table scan of {}',
+    'index_scan': 'full index scan of {}',
+    'filesort': 'filesort for {}',
+    'temporary': 'temporary table for {}',
+}
+
+
+def capture(func, *args, **kwargs):
+    # Calls a Collaboratory method and returns the query_log entries of the statements it ran
+    entries = []
+    query_log.add_listener(entries.append)
+
+    try:
+        func(*args, **kwargs)
+
+    finally:
+        query_log.remove_listener(entries.append)
+
+    return entries
+
+
+def analyze_prefix(version):
+    # MariaDB runs and measures a statement with ANALYZE, MySQL with EXPLAIN ANALYZE from 8.0.18
+    if 'mariadb' in version.lower():
+        return 'ANALYZE'
+
+    numbers = re.match(r'(\d+)\.(\d+)\.(\d+)', version)
+
+    if numbers and tuple(int(number) for number in numbers.groups()) >= (8, 0, 18):
+        return 'EXPLAIN ANALYZE'
+
+    return None
+
+
+def explain(connection, entry, analyze_with=None):
+    # Runs through the dialect layer, which binds the IN lists, but not through query_log, so the EXPLAIN itself
+    # isn't captured or logged as a query
+    sql = entry['sql'].strip().rstrip(';')
+    plan = dialects.execute(connection, 'EXPLAIN ' + sql, entry['params']).all(as_dict=True)
+    analyzed = None
+
+    if analyze_with is not None:
+        analyzed = dialects.execute(connection, analyze_with + ' ' + sql, entry['params']).all(as_dict=True)
+
+    return plan, analyzed
+
+
+def qualified_table(sql, table):
+    # EXPLAIN names tables without their database, so it's looked up in the statement
+    match = re.search(r'\b(\w+)\.' + re.escape(table) + r'\b', sql)
+
+    return '{}.{}'.format(match.group(1), table) if match else table
+
+
+def findings(sql, plan):
+    # Returns (kind, table) pairs for the full scans, filesorts and temporary tables in a plan
+    found = []
+
+    for row in plan:
+        table = row.get('table') or ''
+        extra = row.get('Extra') or ''
+
+        # Derived tables and unions are always read in full once materialized
+        if table and not table.startswith('<'):
+            if row.get('type') == 'ALL':
+                found.append(('full_scan', qualified_table(sql, table)))
+
+            elif row.get('type') == 'index':
+                found.append(('index_scan', qualified_table(sql, table)))
+
+        if 'Using filesort' in extra:
+            found.append(('filesort', table))
+
+        if 'Using temporary' in extra:
+            found.append(('temporary', table))
+
+    return found
+
+
+def suggest_indexes(found, existing):
+    # existing maps a qualified table name to the column lists of its indexes
+    suggestions = []
+
+    for kind, table in found:
+        columns = SUGGESTED_INDEXES.get(table)
+
+        if kind not in ('full_scan', 'index_scan') or columns is None:
+            continue
+
+        if any(index[:1] == columns[:1] for index in existing.get(table, [])):
+            continue
+
+        statement = 'CREATE INDEX billing_{} ON {} ({});'.format('_'.join(columns), table, ', '.join(columns))
+
+        if statement not in suggestions:
+            suggestions.append(statement)
+
+    return suggestions
+
+
+def existing_indexes(connection, schemas):
+    rows = dialects.execute(
+        connection,
+        '''
+        SELECT table_schema, table_name, index_name, column_name
+        FROM information_schema.statistics
+        WHERE table_schema IN :schemas
+        ORDER BY table_schema, table_name, index_name, seq_in_index
+        ''',
+        {'schemas': list(schemas)}
+    ).all(as_dict=True)
+
+    indexes = {}
+
+    for row in rows:
+        row = dict((key.lower(), value) for key, value in row.items())
+        table = '{}.{}'.format(row['table_schema'], row['table_name'])
+        indexes.setdefault((table, row['index_name']), []).append(row['column_name'])
+
+    existing = {}
+
+    for (table, index_name), columns in indexes.items():
+        existing.setdefault(table, []).append(tuple(columns))
+
+    return existing
+
+
+def format_plan(plan, columns=PLAN_COLUMNS):
+    rows = [[str(row.get(column) if row.get(column) is not None else '-') for column in columns] for row in plan]
+    widths = [max(len(value) for value in values) for values in zip(columns, *rows)]
+
+    return [
+        '  '.join(value.ljust(width) for value, width in zip(values, widths)).rstrip()
+        for values in [list(columns)] + rows
+    ]
+
+
+def format_report(reports):
+    # reports is a list of (label, plan, found, suggestions, analyzed) in a fixed order, so the text of two runs
+    # over the same schema only differs where a plan does
+    lines = []
+
+    for label, plan, found, suggestions, analyzed in reports:
+        lines.append('== ' + label)
+        lines.extend(format_plan(plan))
+
+        for kind, table in found:
+            lines.append('! ' + FINDINGS[kind].format(table))
+
+        for statement in suggestions:
+            lines.append('+ ' + statement)
+
+        if analyzed is not None:
+            lines.append('-- analyzed (timings vary between runs)')
+            lines.extend(format_analyzed(analyzed))
+
+        lines.append('')
+
+    return '\n'.join(lines)
+
+
+def format_analyzed(analyzed):
+    # MySQL returns one row holding the whole plan tree as text, MariaDB returns a plan table with actual rows
+    if len(analyzed) == 1 and len(analyzed[0]) == 1:
+        return list(analyzed[0].values())[0].splitlines()
+
+    return format_plan(analyzed, PLAN_COLUMNS + ('rows', 'r_rows', 'r_filtered'))
@@ -0,0 +1,117 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+from collections import OrderedDict, namedtuple
+
+# Identifies the usage of one bucket of one report. Everything that decides which rows a report can see is
+# part of the key, so two users only ever share an entry if they would have run the exact same queries.
+ReportCacheKey = namedtuple('ReportCacheKey', [
+    'requester',
+    'billing_projects',
+    'user_projects',
+    'user',
+    'bucket_size',
+    'start_date',
+    'end_date',
+])
+
+
+# Usage rows of report buckets that are over and can't change any more, evicted least recently used first. The
+# cache is bounded by both the number of buckets and the total number of rows across them, since one bucket of a
+# report on many projects can hold thousands of rows.
+class ReportCache:
+
+    def __init__(self, max_entries=10000, max_rows=200000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            rows = self.entries.get(key)
+
+            if rows is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return rows
+
+    def put(self, key, rows):
+        # Returns how many entries were evicted to make room. A bucket with more rows than the whole cache may hold
+        # isn't cached at all.
+        if self.max_entries <= 0 or len(rows) > self.max_rows:
+            return 0
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+
+            if previous is not None:
+                self.rows -= len(previous)
+
+            self.entries[key] = rows
+            self.rows += len(rows)
+
+            evictions = 0
+
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                _, evicted = self.entries.popitem(last=False)
+                self.rows -= len(evicted)
+                evictions += 1
+
+            self.evictions += evictions
+
+            return evictions
+
+    def invalidate(self, predicate=None):
+        # Drops every entry, or only the ones the predicate returns True for; returns how many were dropped
+        with self.lock:
+            if predicate is None:
+                dropped = len(self.entries)
+                self.entries.clear()
+                self.rows = 0
+                return dropped
+
+            keys = [key for key in self.entries if predicate(key)]
+
+            for key in keys:
+                self.rows -= len(self.entries.pop(key))
+
+            return len(keys)
+
+    def invalidate_range(self, start_date, end_date):
+        # Drops every bucket overlapping [start_date, end_date), e.g. after correcting usage for those dates
+        return self.invalidate(lambda key: key.start_date < end_date and key.end_date > start_date)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'entries': len(self.entries),
+                'rows': self.rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
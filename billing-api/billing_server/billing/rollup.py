@@ -0,0 +1,390 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+from .utils import parsing
+
+RESOURCES = ('cpu', 'volume', 'image')
+
+rollup_schema = '''
+  CREATE TABLE IF NOT EXISTS usage_rollup
+  (
+    resource    TEXT     NOT NULL,
+    day         TEXT     NOT NULL,
+    user_id     TEXT     NOT NULL,
+    project_id  TEXT     NOT NULL,
+    quantity    INTEGER  NOT NULL,
+    PRIMARY KEY (resource, day, user_id, project_id)
+  );
+  '''
+
+rollup_watermarks_schema = '''
+  CREATE TABLE IF NOT EXISTS rollup_watermarks
+  (
+    resource    TEXT     NOT NULL PRIMARY KEY,
+    watermark   TEXT     NOT NULL
+  );
+  '''
+
+rollup_days_schema = '''
+  CREATE TABLE IF NOT EXISTS rollup_days
+  (
+    resource    TEXT     NOT NULL,
+    day         TEXT     NOT NULL,
+    PRIMARY KEY (resource, day)
+  );
+  '''
+
+# When each day's stored usage last changed, so the web workers can drop cached report buckets covering it
+rollup_changes_schema = '''
+  CREATE TABLE IF NOT EXISTS rollup_changes
+  (
+    day         TEXT     NOT NULL PRIMARY KEY,
+    changed_at  REAL     NOT NULL
+  );
+  '''
+
+
+# Per (user, project, day) usage quantities, precomputed from the OpenStack databases into a local SQLite file.
+# Each day is rated exactly like a daily bucket of a report, so daily buckets read from the store match the live
+# queries. Longer buckets are always queried live: the live queries round every instance's, volume's and image's
+# hours up once per bucket, and summing days that were each rounded up would bill partial hours once per day.
+class RollupStore:
+
+    def __init__(self, path, timezone, logger=None):
+        self.path = path
+        self.timezone = timezone
+        self.logger = logger or logging.getLogger(__name__)
+
+        with self.connect() as connection:
+            connection.execute(rollup_schema)
+            connection.execute(rollup_days_schema)
+            connection.execute(rollup_watermarks_schema)
+            connection.execute(rollup_changes_schema)
+
+    def connect(self):
+        # A connection per call keeps the store safe to share between request threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def day_bucket(self, day):
+        start_date = self.timezone.localize(datetime(year=day.year, month=day.month, day=day.day))
+        next_day = day + timedelta(days=1)
+        end_date = self.timezone.localize(datetime(year=next_day.year, month=next_day.month, day=next_day.day))
+
+        return start_date.isoformat(' '), end_date.isoformat(' ')
+
+    def bucket_days(self, start_date, end_date):
+        # The days making up a bucket, or None if the bucket doesn't start and end on local midnights
+        start_date = parse(start_date).astimezone(self.timezone)
+        end_date = parse(end_date).astimezone(self.timezone)
+
+        for date in (start_date, end_date):
+            if (date.hour, date.minute, date.second, date.microsecond) != (0, 0, 0, 0):
+                return None
+
+        days = []
+        day = start_date.date()
+
+        while day < end_date.date():
+            days.append(day.isoformat())
+            day += timedelta(days=1)
+
+        return days
+
+    def covered_buckets(self, resource, buckets):
+        # {[bucket index]: [day]} for every bucket that is exactly one day the store has computed
+        bucket_days = {}
+
+        for index, (start_date, end_date) in enumerate(buckets):
+            days = self.bucket_days(start_date, end_date)
+
+            if days and len(days) == 1:
+                bucket_days[index] = days
+
+        if not bucket_days:
+            return {}
+
+        all_days = [day for days in bucket_days.values() for day in days]
+
+        with self.connect() as connection:
+            covered = set(day for (day,) in connection.execute(
+                'SELECT day FROM rollup_days WHERE resource = ? AND day >= ? AND day <= ?',
+                (resource, min(all_days), max(all_days))
+            ))
+
+        return {
+            index: days
+            for index, days in bucket_days.items()
+            if all(day in covered for day in days)
+        }
+
+    def sum_buckets(self, resource, bucket_days, billing_projects, user_projects, user_id):
+        if not bucket_days:
+            return []
+
+        day_buckets = {day: index for index, days in bucket_days.items() for day in days}
+        project_filter, project_params = self.project_filter(resource, billing_projects, user_projects, user_id)
+
+        with self.connect() as connection:
+            results = connection.execute(
+                '''
+                SELECT day, user_id, project_id, quantity
+                FROM usage_rollup
+                WHERE resource = ? AND day >= ? AND day <= ? AND {project_filter}
+                ORDER BY day, user_id, project_id
+                '''.format(project_filter=project_filter),
+                [resource, min(day_buckets), max(day_buckets)] + project_params
+            ).fetchall()
+
+        totals = {}
+        for day, user, project_id, quantity in results:
+            if day in day_buckets:
+                key = (day_buckets[day], user, project_id)
+                totals[key] = totals.get(key, 0) + quantity
+
+        rows = []
+        for (index, user, project_id), quantity in totals.items():
+            row = {'bucket': index, 'projectId': project_id, resource: quantity}
+
+            # Images belong to projects, not users
+            if resource != 'image':
+                row['user'] = user
+
+            rows.append(row)
+
+        return rows
+
+    @staticmethod
+    def project_filter(resource, billing_projects, user_projects, user_id):
+        if billing_projects is None:
+            return '1 = 1', []
+
+        if resource == 'image':
+            return 'project_id IN ({})'.format(placeholders(billing_projects)), list(billing_projects)
+
+        return (
+            '(project_id IN ({}) OR (user_id = ? AND project_id IN ({})))'.format(
+                placeholders(billing_projects),
+                placeholders(user_projects)
+            ),
+            list(billing_projects) + [user_id] + list(user_projects)
+        )
+
+    def store_days(self, resource, days, rows, complete=True):
+        # Replaces everything stored for the given days. Only complete days are marked as computed and used for
+        # reports; today is stored so the next run can diff against it, but reports keep querying it live.
+        with self.connect() as connection:
+            connection.executemany(
+                'DELETE FROM usage_rollup WHERE resource = ? AND day = ?',
+                [(resource, day) for day in days]
+            )
+            connection.executemany(
+                'INSERT INTO usage_rollup (resource, day, user_id, project_id, quantity) VALUES (?, ?, ?, ?, ?)',
+                [(resource, day, user or '', project_id, quantity) for day, user, project_id, quantity in rows]
+            )
+
+            if complete:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO rollup_days (resource, day) VALUES (?, ?)',
+                    [(resource, day) for day in days]
+                )
+
+    def stored_rows(self, resource, days):
+        with self.connect() as connection:
+            results = connection.execute(
+                'SELECT day, user_id, project_id, quantity FROM usage_rollup WHERE resource = ? AND day >= ? AND day <= ?',
+                (resource, min(days), max(days))
+            ).fetchall()
+
+        return {(day, user, project_id): quantity for day, user, project_id, quantity in results if day in days}
+
+    def record_changes(self, days):
+        # All the days of one run share a timestamp, so a reader never sees only part of a run as new
+        if not days:
+            return
+
+        changed_at = time.time()
+
+        with self.connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO rollup_changes (day, changed_at) VALUES (?, ?)',
+                [(day, changed_at) for day in sorted(set(days))]
+            )
+
+    def changed_days(self, since):
+        # ([day], time of the latest change) for the days changed after since, a time.time() value
+        with self.connect() as connection:
+            results = connection.execute(
+                'SELECT day, changed_at FROM rollup_changes WHERE changed_at > ? ORDER BY day',
+                (since,)
+            ).fetchall()
+
+        return [day for day, changed_at in results], max([changed_at for day, changed_at in results], default=since)
+
+    # Watermarks are wall-clock times in the report timezone, formatted like the database's DATETIME columns,
+    # which is how the usage queries compare bucket boundaries against created_at and deleted_at
+    def get_watermark(self, resource):
+        with self.connect() as connection:
+            result = connection.execute(
+                'SELECT watermark FROM rollup_watermarks WHERE resource = ?', (resource,)
+            ).fetchone()
+
+        return parse(result[0]) if result else None
+
+    def set_watermark(self, resource, watermark):
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO rollup_watermarks (resource, watermark) VALUES (?, ?)',
+                (resource, watermark.strftime('%Y-%m-%d %H:%M:%S'))
+            )
+
+    def rate_days(self, database, days):
+        # {[resource]: [(day, user, project_id, quantity)]} for the given days, from the OpenStack databases
+        buckets = [self.day_bucket(day) for day in days]
+        day_names = [day.isoformat() for day in days]
+        queries = {
+            'cpu': lambda: database.query_instance_core_hours_by_bucket(buckets, None, None, None),
+            'volume': lambda: database.query_volume_gigabyte_hours_by_bucket(buckets, None, None, None),
+            'image': lambda: database.query_image_storage_gigabyte_hours_by_bucket(buckets, None),
+        }
+
+        rated = {}
+        for resource in RESOURCES:
+            rated[resource] = [
+                (
+                    day_names[row['bucket']],
+                    row.get('user'),
+                    row['projectId'],
+                    parsing.parse_decimal(row[resource])
+                )
+                for row in queries[resource]()
+            ]
+
+        return rated
+
+    def rebuild(self, database, first_day, last_day, chunk_days=31):
+        # Recomputes every day from first_day to last_day inclusive, a chunk of days per query
+        total = 0
+
+        for days in day_chunks(first_day, last_day, chunk_days):
+            rated = self.rate_days(database, days)
+
+            for resource in RESOURCES:
+                self.store_days(resource, [day.isoformat() for day in days], rated[resource])
+                total += len(rated[resource])
+
+            self.record_changes([day.isoformat() for day in days])
+
+            self.logger.info('Rolled up {} to {}'.format(days[0].isoformat(), days[-1].isoformat()))
+
+        # Everything up to the end of last_day is now accounted for, so incremental updates can start from there
+        next_day = last_day + timedelta(days=1)
+        end_of_last_day = datetime(year=next_day.year, month=next_day.month, day=next_day.day)
+
+        for resource in RESOURCES:
+            watermark = self.get_watermark(resource)
+
+            if watermark is None or watermark < end_of_last_day:
+                self.set_watermark(resource, end_of_last_day)
+
+        return total
+
+    def update(self, database, now=None, dry_run=False, chunk_days=31):
+        # Re-rates only the days touched since the last run: from the earliest day affected by an instance, volume
+        # or image created, deleted or updated after the watermark, through today. An update in place, such as a
+        # vm_state change or a resize, goes back to the day the row was created. Anything still running only
+        # changes today's usage, so a run with no new changes recomputes today alone.
+        now = (now or datetime.now(self.timezone)).astimezone(self.timezone)
+        today = now.date()
+        summary = {'days': 0, 'changed': {}, 'open': {}}
+        first_day = today
+
+        for resource in RESOURCES:
+            watermark = self.get_watermark(resource)
+
+            if watermark is None:
+                raise ValueError('No rollup watermark for {}; rebuild a range of days first'.format(resource))
+
+            changes = database.get_usage_changes_since(resource, watermark.strftime('%Y-%m-%d %H:%M:%S'))
+            summary['open'][resource] = parsing.parse_decimal(changes['open'])
+
+            first_day = min(first_day, watermark.date())
+
+            if changes['earliest'] is not None:
+                first_day = min(first_day, parse(str(changes['earliest'])).date())
+
+        changed_days = set()
+
+        for days in day_chunks(first_day, today, chunk_days):
+            rated = self.rate_days(database, days)
+            day_names = [day.isoformat() for day in days]
+            closed_days = [day for day in day_names if day != today.isoformat()]
+            summary['days'] += len(days)
+
+            for resource in RESOURCES:
+                stored = self.stored_rows(resource, day_names)
+                new = {(day, user or '', project_id): quantity for day, user, project_id, quantity in rated[resource]}
+                changed = [key for key in set(stored) | set(new) if stored.get(key) != new.get(key)]
+                summary['changed'][resource] = summary['changed'].get(resource, 0) + len(changed)
+
+                if dry_run:
+                    continue
+
+                self.store_days(resource, closed_days, [row for row in rated[resource] if row[0] in closed_days])
+                changed_days.update(key[0] for key in changed if key[0] in closed_days)
+
+                if today.isoformat() in day_names:
+                    self.store_days(
+                        resource,
+                        [today.isoformat()],
+                        [row for row in rated[resource] if row[0] == today.isoformat()],
+                        complete=False
+                    )
+
+        if not dry_run:
+            self.record_changes(changed_days)
+
+            for resource in RESOURCES:
+                self.set_watermark(resource, now.replace(tzinfo=None))
+
+        self.logger.info('Rollup update from {} ({}): {}'.format(
+            first_day.isoformat(),
+            'dry run' if dry_run else 'applied',
+            summary
+        ))
+
+        return summary
+
+
+def day_chunks(first_day, last_day, chunk_days):
+    day = first_day
+
+    while day <= last_day:
+        days = []
+        while day <= last_day and len(days) < chunk_days:
+            days.append(day)
+            day += timedelta(days=1)
+
+        yield days
+
+
+def placeholders(values):
+    return ', '.join('?' for value in values) or "''"
@@ -14,7 +14,6 @@
 # IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import json
 from flask import abort
 
 
@@ -41,9 +40,10 @@ def get_billing_info(user_id, invoice_role, database, logger):
 def get_billing_map(database):
         project_map = get_project_name_map(database)
         billing_maps = list(get_project_billing_map(database))
+        user_extras = database.get_users_extras([entry.get('user_id') for entry in billing_maps])
         for entry in billing_maps:
             entry['project_name'] = project_map.get(entry.get('project_id'))
-            entry['extra'] = json.loads(database.get_user_extras(entry.get('user_id')).get('extra'))
+            entry['extra'] = user_extras.get(entry.get('user_id'))
         return billing_maps
 
 
@@ -60,9 +60,8 @@ def get_project_billing_map(database):
     return map(lambda r: {'project_id': r.project_id, 'user_id': r.user_id}, project_map)
 
 def get_user_email(user_id,database):
-    user_email = database.get_user_extras(user_id).get('extra')
+    user_email = database.get_users_extras([user_id]).get(user_id)
     if user_email is None or user_email == "": return user_email
-    user_email = json.loads(user_email)
     if "email" in user_email.keys():
         user_email = user_email["email"]
     return user_email
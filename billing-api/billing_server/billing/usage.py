@@ -0,0 +1,51 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# The pricing period field each resource is billed with
+PRICE_FIELDS = {
+    'cpu': 'cpu_price',
+    'volume': 'volume_price',
+    'image': 'image_price',
+    'objects': 'object_storage_price',
+}
+
+
+# One usage row of a report: a quantity of one resource used by a user (None for storage, which is billed per
+# project) in one project during one bucket. Dates and prices are read through the shared Bucket rather than copied
+# into every row, and slots keep each record a fraction of the size of the dict it replaces.
+class UsageRecord:
+    __slots__ = ('bucket', 'resource', 'user', 'project_id', 'username', 'quantity')
+
+    def __init__(self, bucket, resource, user, project_id, username, quantity):
+        self.bucket = bucket
+        self.resource = resource
+        self.user = user
+        self.project_id = project_id
+        self.username = username
+        self.quantity = quantity
+
+    @property
+    def price(self):
+        return getattr(self.bucket.period, PRICE_FIELDS[self.resource])
+
+    def __eq__(self, other):
+        return isinstance(other, UsageRecord) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__
+        )
+
+    def __repr__(self):
+        return 'UsageRecord({})'.format(', '.join(
+            '{}={!r}'.format(field, getattr(self, field)) for field in self.__slots__
+        ))
@@ -13,32 +13,51 @@
 # OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
 # IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import json
 import time
+from bisect import bisect_right
 from datetime import datetime
+import numpy
 import records
 import requests
 from dateutil.parser import parse
+from . import metrics, pool, query_log, user_directory
 from .utils import parsing
 
 
 # TODO: Make this not use Records, as Records caches responses
 class Collaboratory:
 
-    def __init__(self, database_url, graphite_url, logger, billing_role='billing', initialized=True):
+    def __init__(self, database_url, graphite_url, logger, billing_role='billing', initialized=True, rollup=None,
+                 engine='sql'):
         self.billing_role = billing_role
+        self.rollup = rollup
+        self.engine = engine  # 'sql' rates usage in MySQL, 'sweep' fetches lifetimes and rates them with NumPy
         self.logger = logger
         logger.info('Acquiring database')
-        self.database = records.Database(database_url)
+        # Borrow a connection from the worker's pool rather than opening a new one per request
+        connection, waited = pool.connect(database_url)
+        self.connection = connection
+        self.database = records.Connection(connection)
         self.graphite_url = graphite_url
-        logger.info('Successfully connected to database')
-        self.user_map = {}
+        logger.info('Successfully connected to database in {:.3f}s: {}'.format(waited, pool.status(database_url)))
+        # Usernames are shared by every request in the worker rather than loaded per Collaboratory
+        self.users = user_directory.get_directory(database_url, logger)
+        self.user_extras = {}  # {[user_id]: decoded keystone.user.extra}, for the lifetime of this Collaboratory
         if initialized:
-            self.refresh_user_id_map()
+            self.users.load()
 
     def close(self):
-        if hasattr(self, 'database'):
+        # Returns the connection to the pool
+        if hasattr(self, 'database') and self.database.open:
             self.database.close()
 
+    def _query(self, name, sql, **params):
+        # Every statement goes through here so it can be timed and described to query_log under the name of the
+        # Collaboratory method that ran it
+        return query_log.execute(name, self.connection, sql, params, self.logger)
+
+    @metrics.observed
     def get_instance_core_hours(self, start_date, end_date, billing_projects, user_projects, user_id):
 
         # SQL doesn't like empty lists, so we ensure the invalid project_id of '' populates the list if it's empty
@@ -48,7 +67,8 @@ class Collaboratory:
         if not user_projects:
             user_projects.append('')
 
-        results = self.database.query(
+        results = self._query(
+            'get_instance_core_hours',
             '''
             SELECT
               user_id as user,
@@ -104,6 +124,7 @@ class Collaboratory:
 
         return results.all(as_dict=True)
 
+    @metrics.observed
     def get_volume_gigabyte_hours(self, start_date, end_date, billing_projects, user_projects, user_id):
 
         # SQL doesn't like empty lists, so we ensure the invalid project_id of '' populates the list if it's empty
@@ -113,7 +134,8 @@ class Collaboratory:
         if not user_projects:
             user_projects.append('')
 
-        results = self.database.query(
+        results = self._query(
+            'get_volume_gigabyte_hours',
             '''
             SELECT
               user_id as user,
@@ -165,11 +187,13 @@ class Collaboratory:
 
         return results.all(as_dict=True)
 
+    @metrics.observed
     def get_image_storage_gigabyte_hours_by_project(self, start_date, end_date, projects):
         if not projects:
             projects.append('')
 
-        results = self.database.query(
+        results = self._query(
+            'get_image_storage_gigabyte_hours_by_project',
             '''
             SELECT
               CEIL(
@@ -211,6 +235,470 @@ class Collaboratory:
             projects=projects)
         return results.all(as_dict=True)
 
+    # The *_by_bucket queries answer a whole report in one statement per resource. The bucket boundaries are
+    # joined in as a derived table, so every row is clipped and rounded against its own bucket exactly like the
+    # single range queries above, and each result row carries the index of the bucket it belongs to.
+    # Passing None for the projects reports on every project, which is how the rollup store is filled.
+    @metrics.observed
+    def get_instance_core_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if self.engine == 'sweep':
+            query = self.sweep_instance_core_hours_by_bucket
+
+        else:
+            query = self.query_instance_core_hours_by_bucket
+
+        return self._by_bucket(
+            'cpu',
+            lambda subset: query(subset, billing_projects, user_projects, user_id),
+            buckets,
+            billing_projects,
+            user_projects,
+            user_id
+        )
+
+    @metrics.observed
+    def get_volume_gigabyte_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if self.engine == 'sweep':
+            query = self.sweep_volume_gigabyte_hours_by_bucket
+
+        else:
+            query = self.query_volume_gigabyte_hours_by_bucket
+
+        return self._by_bucket(
+            'volume',
+            lambda subset: query(subset, billing_projects, user_projects, user_id),
+            buckets,
+            billing_projects,
+            user_projects,
+            user_id
+        )
+
+    @metrics.observed
+    def get_image_storage_gigabyte_hours_by_bucket(self, buckets, projects):
+        if self.engine == 'sweep':
+            query = self.sweep_image_storage_gigabyte_hours_by_bucket
+
+        else:
+            query = self.query_image_storage_gigabyte_hours_by_bucket
+
+        return self._by_bucket(
+            'image',
+            lambda subset: query(subset, projects),
+            buckets,
+            projects,
+            None,
+            None
+        )
+
+    def _by_bucket(self, resource, query, buckets, billing_projects, user_projects, user_id):
+        if self.rollup is None or not buckets:
+            return query(buckets)
+
+        # Daily buckets the rollup store has already computed are read from there; only the rest, longer buckets
+        # and typically the bucket containing today, go to the database
+        rollup_days = self.rollup.covered_buckets(resource, buckets)
+        remaining = [index for index in range(len(buckets)) if index not in rollup_days]
+
+        rows = self.rollup.sum_buckets(resource, rollup_days, billing_projects, user_projects, user_id)
+
+        if remaining:
+            for row in query([buckets[index] for index in remaining]):
+                row['bucket'] = remaining[row['bucket']]
+                rows.append(row)
+
+        rows.sort(key=lambda row: (row['bucket'], row.get('user') or '', row['projectId']))
+
+        return rows
+
+    def _project_filter(self, billing_projects, user_projects, user_id):
+        if billing_projects is None:
+            return '1 = 1', {}
+
+        # SQL doesn't like empty lists, so we ensure the invalid project_id of '' populates the list if it's empty
+        if not billing_projects:
+            billing_projects.append('')
+
+        if not user_projects:
+            user_projects.append('')
+
+        return (
+            '''(
+                project_id IN :billing_projects OR
+                (
+                  user_id    =  :user_id      AND
+                  project_id IN :user_projects
+                )
+              )''',
+            {
+                'billing_projects': billing_projects,
+                'user_projects': user_projects,
+                'user_id': user_id,
+            }
+        )
+
+    def _owner_filter(self, projects):
+        if projects is None:
+            return '1 = 1', {}
+
+        if not projects:
+            projects.append('')
+
+        return 'owner IN :projects', {'projects': projects}
+
+    @metrics.observed
+    def query_instance_core_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._project_filter(billing_projects, user_projects, user_id)
+        bucket_table, bucket_params = self._bucket_table(buckets)
+
+        results = self._query(
+            'query_instance_core_hours_by_bucket',
+            '''
+            SELECT
+              buckets.bucket AS bucket,
+              user_id as user,
+              project_id as projectId,
+              SUM(
+                CEIL(
+                  TIMESTAMPDIFF(
+                    SECOND,
+                    GREATEST(
+                      buckets.start_date,
+                      created_at
+                    ),
+                    LEAST(
+                      buckets.end_date,
+                      COALESCE(
+                        deleted_at,
+                        buckets.end_date
+                      )
+                    )
+                  ) / 3600
+                ) * vcpus
+              ) AS cpu
+
+            FROM
+              nova.instances
+              JOIN
+              (
+                {bucket_table}
+              ) AS buckets
+              ON
+                (
+                  deleted_at >  buckets.start_date  OR
+                  deleted_at IS NULL
+                )                                   AND
+                created_at <  buckets.end_date
+
+            WHERE
+              vm_state NOT IN (
+                'error',
+                'shelved_offloaded'
+              ) AND
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                               AND
+              created_at <  :end_date         AND
+              {project_filter}
+            GROUP BY
+              buckets.bucket,
+              user_id,
+              project_id
+            ORDER BY
+              buckets.bucket,
+              user_id,
+              project_id
+            '''.format(bucket_table=bucket_table, project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params,
+            **bucket_params)
+
+        return results.all(as_dict=True)
+
+    @metrics.observed
+    def query_volume_gigabyte_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._project_filter(billing_projects, user_projects, user_id)
+        bucket_table, bucket_params = self._bucket_table(buckets)
+
+        results = self._query(
+            'query_volume_gigabyte_hours_by_bucket',
+            '''
+            SELECT
+              buckets.bucket AS bucket,
+              user_id as user,
+              project_id as projectId,
+              SUM(
+                CEIL(
+                  TIMESTAMPDIFF(
+                    SECOND,
+                    GREATEST(
+                      buckets.start_date,
+                      created_at
+                    ),
+                    LEAST(
+                      buckets.end_date,
+                      COALESCE(
+                        deleted_at,
+                        buckets.end_date
+                      )
+                    )
+                  ) / 3600
+                ) * size
+              ) AS volume
+
+            FROM
+              cinder.volumes
+              JOIN
+              (
+                {bucket_table}
+              ) AS buckets
+              ON
+                (
+                  deleted_at >  buckets.start_date  OR
+                  deleted_at IS NULL
+                )                                   AND
+                created_at <  buckets.end_date
+
+            WHERE
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                              AND
+              created_at <  :end_date        AND
+              {project_filter}
+            GROUP BY
+              buckets.bucket,
+              user_id,
+              project_id
+            ORDER BY
+              buckets.bucket,
+              user_id,
+              project_id
+            '''.format(bucket_table=bucket_table, project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params,
+            **bucket_params)
+
+        return results.all(as_dict=True)
+
+    @metrics.observed
+    def query_image_storage_gigabyte_hours_by_bucket(self, buckets, projects):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._owner_filter(projects)
+        bucket_table, bucket_params = self._bucket_table(buckets)
+
+        results = self._query(
+            'query_image_storage_gigabyte_hours_by_bucket',
+            '''
+            SELECT
+              buckets.bucket AS bucket,
+              CEIL(
+                SUM(
+                  CEIL(
+                    TIMESTAMPDIFF(
+                      SECOND,
+                      GREATEST(
+                        buckets.start_date,
+                        created_at
+                      ),
+                      LEAST(
+                        buckets.end_date,
+                        COALESCE(
+                          deleted_at,
+                          buckets.end_date
+                        )
+                      )
+                    ) / 3600
+                  ) * size
+                ) / POWER(2, 30)
+              ) AS image,
+              owner AS projectId
+
+            FROM
+              glance.images
+              JOIN
+              (
+                {bucket_table}
+              ) AS buckets
+              ON
+                (
+                  deleted_at >  buckets.start_date  OR
+                  deleted_at IS NULL
+                )                                   AND
+                created_at <  buckets.end_date
+
+            WHERE
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                              AND
+              created_at <  :end_date        AND
+              {project_filter}
+            GROUP BY
+              buckets.bucket,
+              owner
+            ORDER BY
+              buckets.bucket,
+              owner;
+            '''.format(bucket_table=bucket_table, project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params,
+            **bucket_params)
+
+        return results.all(as_dict=True)
+
+    # The sweep engine: each query fetches the lifetimes overlapping the whole report once, and sweep_buckets rates
+    # them against every bucket in one pass, with the same per-bucket rounding as the SQL above
+    @metrics.observed
+    def sweep_instance_core_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._project_filter(billing_projects, user_projects, user_id)
+
+        results = self._query(
+            'sweep_instance_core_hours_by_bucket',
+            '''
+            SELECT
+              user_id,
+              project_id,
+              vcpus,
+              created_at,
+              deleted_at
+
+            FROM
+              nova.instances
+
+            WHERE
+              vm_state NOT IN (
+                'error',
+                'shelved_offloaded'
+              ) AND
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                               AND
+              created_at <  :end_date         AND
+              {project_filter}
+            '''.format(project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params)
+
+        # Records can't be sliced, so sweep_buckets is given each row's list of values
+        lifetimes = [record.values() for record in results]
+
+        return [
+            {'bucket': bucket, 'user': user, 'projectId': project_id, 'cpu': hours}
+            for bucket, (user, project_id), hours in sweep_buckets(lifetimes, buckets)
+        ]
+
+    @metrics.observed
+    def sweep_volume_gigabyte_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._project_filter(billing_projects, user_projects, user_id)
+
+        results = self._query(
+            'sweep_volume_gigabyte_hours_by_bucket',
+            '''
+            SELECT
+              user_id,
+              project_id,
+              size,
+              created_at,
+              deleted_at
+
+            FROM
+              cinder.volumes
+
+            WHERE
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                              AND
+              created_at <  :end_date        AND
+              {project_filter}
+            '''.format(project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params)
+
+        lifetimes = [record.values() for record in results]
+
+        return [
+            {'bucket': bucket, 'user': user, 'projectId': project_id, 'volume': hours}
+            for bucket, (user, project_id), hours in sweep_buckets(lifetimes, buckets)
+        ]
+
+    @metrics.observed
+    def sweep_image_storage_gigabyte_hours_by_bucket(self, buckets, projects):
+        if not buckets:
+            return []
+
+        project_filter, project_params = self._owner_filter(projects)
+
+        results = self._query(
+            'sweep_image_storage_gigabyte_hours_by_bucket',
+            '''
+            SELECT
+              owner,
+              size,
+              created_at,
+              deleted_at
+
+            FROM
+              glance.images
+
+            WHERE
+              (
+                deleted_at >  :start_date  OR
+                deleted_at IS NULL
+              )                              AND
+              created_at <  :end_date        AND
+              {project_filter}
+            '''.format(project_filter=project_filter),
+            start_date=buckets[0][0],
+            end_date=buckets[-1][1],
+            **project_params)
+
+        lifetimes = [record.values() for record in results]
+
+        # Images are rated in byte-hours and only rounded up to gigabyte-hours once summed, like the SQL
+        return [
+            {'bucket': bucket, 'image': -(-byte_hours // 2 ** 30), 'projectId': owner}
+            for bucket, (owner,), byte_hours in sweep_buckets(lifetimes, buckets)
+        ]
+
+    @staticmethod
+    def _bucket_table(buckets):
+        # Builds a derived table of (bucket, start_date, end_date) rows with every boundary bound as a parameter
+        selects = []
+        params = {}
+
+        for index, (start_date, end_date) in enumerate(buckets):
+            selects.append(
+                'SELECT {index} AS bucket, :bucket_start_{index} AS start_date, :bucket_end_{index} AS end_date'
+                .format(index=index)
+            )
+            params['bucket_start_{}'.format(index)] = start_date
+            params['bucket_end_{}'.format(index)] = end_date
+
+        return '\n                UNION ALL\n                '.join(selects), params
+
+    @metrics.observed
     def get_object_storage_by_project(self, start_date, end_date, projects):
         def date_format(date_str):
             return time.strftime(
@@ -226,20 +714,21 @@ class Collaboratory:
             projects.append('')
 
         try:
-            retval = requests.get(url, params={
-                'format': 'json',
-                'from': date_format(start_date),
-                'target':
-                    'object_usage.{' +
-                    # '2fb7b98d74134a37b9fba88856f60b78,' + # test values
-                    projects_string +
-                    '}',
-                'tz': 'America/Toronto',
-                'until': date_format(end_date),
-            })
+            with metrics.dependency('graphite', 'render'):
+                retval = requests.get(url, params={
+                    'format': 'json',
+                    'from': date_format(start_date),
+                    'target':
+                        'object_usage.{' +
+                        # '2fb7b98d74134a37b9fba88856f60b78,' + # test values
+                        projects_string +
+                        '}',
+                    'tz': 'America/Toronto',
+                    'until': date_format(end_date),
+                })
 
             if str(retval.content, 'utf-8').find("error") >= 0:
-                self.logger.error('at get_object_storage_by_project', retval.content)
+                self.logger.error('at get_object_storage_by_project: %s', retval.content)
                 raise Exception('at get_object_storage_by_project', retval.content)
                 return []
 
@@ -249,7 +738,8 @@ class Collaboratory:
 
             for project_usage in retval.json():
                 project = {
-                    'projectId': projects_string,
+                    # Targets come back as object_usage.<project id>
+                    'projectId': project_usage['target'].split('.', 1)[-1],
                     'objects': 0
                 }
                 for point in project_usage['datapoints']:
@@ -263,11 +753,75 @@ class Collaboratory:
             return responses
 
         except requests.exceptions.ConnectionError as err:
-            self.logger.error('at get_object_storage_by_project', err)
+            self.logger.error('at get_object_storage_by_project: %s', err)
+            return []
+
+    @metrics.observed
+    def get_object_storage_by_bucket(self, buckets, projects):
+        # Fetches the whole report range from Graphite once and sums the datapoints into buckets locally,
+        # returning one row per project per bucket
+        if not buckets:
+            return []
+
+        url = self.graphite_url + '/render'
+        projects_string = ','.join(projects)
+
+        if not projects:
+            projects.append('')
+
+        bucket_starts = [parse(start_date).timestamp() for start_date, end_date in buckets]
+        bucket_ends = [parse(end_date).timestamp() for start_date, end_date in buckets]
+
+        try:
+            with metrics.dependency('graphite', 'render'):
+                retval = requests.get(url, params={
+                    'format': 'json',
+                    'from': int(bucket_starts[0]),
+                    'target':
+                        'object_usage.{' +
+                        projects_string +
+                        '}',
+                    'tz': 'America/Toronto',
+                    'until': int(bucket_ends[-1]),
+                })
+
+            if str(retval.content, 'utf-8').find("error") >= 0:
+                self.logger.error('at get_object_storage_by_bucket: %s', retval.content)
+                raise Exception('at get_object_storage_by_bucket', retval.content)
+
+            responses = []
+
+            for project_usage in retval.json():
+                # Targets come back as object_usage.<project id>
+                project_id = project_usage['target'].split('.', 1)[-1]
+                objects = [0] * len(buckets)
+
+                for value, timestamp in project_usage['datapoints']:
+                    if value is None:
+                        continue
+
+                    index = bisect_right(bucket_starts, timestamp) - 1
+
+                    if index >= 0 and timestamp < bucket_ends[index]:
+                        objects[index] += value
+
+                for index, total in enumerate(objects):
+                    responses.append({
+                        'bucket': index,
+                        'projectId': project_id,
+                        'objects': total / 1000000000,  # Bytes to GB
+                    })
+
+            return responses
+
+        except requests.exceptions.ConnectionError as err:
+            self.logger.error('at get_object_storage_by_bucket: %s', err)
             return []
 
+    @metrics.observed
     def get_user_roles(self, user_id):
-        results = self.database.query(
+        results = self._query(
+            'get_user_roles',
             '''
             SELECT
               assignment.project_id,
@@ -303,8 +857,62 @@ class Collaboratory:
                 role_map[result['project_id']] = [result['name'].lower()]
         return role_map
 
+    @metrics.observed
+    def get_usage_changes_since(self, resource, watermark):
+        # How many rows of a resource were created, deleted or otherwise updated after the watermark, the earliest
+        # day those changes affect, and how many are still open. Used to decide which rollup days to re-rate.
+        # A row updated in place, e.g. an instance going to error or being resized, changes its usage on every day
+        # since it was created, since the usage queries read its current vm_state and size.
+        table = {
+            'cpu': 'nova.instances',
+            'volume': 'cinder.volumes',
+            'image': 'glance.images',
+        }[resource]
+
+        changes = self._query(
+            'get_usage_changes_since',
+            '''
+            SELECT
+              COUNT(*) AS changed,
+              MIN(
+                CASE
+                  WHEN created_at >= :watermark THEN created_at
+                  WHEN deleted_at >= :watermark THEN deleted_at
+                  ELSE created_at
+                END
+              ) AS earliest
+
+            FROM
+              {table}
+
+            WHERE
+              created_at >= :watermark OR
+              deleted_at >= :watermark OR
+              updated_at >= :watermark
+            '''.format(table=table),
+            watermark=watermark).all(as_dict=True)[0]
+
+        still_open = self._query(
+            'get_usage_changes_since',
+            '''
+            SELECT
+              COUNT(*) AS open
+
+            FROM
+              {table}
+
+            WHERE
+              deleted_at IS NULL
+            '''.format(table=table)).all(as_dict=True)[0]
+
+        changes['open'] = still_open['open']
+
+        return changes
+
+    @metrics.observed
     def get_project_billing_map(self):
-        results = self.database.query(
+        results = self._query(
+            'get_project_billing_map',
             '''
             SELECT assignment.target_id AS project_id, assignment.actor_id AS user_id
             FROM keystone.assignment
@@ -313,8 +921,10 @@ class Collaboratory:
         )
         return results.all()
 
+    @metrics.observed
     def get_project_id_map(self):
-        results = self.database.query(
+        results = self._query(
+            'get_project_id_map',
             '''
             SELECT id, name
             FROM keystone.project
@@ -322,8 +932,10 @@ class Collaboratory:
         )
         return results.all()
 
+    @metrics.observed
     def get_user_extras(self, user_id):
-        results = self.database.query(
+        results = self._query(
+            'get_user_extras',
             '''
             SELECT extra
             FROM keystone.user
@@ -333,19 +945,119 @@ class Collaboratory:
         )
         return results.all(as_dict=True)[0]
 
+    @metrics.observed
+    def get_users_extras(self, user_ids):
+        # Fetches and decodes the extras of every user not seen yet in a single query
+        missing = list(set(user_id for user_id in user_ids if user_id not in self.user_extras))
+
+        if missing:
+            results = self._query(
+                'get_users_extras',
+                '''
+                SELECT id, extra
+                FROM keystone.user
+                WHERE id IN :user_ids
+                ''',
+                user_ids=missing
+            )
+
+            for result in results.all(as_dict=True):
+                extra = result['extra']
+                self.user_extras[result['id']] = json.loads(extra) if extra else extra
+
+        return {user_id: self.user_extras.get(user_id) for user_id in user_ids}
+
+    @property
+    def user_map(self):
+        return self.users.names
+
+    @metrics.observed
     def refresh_user_id_map(self):
-        results = self.database.query(
-            '''
-            SELECT user_id, name
-            FROM keystone.local_user;
-            '''
-        )
-        for result in results.all(as_dict=True):
-            self.user_map[result['user_id']] = result['name']
-        return self.user_map
+        return self.users.refresh(full=True)
 
     def get_username(self, user_id):
-        if user_id in self.user_map:
-            return self.user_map[user_id]
+        name = self.users.get(user_id)
+        if name is not None:
+            return name
         else:
             return 'Unknown User <' + user_id + '>'
+
+
+def sweep_buckets(lifetimes, buckets):
+    # Rates lifetimes against buckets the way the bucketed SQL does: every lifetime is charged, in each bucket it
+    # overlaps, its size times the hours it was alive in that bucket rounded up, and the charges are summed per bucket
+    # and group. Each lifetime is a row whose last three columns are the size, created_at and deleted_at; the columns
+    # before them are the group. Buckets must be sorted and must not overlap. Returns (bucket index, group, total)
+    # tuples ordered by bucket and group.
+    if not lifetimes:
+        return []
+
+    groups = dict()
+    group_ids = numpy.empty(len(lifetimes), dtype=numpy.int64)
+    sizes = numpy.empty(len(lifetimes), dtype=numpy.int64)
+    created = numpy.empty(len(lifetimes), dtype='datetime64[s]')
+    deleted = numpy.empty(len(lifetimes), dtype='datetime64[s]')
+
+    for index, row in enumerate(lifetimes):
+        group = tuple(row[:-3])
+        group_ids[index] = groups.setdefault(group, len(groups))
+        sizes[index] = row[-3] or 0
+        created[index] = as_datetime64(row[-2])
+        deleted[index] = as_datetime64(row[-1])
+
+    # Bucket boundaries are compared with created_at and deleted_at as wall-clock times, as MySQL does
+    starts = numpy.array([as_datetime64(start_date) for start_date, end_date in buckets], dtype='datetime64[s]')
+    ends = numpy.array([as_datetime64(end_date) for start_date, end_date in buckets], dtype='datetime64[s]')
+
+    # A lifetime is in every bucket from the first one ending after it was created to the last one starting before
+    # it was deleted, or to the last bucket if it hasn't been
+    still_alive = numpy.isnat(deleted)
+    first = numpy.searchsorted(ends, created, side='right')
+    last = numpy.where(still_alive, len(buckets), numpy.searchsorted(starts, deleted, side='left')) - 1
+    counts = numpy.maximum(last - first + 1, 0)
+
+    # One element per (lifetime, bucket) pair it overlaps
+    lifetime_index = numpy.repeat(numpy.arange(len(lifetimes)), counts)
+    bucket_index = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    bucket_index += first[lifetime_index]
+
+    bucket_ends = ends[bucket_index]
+    overlap_end = numpy.where(
+        still_alive[lifetime_index],
+        bucket_ends,
+        numpy.minimum(bucket_ends, deleted[lifetime_index])
+    )
+    overlap_start = numpy.maximum(starts[bucket_index], created[lifetime_index])
+    seconds = (overlap_end - overlap_start).astype(numpy.int64)
+    charges = -(-seconds // 3600) * sizes[lifetime_index]
+
+    # Sum the charges per (bucket, group) with exact integer arithmetic
+    keys = bucket_index * len(groups) + group_ids[lifetime_index]
+    order = numpy.argsort(keys, kind='stable')
+    keys = keys[order]
+
+    if not len(keys):
+        return []
+
+    starts_of_runs = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    totals = numpy.add.reduceat(charges[order], starts_of_runs)
+
+    group_names = list(groups)
+    results = [
+        (int(key) // len(groups), group_names[int(key) % len(groups)], int(total))
+        for key, total in zip(keys[starts_of_runs], totals)
+    ]
+    results.sort(key=lambda result: (result[0], tuple(name or '' for name in result[1])))
+
+    return results
+
+
+def as_datetime64(value):
+    # Naive wall-clock seconds for a DATETIME column value or a bucket boundary string, NaT for NULL
+    if value is None:
+        return numpy.datetime64('NaT')
+
+    if isinstance(value, str):
+        value = parse(value)
+
+    return numpy.datetime64(value.replace(tzinfo=None, microsecond=0), 's')
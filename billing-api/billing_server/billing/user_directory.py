@@ -0,0 +1,242 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import logging
+import os
+import sys
+import threading
+import time
+
+from . import pool, query_log
+
+_directories = {}
+_directories_pid = None
+_lock = threading.Lock()
+
+_options = {
+    'ttl': 300,
+    'full_refresh': 3600,
+}
+
+
+def configure(ttl=None, full_refresh=None):
+    with _lock:
+        if ttl is not None:
+            _options['ttl'] = ttl
+
+        if full_refresh is not None:
+            _options['full_refresh'] = full_refresh
+
+
+def get_directory(database_url, logger=None):
+    global _directories_pid
+
+    with _lock:
+        if _directories_pid != os.getpid():
+            _directories.clear()
+            _directories_pid = os.getpid()
+
+        directory = _directories.get(database_url)
+
+        if directory is None:
+            directory = UserDirectory(database_url, logger, _options['ttl'], _options['full_refresh'])
+            _directories[database_url] = directory
+
+        return directory
+
+
+def reset():
+    with _lock:
+        _directories.clear()
+
+
+# Usernames from keystone.local_user, shared by every request in the worker. Once loaded, the map is topped up
+# in the background with users added since the last refresh, and fully reloaded every full_refresh seconds to
+# pick up renames. Ids that aren't in the map are looked up one at a time.
+class UserDirectory:
+
+    def __init__(self, database_url, logger=None, ttl=300, full_refresh=3600):
+        self.database_url = database_url
+        self.logger = logger or logging.getLogger(__name__)
+        self.ttl = ttl
+        self.full_refresh = full_refresh
+        self.names = {}
+        self.missing = {}  # {[user_id]: time of the failed lookup}
+        self.last_id = None
+        self.refreshed_at = None
+        self.fully_refreshed_at = None
+        self.refresh_seconds = None
+        self.refreshing = False
+        self.lookups = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        # Blocks only the first time; afterwards a stale map is refreshed in the background
+        if self.refreshed_at is None:
+            self.refresh(full=True)
+
+        elif time.time() - self.refreshed_at > self.ttl:
+            self.refresh_in_background()
+
+    def get(self, user_id):
+        self.load()
+
+        name = self.names.get(user_id)
+
+        if name is None:
+            name = self.lookup(user_id)
+
+        return name
+
+    def lookup(self, user_id):
+        failed_at = self.missing.get(user_id)
+
+        if failed_at is not None and time.time() - failed_at < self.ttl:
+            return None
+
+        rows = self.query(
+            'UserDirectory.lookup',
+            '''
+            SELECT user_id, name
+            FROM keystone.local_user
+            WHERE user_id = :user_id;
+            ''',
+            user_id=user_id
+        )
+
+        with self.lock:
+            self.lookups += 1
+
+            if not rows:
+                self.missing[user_id] = time.time()
+                return None
+
+            self.missing.pop(user_id, None)
+            self.names[user_id] = rows[0]['name']
+
+        return rows[0]['name']
+
+    def refresh(self, full=False):
+        started = time.monotonic()
+        now = time.time()
+        full = full or self.last_id is None or now - self.fully_refreshed_at > self.full_refresh
+
+        if full:
+            rows = self.query(
+                'UserDirectory.refresh',
+                '''
+                SELECT id, user_id, name
+                FROM keystone.local_user;
+                '''
+            )
+
+        else:
+            rows = self.query(
+                'UserDirectory.refresh',
+                '''
+                SELECT id, user_id, name
+                FROM keystone.local_user
+                WHERE id > :last_id;
+                ''',
+                last_id=self.last_id
+            )
+
+        names = {row['user_id']: row['name'] for row in rows}
+
+        with self.lock:
+            if full:
+                # Swap the whole map so readers never see it half built
+                self.names = names
+                self.missing = {}
+                self.fully_refreshed_at = now
+
+            else:
+                self.names.update(names)
+
+                for user_id in names:
+                    self.missing.pop(user_id, None)
+
+            ids = [row['id'] for row in rows]
+
+            if not full and self.last_id is not None:
+                ids.append(self.last_id)
+
+            if ids:
+                self.last_id = max(ids)
+
+            self.refreshed_at = now
+            self.refresh_seconds = time.monotonic() - started
+
+        self.logger.info('Refreshed {} users ({}) in {:.3f}s'.format(
+            len(names),
+            'full' if full else 'incremental',
+            self.refresh_seconds
+        ))
+
+        return self.names
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+
+            self.refreshing = True
+
+        thread = threading.Thread(target=self.background_refresh, daemon=True)
+        thread.start()
+
+    def background_refresh(self):
+        try:
+            self.refresh()
+
+        except Exception:
+            self.logger.exception('Background refresh of the user directory failed')
+
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def query(self, name, sql, **params):
+        connection, waited = pool.connect(self.database_url)
+
+        # Timed and described to query_log like the Collaboratory's statements
+        try:
+            return query_log.execute(name, connection, sql, params, self.logger).all(as_dict=True)
+
+        finally:
+            connection.close()
+
+    def memory_footprint(self):
+        # Approximate bytes held by the map: the dicts plus every key and value in them
+        with self.lock:
+            size = sys.getsizeof(self.names) + sys.getsizeof(self.missing)
+
+            for user_id, name in self.names.items():
+                size += sys.getsizeof(user_id) + sys.getsizeof(name)
+
+            for user_id in self.missing:
+                size += sys.getsizeof(user_id)
+
+            return size
+
+    def stats(self):
+        return {
+            'users': len(self.names),
+            'missing': len(self.missing),
+            'lookups': self.lookups,
+            'bytes': self.memory_footprint(),
+            'refreshed_at': self.refreshed_at,
+            'refresh_seconds': self.refresh_seconds,
+        }
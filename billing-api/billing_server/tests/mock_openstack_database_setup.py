@@ -3,61 +3,90 @@
 
 import uuid
 
+from billing_server.billing import dialects
+
 BILLING_ROLE_ID = '81ab2b06f0104e9a93fee991e61d7ac8'
 NORMAL_ROLE_ID = '52d376dce28e4c70b2929c265ad1c4c0'
 
+def execute(database, sql, **params):
+    # records can't run statements that return no rows, so the setup goes through the dialect layer too
+    return dialects.execute(database.connection, sql, params)
+
+
+def is_sqlite(database):
+    # On SQLite the pool attaches nova, cinder, glance and keystone to every connection, so there are no
+    # databases to create or drop, only tables
+    return database.connection.dialect.name == 'sqlite'
+
+
 def initialize_database(database):
-    database.database.query('CREATE DATABASE IF NOT EXISTS nova;')
-    database.database.query(nova_instances_schema)
+    if not is_sqlite(database):
+        execute(database, 'CREATE DATABASE IF NOT EXISTS nova;')
+    execute(database, nova_instances_schema)
 
-    database.database.query('CREATE DATABASE IF NOT EXISTS cinder;')
-    database.database.query(cinder_volumes_schema)
+    if not is_sqlite(database):
+        execute(database, 'CREATE DATABASE IF NOT EXISTS cinder;')
+    execute(database, cinder_volumes_schema)
 
-    database.database.query('CREATE DATABASE IF NOT EXISTS glance;')
-    database.database.query(glance_images_schema)
+    if not is_sqlite(database):
+        execute(database, 'CREATE DATABASE IF NOT EXISTS glance;')
+    execute(database, glance_images_schema)
 
     # Note that we don't have to create any projects, since we do not read from the table
-    database.database.query('CREATE DATABASE IF NOT EXISTS keystone;')
-    database.database.query(keystone_assignment_schema)
-    database.database.query(keystone_role_schema)
-    database.database.query(keystone_user_schema)
-    database.database.query(keystone_local_user_schema)
-    database.database.query(keystone_create_role,
-                            role_id=BILLING_ROLE_ID,
-                            role_name='billing')
-    database.database.query(keystone_create_role,
-                            role_id=NORMAL_ROLE_ID,
-                            role_name='user')
+    if not is_sqlite(database):
+        execute(database, 'CREATE DATABASE IF NOT EXISTS keystone;')
+    execute(database, keystone_assignment_schema)
+    execute(database, keystone_role_schema)
+    execute(database, keystone_user_schema)
+    execute(database, keystone_local_user_schema)
+    execute(database, keystone_project_schema)
+    execute(database, keystone_create_role,
+            role_id=BILLING_ROLE_ID,
+            role_name='billing')
+    execute(database, keystone_create_role,
+            role_id=NORMAL_ROLE_ID,
+            role_name='user')
 
 
 def teardown_database(database):
-    database.database.query('DROP DATABASE nova;')
-    database.database.query('DROP DATABASE cinder;')
-    database.database.query('DROP DATABASE glance;')
-    database.database.query('DROP DATABASE keystone;')
+    if is_sqlite(database):
+        for table in ('nova.instances', 'cinder.volumes', 'glance.images', 'keystone.assignment', 'keystone.role',
+                      'keystone.user', 'keystone.local_user', 'keystone.project'):
+            execute(database, 'DROP TABLE IF EXISTS {};'.format(table))
+        return
+
+    execute(database, 'DROP DATABASE nova;')
+    execute(database, 'DROP DATABASE cinder;')
+    execute(database, 'DROP DATABASE glance;')
+    execute(database, 'DROP DATABASE keystone;')
 
 
-def create_user(database, user_id, username):
-    database.database.query(
+def create_user(database, user_id, username, extra=None):
+    execute(
+        database,
         '''
         INSERT INTO
           keystone.user
           (
             id,
-            name
+            name,
+            extra
           )
 
         VALUES
           (
             :user_id,
-            :username
+            :username,
+            :extra
           );
         ''',
         user_id=user_id,
-        username=username)
+        username=username,
+        extra=extra)
 
 def delete_user(database, user_id):
-    database.database.query(
+    execute(
+        database,
         '''
         DELETE
         FROM
@@ -67,7 +96,8 @@ def delete_user(database, user_id):
           id = :user_id;
         '''
         , user_id=user_id)
-    database.database.query(
+    execute(
+        database,
         '''
         DELETE
         FROM
@@ -85,7 +115,8 @@ def assign_role(database, user_id, project_id, billing=False):
     else:
         role_id = NORMAL_ROLE_ID
 
-    database.database.query(
+    execute(
+        database,
         '''
         INSERT INTO
           keystone.assignment
@@ -108,7 +139,8 @@ def assign_role(database, user_id, project_id, billing=False):
 
 
 def create_instance(uuid, database, user_id, project_id, vcpus, created_at, deleted_at):
-    database.database.query(
+    execute(
+        database,
         '''
         INSERT INTO
           nova.instances
@@ -142,7 +174,8 @@ def create_instance(uuid, database, user_id, project_id, vcpus, created_at, dele
 
 
 def create_volume(database, user_id, project_id, size, created_at, deleted_at):
-    database.database.query(
+    execute(
+        database,
         '''
         INSERT INTO
           cinder.volumes
@@ -171,7 +204,8 @@ def create_volume(database, user_id, project_id, size, created_at, deleted_at):
 
 
 def create_image(database, project_id, size, created_at, deleted_at):
-    database.database.query(
+    execute(
+        database,
         '''
         INSERT INTO
           glance.images
@@ -200,6 +234,7 @@ nova_instances_schema = '''
   CREATE TABLE IF NOT EXISTS nova.instances
   (
     created_at  DATETIME,
+    updated_at  DATETIME,
     deleted_at  DATETIME,
     user_id     VARCHAR (255),
     project_id  VARCHAR (255),
@@ -213,6 +248,7 @@ cinder_volumes_schema = '''
   CREATE TABLE IF NOT EXISTS cinder.volumes
   (
     created_at  DATETIME,
+    updated_at  DATETIME,
     deleted_at  DATETIME,
     user_id     VARCHAR (255),
     project_id  VARCHAR (255),
@@ -225,6 +261,7 @@ glance_images_schema = '''
   (
     size        BIGINT (20),
     created_at  DATETIME,
+    updated_at  DATETIME,
     deleted_at  DATETIME,
     owner       VARCHAR (255)
   );
@@ -251,7 +288,8 @@ keystone_user_schema = '''
   CREATE TABLE IF NOT EXISTS keystone.user
   (
     id          VARCHAR (64),
-    name        VARCHAR (255)
+    name        VARCHAR (255),
+    extra       TEXT
   );
   '''
 
@@ -264,6 +302,14 @@ keystone_local_user_schema = '''
   );
   '''
 
+keystone_project_schema = '''
+  CREATE TABLE IF NOT EXISTS keystone.project
+  (
+    id          VARCHAR (64),
+    name        VARCHAR (64)
+  );
+  '''
+
 keystone_create_role = '''
   INSERT INTO
     keystone.role
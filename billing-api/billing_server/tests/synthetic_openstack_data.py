@@ -0,0 +1,240 @@
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from .mock_openstack_database_setup import *
+
+# Generates a cloud's worth of the OpenStack rows the billing queries read, in the tables and columns of
+# mock_openstack_database_setup. The same seed and counts always give the same rows, and every table draws from
+# its own random stream, so changing the number of volumes doesn't change the instances.
+
+# Tables in load order, with the columns they are loaded with
+COLUMNS = [
+    ('keystone.project', ('id', 'name')),
+    ('keystone.user', ('id', 'name', 'extra')),
+    ('keystone.local_user', ('id', 'user_id', 'name')),
+    ('keystone.role', ('id', 'name')),
+    ('keystone.assignment', ('actor_id', 'target_id', 'role_id')),
+    ('nova.instances', ('uuid', 'user_id', 'project_id', 'vcpus', 'vm_state', 'created_at', 'deleted_at')),
+    ('cinder.volumes', ('user_id', 'project_id', 'size', 'created_at', 'deleted_at')),
+    ('glance.images', ('owner', 'size', 'created_at', 'deleted_at')),
+]
+
+SCHEMAS = [
+    nova_instances_schema,
+    cinder_volumes_schema,
+    glance_images_schema,
+    keystone_assignment_schema,
+    keystone_role_schema,
+    keystone_user_schema,
+    keystone_local_user_schema,
+    keystone_project_schema,
+]
+
+VCPUS = (1, 2, 2, 4, 4, 8, 16)
+VOLUME_SIZES = (1, 10, 20, 50, 100, 250, 500, 1000)  # GB
+IMAGE_SIZE_MEDIAN = 2 * 2 ** 30  # bytes
+
+
+class SyntheticCloud:
+
+    def __init__(self, seed=42, projects=5000, users=50000, instances=1000000, volumes=200000, images=50000,
+                 start_date=datetime(2016, 1, 1), end_date=datetime(2017, 1, 1), deleted_fraction=0.7,
+                 error_fraction=0.02, shelved_fraction=0.01, mean_lifetime=30, projects_per_user=2):
+        self.seed = seed
+        self.counts = {
+            'nova.instances': instances,
+            'cinder.volumes': volumes,
+            'glance.images': images,
+        }
+        self.start_date = start_date
+        self.span = int((end_date - start_date).total_seconds())
+        self.deleted_fraction = deleted_fraction
+        self.error_fraction = error_fraction
+        self.shelved_fraction = shelved_fraction
+        # Churn: deleted resources live for an exponentially distributed time with this mean, in days
+        self.mean_lifetime = mean_lifetime * 86400
+
+        rng = self.random('ids')
+        self.project_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(projects)]
+        self.user_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(users)]
+        self.members = self.assign_members(projects_per_user)
+
+    def random(self, stream):
+        # Seeding with a string is stable across runs and Python versions
+        return random.Random('{}:{}'.format(self.seed, stream))
+
+    def assign_members(self, projects_per_user):
+        # Every project gets a member while there are users to go around; users beyond that join a random
+        # project, plus on average projects_per_user - 1 more
+        rng = self.random('members')
+        members = [[] for _ in self.project_ids]
+
+        for user in range(len(self.user_ids)):
+            projects = {user % len(members) if user < len(members) else rng.randrange(len(members))}
+
+            if projects_per_user > 1:
+                for _ in range(int(rng.expovariate(1 / (projects_per_user - 1)))):
+                    projects.add(rng.randrange(len(members)))
+
+            for project in sorted(projects):
+                members[project].append(user)
+
+        return members
+
+    def rows(self, table):
+        return getattr(self, table.split('.')[1] + '_rows')()
+
+    def project_rows(self):
+        for index, project_id in enumerate(self.project_ids):
+            yield project_id, 'project-{}'.format(index)
+
+    def user_rows(self):
+        for index, user_id in enumerate(self.user_ids):
+            yield user_id, 'user-{}'.format(index), json.dumps({'email': 'user-{}@example.org'.format(index)})
+
+    def local_user_rows(self):
+        for index, user_id in enumerate(self.user_ids):
+            yield index + 1, user_id, 'user-{}'.format(index)
+
+    def role_rows(self):
+        yield BILLING_ROLE_ID, 'billing'
+        yield NORMAL_ROLE_ID, 'user'
+
+    def assignment_rows(self):
+        # The first member of each project is its billing contact
+        for project, users in enumerate(self.members):
+            for position, user in enumerate(users):
+                yield self.user_ids[user], self.project_ids[project], NORMAL_ROLE_ID
+
+                if position == 0:
+                    yield self.user_ids[user], self.project_ids[project], BILLING_ROLE_ID
+
+    def instances_rows(self):
+        rng = self.random('nova.instances')
+
+        for _ in range(self.counts['nova.instances']):
+            project, user = self.owner(rng)
+            created_at, deleted_at = self.lifetime(rng)
+            state = rng.random()
+
+            if state < self.error_fraction:
+                vm_state = 'error'
+
+            elif state < self.error_fraction + self.shelved_fraction:
+                vm_state = 'shelved_offloaded'
+
+            else:
+                vm_state = 'deleted' if deleted_at else 'active'
+
+            yield (uuid.UUID(int=rng.getrandbits(128)).hex, user, project, rng.choice(VCPUS), vm_state, created_at,
+                   deleted_at)
+
+    def volumes_rows(self):
+        rng = self.random('cinder.volumes')
+
+        for _ in range(self.counts['cinder.volumes']):
+            project, user = self.owner(rng)
+            created_at, deleted_at = self.lifetime(rng)
+
+            yield user, project, rng.choice(VOLUME_SIZES), created_at, deleted_at
+
+    def images_rows(self):
+        rng = self.random('glance.images')
+
+        for _ in range(self.counts['glance.images']):
+            project, user = self.owner(rng)
+            created_at, deleted_at = self.lifetime(rng)
+
+            yield project, int(rng.lognormvariate(0, 1) * IMAGE_SIZE_MEDIAN), created_at, deleted_at
+
+    def owner(self, rng):
+        # Squaring skews ownership toward the first projects, so a few projects own most of the resources
+        project = int(len(self.project_ids) * rng.random() ** 2)
+        users = self.members[project]
+        user = users[rng.randrange(len(users))] if users else rng.randrange(len(self.user_ids))
+
+        return self.project_ids[project], self.user_ids[user]
+
+    def lifetime(self, rng):
+        # Created uniformly over the range; deleted ones are deleted by the end of it at the latest
+        created = rng.randrange(self.span)
+        deleted = None
+
+        if rng.random() < self.deleted_fraction:
+            deleted = min(created + int(rng.expovariate(1 / self.mean_lifetime)) + 1, self.span)
+
+        return self.timestamp(created), self.timestamp(deleted)
+
+    def timestamp(self, seconds):
+        if seconds is None:
+            return None
+
+        return (self.start_date + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def create_schema(connection):
+    if connection.dialect.name != 'sqlite':
+        for schema in ('nova', 'cinder', 'glance', 'keystone'):
+            connection.execute(text('CREATE DATABASE IF NOT EXISTS {}'.format(schema)))
+
+    for statement in SCHEMAS:
+        connection.execute(text(statement))
+
+
+def load_inserts(connection, table, columns, rows, batch_size=1000):
+    # Executes one statement per batch with many parameter sets; MySQLdb and PyMySQL send those as a single
+    # multi-row INSERT
+    statement = text('INSERT INTO {} ({}) VALUES ({})'.format(
+        table,
+        ', '.join(columns),
+        ', '.join(':' + column for column in columns)
+    ))
+    loaded = 0
+    batch = []
+
+    with connection.begin():
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+
+            if len(batch) >= batch_size:
+                connection.execute(statement, batch)
+                loaded += len(batch)
+                batch = []
+
+        if batch:
+            connection.execute(statement, batch)
+            loaded += len(batch)
+
+    return loaded
+
+
+def load_data_infile(connection, table, columns, rows, directory):
+    # Writes the rows as a tab separated file and has MySQL read it with LOAD DATA LOCAL INFILE, which needs
+    # local_infile enabled on both the client and the server
+    path = os.path.join(directory, table + '.tsv')
+    loaded = 0
+
+    with open(path, 'w') as tsv:
+        for row in rows:
+            tsv.write('\t'.join(tsv_value(value) for value in row) + '\n')
+            loaded += 1
+
+    with connection.begin():
+        connection.execute(text(
+            "LOAD DATA LOCAL INFILE :path INTO TABLE {} FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({})"
+            .format(table, ', '.join(columns))
+        ), path=path)
+
+    return loaded
+
+
+def tsv_value(value):
+    if value is None:
+        return '\\N'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
@@ -0,0 +1,39 @@
+import unittest
+from datetime import datetime
+
+from billing_server.billing import app, choose_bucket_size, count_buckets, is_enabled
+
+
+def local(*args):
+    return app.timezone.localize(datetime(*args))
+
+
+class Test(unittest.TestCase):
+
+    def test_short_ranges_keep_their_bucket_size(self):
+        self.assertEqual('daily', choose_bucket_size(local(2019, 1, 1), local(2019, 2, 1), 'daily', 62))
+        self.assertEqual('monthly', choose_bucket_size(local(2019, 1, 1), local(2019, 2, 1), 'monthly', 62))
+
+    def test_long_ranges_are_coarsened(self):
+        self.assertEqual('weekly', choose_bucket_size(local(2019, 1, 1), local(2020, 1, 1), 'daily', 62))
+        self.assertEqual('monthly', choose_bucket_size(local(2015, 1, 1), local(2020, 1, 1), 'daily', 62))
+        self.assertEqual('yearly', choose_bucket_size(local(2000, 1, 1), local(2020, 1, 1), 'weekly', 62))
+
+    def test_never_finer_than_requested(self):
+        self.assertEqual('yearly', choose_bucket_size(local(2019, 1, 1), local(2019, 1, 2), 'yearly', 62))
+
+    def test_unknown_sizes_start_from_daily(self):
+        self.assertEqual('daily', choose_bucket_size(local(2019, 1, 1), local(2019, 1, 10), 'hourly', 62))
+
+    def test_falls_back_to_the_coarsest_size(self):
+        self.assertEqual('yearly', choose_bucket_size(local(1900, 1, 1), local(2020, 1, 1), 'daily', 62))
+
+    def test_count_buckets(self):
+        self.assertEqual(31, count_buckets(local(2019, 1, 1), local(2019, 2, 1), 'daily', 100))
+        self.assertEqual(10, count_buckets(local(2019, 1, 1), local(2019, 2, 1), 'daily', 10))
+        self.assertEqual(2, count_buckets(local(2019, 1, 15), local(2019, 2, 15), 'monthly', 100))
+
+    def test_is_enabled(self):
+        self.assertTrue(is_enabled('true', False))
+        self.assertFalse(is_enabled('false', True))
+        self.assertTrue(is_enabled(None, True))
@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+from billing_server.billing.buckets import BucketCalendar
+
+TIMEZONE = pytz.timezone('America/Toronto')
+
+
+def local(*args):
+    return TIMEZONE.localize(datetime(*args))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = BucketCalendar(TIMEZONE)
+
+    def test_daily_boundaries_follow_dst(self):
+        boundaries = self.calendar.boundaries('daily', local(2019, 3, 9), local(2019, 3, 12))
+
+        self.assertEqual([local(2019, 3, 10), local(2019, 3, 11)], boundaries)
+        self.assertEqual(timedelta(hours=23), boundaries[1] - boundaries[0])
+        self.assertEqual('-04:00', boundaries[1].isoformat()[-6:])
+
+    def test_boundaries_are_strictly_inside_the_range(self):
+        self.assertEqual([local(2019, 2, 1)], self.calendar.boundaries('monthly', local(2019, 1, 1), local(2019, 3, 1)))
+        self.assertEqual([], self.calendar.boundaries('yearly', local(2019, 1, 1), local(2019, 12, 31)))
+
+    def test_next_boundary_and_start_of(self):
+        wednesday = local(2019, 5, 15, 13, 30)
+
+        self.assertEqual(local(2019, 5, 16), self.calendar.next_boundary('daily', wednesday))
+        self.assertEqual(local(2019, 5, 20), self.calendar.next_boundary('weekly', wednesday))
+        self.assertEqual(local(2019, 5, 13), self.calendar.start_of('weekly', wednesday))
+        self.assertEqual(local(2019, 6, 1), self.calendar.next_boundary('monthly', wednesday))
+        self.assertEqual(local(2019, 1, 1), self.calendar.start_of('yearly', wednesday))
+
+        # A boundary starts its own bucket
+        self.assertEqual(local(2019, 5, 13), self.calendar.start_of('weekly', local(2019, 5, 13)))
+        self.assertEqual(local(2019, 5, 20), self.calendar.next_boundary('weekly', local(2019, 5, 13)))
+
+    def test_calendar_grows_to_cover_new_years(self):
+        self.calendar.boundaries('daily', local(2019, 1, 1), local(2019, 2, 1))
+        self.assertEqual(local(2031, 1, 2), self.calendar.next_boundary('daily', local(2031, 1, 1)))
+        self.assertEqual(local(2001, 1, 1), self.calendar.start_of('daily', local(2001, 1, 1, 12)))
+
+        first_year, last_year, boundaries = self.calendar.calendars['daily']
+        self.assertEqual((2000, 2032), (first_year, last_year))
+        self.assertEqual(sorted(boundaries), boundaries)
+
+    def test_calendar_is_bounded(self):
+        calendar = BucketCalendar(TIMEZONE, max_years=10)
+        calendar.boundaries('daily', local(2019, 1, 1), local(2019, 2, 1))
+        calendar.boundaries('daily', local(2022, 1, 1), local(2022, 2, 1))
+        self.assertEqual((2018, 2023), calendar.calendars['daily'][:2])
+
+        # Growing past max_years starts over from the years asked for
+        self.assertEqual(local(2051, 1, 2), calendar.next_boundary('daily', local(2051, 1, 1)))
+        self.assertEqual((2050, 2052), calendar.calendars['daily'][:2])
+
+        # A range longer than max_years is answered without being kept
+        boundaries = calendar.boundaries('yearly', local(1900, 6, 1), local(2100, 6, 1))
+        self.assertEqual(200, len(boundaries))
+        self.assertEqual(local(1901, 1, 1), boundaries[0])
+        self.assertNotIn('yearly', calendar.calendars)
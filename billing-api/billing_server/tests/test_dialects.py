@@ -0,0 +1,150 @@
+import logging
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+import pytz
+
+from billing_server.billing import dialects, usage_queries, user_directory
+from billing_server.billing.config import default
+from .mock_openstack_database_setup import *
+
+BUCKETS = [
+    ('2016-09-11 00:00:00-04:00', '2016-09-12 00:00:00-04:00'),
+    ('2016-09-12 00:00:00-04:00', '2016-09-13 00:00:00-04:00'),
+    ('2016-09-13 00:00:00-04:00', '2016-09-14 00:00:00-04:00'),
+    ('2016-09-14 00:00:00-04:00', '2016-09-14 12:30:00-04:00'),
+]
+
+
+def populate(database):
+    create_user(database, '1', 'Articuno', '{"email": "articuno@oicr.on.ca"}')
+    create_user(database, '2', 'Zapdos')
+    assign_role(database, '1', 'project', True)
+    assign_role(database, '2', 'project')
+    create_instance('a', database, '1', 'project', 4, '2016-09-12 04:39:13', '2016-09-14 16:48:19')
+    create_instance('b', database, '2', 'project', 2, '2016-09-13 10:10:10', None)
+    create_instance('c', database, '1', 'other', 8, '2016-09-01 00:00:00', None)
+    # Starts and ends exactly on bucket boundaries
+    create_instance('d', database, '2', 'project', 1, '2016-09-12 00:00:00', '2016-09-13 00:00:00')
+    create_volume(database, '1', 'project', 64, '2016-09-11 19:40:23', '2016-09-13 20:10:29')
+    create_volume(database, '2', 'project', 16, '2016-09-13 23:59:59', None)
+    create_image(database, 'project', 2 ** 32, '2016-09-12 01:00:00', '2016-09-15 02:00:00')
+    create_image(database, 'project', 3 * 2 ** 29, '2016-09-10 01:00:00', None)
+
+
+def run_queries(database):
+    results = []
+
+    for billing_projects, user_projects in [(['project'], []), ([], ['project', 'other']), ([], [])]:
+        for start_date, end_date in BUCKETS:
+            results.append(database.get_instance_core_hours(start_date, end_date, list(billing_projects),
+                                                            list(user_projects), '1'))
+            results.append(database.get_volume_gigabyte_hours(start_date, end_date, list(billing_projects),
+                                                              list(user_projects), '1'))
+            results.append(database.get_image_storage_gigabyte_hours_by_project(start_date, end_date,
+                                                                                list(billing_projects)))
+
+        results.append(database.query_instance_core_hours_by_bucket(BUCKETS, list(billing_projects),
+                                                                    list(user_projects), '1'))
+        results.append(database.query_volume_gigabyte_hours_by_bucket(BUCKETS, list(billing_projects),
+                                                                      list(user_projects), '1'))
+        results.append(database.query_image_storage_gigabyte_hours_by_bucket(BUCKETS, list(billing_projects)))
+
+    results.append(database.get_user_roles('1'))
+    results.append(database.get_users_extras(['1', '2', 'nobody']))
+    results.append([dict(row.as_dict()) for row in database.get_project_billing_map()])
+
+    for resource in ('cpu', 'volume', 'image'):
+        results.append(database.get_usage_changes_since(resource, '2016-09-13 00:00:00'))
+
+    return normalize(results)
+
+
+def normalize(value):
+    # MySQL returns decimals and datetimes where SQLite returns numbers and text
+    if isinstance(value, dict):
+        return dict((key, normalize(item)) for key, item in value.items())
+
+    if isinstance(value, list):
+        rows = [normalize(item) for item in value]
+
+        # Statements without an ORDER BY may return their rows in any order
+        if all(isinstance(row, dict) for row in rows):
+            rows.sort(key=lambda row: sorted((key, str(item)) for key, item in row.items()))
+
+        return rows
+
+    if isinstance(value, (Decimal, int)) and not isinstance(value, bool):
+        return float(value)
+
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+
+    return value
+
+
+class Test(unittest.TestCase):
+
+    def test_timestampdiff_truncates_toward_zero(self):
+        self.assertEqual(3601.0, dialects.timestampdiff('SECOND', '2016-09-12 00:00:00', '2016-09-12 01:00:01'))
+        self.assertEqual(1.0, dialects.timestampdiff('HOUR', '2016-09-12 00:00:00', '2016-09-12 01:59:59'))
+        self.assertEqual(-1.0, dialects.timestampdiff('HOUR', '2016-09-12 01:59:59', '2016-09-12 00:00:00'))
+        self.assertIsNone(dialects.timestampdiff('SECOND', None, '2016-09-12 00:00:00'))
+
+    def test_greatest_and_least_are_null_with_any_null(self):
+        self.assertEqual('2016-09-12 00:00:00', dialects.greatest('2016-09-11 23:00:00', '2016-09-12 00:00:00'))
+        self.assertEqual(1, dialects.least(3, 1, 2))
+        self.assertIsNone(dialects.greatest('2016-09-11 23:00:00', None))
+
+    def test_bound_datetimes_are_wall_clock_times(self):
+        self.assertEqual('2016-09-12 00:00:00', dialects.wall_clock('2016-09-12 00:00:00-04:00'))
+        self.assertEqual('2016-09-12 00:00:00', dialects.wall_clock('2016-09-12'))
+        self.assertEqual('2016-09-12 00:00:00', dialects.wall_clock(
+            pytz.timezone('America/Toronto').localize(datetime(2016, 9, 12))))
+        self.assertEqual('project', dialects.wall_clock('project'))
+
+    def test_translate_quotes_timestampdiff_units(self):
+        self.assertEqual("TIMESTAMPDIFF('SECOND', a, b)", dialects.translate('TIMESTAMPDIFF(SECOND, a, b)'))
+        self.assertEqual("TIMESTAMPDIFF('HOUR',\n a, b)", dialects.translate('TIMESTAMPDIFF(\n  HOUR,\n a, b)'))
+
+    def test_in_lists_are_expanded(self):
+        database = usage_queries.Collaboratory('sqlite://', 'http://localhost:8080', logging.getLogger('test'),
+                                               'billing', False)
+
+        try:
+            rows = dialects.execute(database.connection, 'SELECT 1 AS one WHERE 2 IN :values', {'values': [1, 2]})
+            self.assertEqual([{'one': 1}], rows.all(as_dict=True))
+
+        finally:
+            database.close()
+
+
+# Runs every usage query on MySQL and on SQLite over the same rows and expects the same results
+class ParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.databases = [
+            usage_queries.Collaboratory(url, default.TEST_GRAPHITE_URI, logging.getLogger('test_dialects'),
+                                        'billing', False)
+            for url in (default.TEST_MYSQL_URI, 'sqlite://')
+        ]
+
+        for database in self.databases:
+            initialize_database(database)
+            populate(database)
+
+    def tearDown(self):
+        for database in self.databases:
+            teardown_database(database)
+            database.close()
+
+        user_directory.reset()
+
+    def test_results_match(self):
+        mysql, sqlite = [run_queries(database) for database in self.databases]
+
+        self.assertEqual(len(mysql), len(sqlite))
+
+        for expected, actual in zip(mysql, sqlite):
+            self.assertEqual(expected, actual)
@@ -0,0 +1,49 @@
+import threading
+import time
+import unittest
+
+from billing_server.billing import fanout
+
+
+class Test(unittest.TestCase):
+
+    def test_results_keep_task_order(self):
+        tasks = [lambda delay=delay, index=index: time.sleep(delay) or index
+                 for index, delay in enumerate([0.05, 0, 0.02, 0])]
+
+        self.assertEqual([0, 1, 2, 3], fanout.run_all(tasks, 4))
+
+    def test_limits_tasks_in_flight(self):
+        lock = threading.Lock()
+        counts = {'running': 0, 'most': 0}
+
+        def task():
+            with lock:
+                counts['running'] += 1
+                counts['most'] = max(counts['most'], counts['running'])
+
+            time.sleep(0.01)
+
+            with lock:
+                counts['running'] -= 1
+
+        fanout.run_all([task] * 12, 2)
+
+        self.assertEqual(2, counts['most'])
+
+    def test_tasks_run_concurrently(self):
+        started = time.monotonic()
+        fanout.run_all([lambda: time.sleep(0.1)] * 4, 4)
+
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_failure_is_raised_and_queued_tasks_are_cancelled(self):
+        ran = []
+
+        def fail():
+            raise ValueError('query failed')
+
+        with self.assertRaises(ValueError):
+            fanout.run_all([fail] + [lambda: ran.append(True)] * 5, 1)
+
+        self.assertEqual([], ran)
@@ -0,0 +1,66 @@
+import unittest
+
+from billing_server.billing import app, metrics
+from prometheus_client import REGISTRY
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_requests_are_counted_per_endpoint(self):
+        labels = {'endpoint': 'get_price', 'method': 'GET'}
+        before = sample('billing_http_request_duration_seconds_count', **labels)
+        ok_before = sample('billing_http_requests_total', status='200', **labels)
+
+        self.client.get('/price?date=2016-01-01')
+        self.client.get('/price?date=2016-01-01')
+
+        self.assertEqual(before + 2, sample('billing_http_request_duration_seconds_count', **labels))
+        self.assertEqual(ok_before + 2, sample('billing_http_requests_total', status='200', **labels))
+
+    def test_unknown_paths_share_a_label(self):
+        labels = {'endpoint': 'unmatched', 'method': 'GET', 'status': '404'}
+        before = sample('billing_http_requests_total', **labels)
+
+        self.client.get('/no-such-page')
+        self.client.get('/another-one')
+
+        self.assertEqual(before + 2, sample('billing_http_requests_total', **labels))
+
+    def test_dependency_errors_are_counted(self):
+        labels = {'dependency': 'keystone', 'call': 'test_call'}
+
+        with self.assertRaises(ValueError):
+            with metrics.dependency('keystone', 'test_call'):
+                raise ValueError()
+
+        self.assertEqual(1, sample('billing_dependency_duration_seconds_count', **labels))
+        self.assertEqual(1, sample('billing_dependency_errors_total', **labels))
+
+    def test_observed_methods_keep_their_name(self):
+        @metrics.observed
+        def get_something():
+            return 'rows'
+
+        self.assertEqual('rows', get_something())
+        self.assertEqual('get_something', get_something.__name__)
+        self.assertEqual(1, sample('billing_query_duration_seconds_count', method='get_something'))
+
+    def test_metrics_endpoint(self):
+        self.client.get('/price?date=2016-01-01')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn(b'billing_http_request_duration_seconds_bucket{endpoint="get_price"', response.data)
+
+    def test_metrics_endpoint_refuses_other_addresses(self):
+        response = self.client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'})
+
+        self.assertEqual(403, response.status_code)
@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from billing_server.billing import usage_queries
+
+
+class GraphiteHandler(BaseHTTPRequestHandler):
+    # Stands in for Graphite's /render endpoint, serving one datapoint per hour for every requested project
+
+    def do_GET(self):
+        self.server.requests.append(parse_qs(urlparse(self.path).query))
+        params = self.server.requests[-1]
+        target = params['target'][0]
+        projects = target[target.index('{') + 1:target.index('}')].split(',')
+        start = int(params['from'][0])
+        until = int(params['until'][0])
+
+        body = json.dumps([
+            {
+                'target': 'object_usage.' + project,
+                'datapoints': [[1000000000, point] for point in range(start, until, 3600)],
+            }
+            for project in projects
+        ]).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.graphite = HTTPServer(('127.0.0.1', 0), GraphiteHandler)
+        self.graphite.requests = []
+        threading.Thread(target=self.graphite.serve_forever, daemon=True).start()
+
+        self.database = usage_queries.Collaboratory(
+            'sqlite://',
+            'http://127.0.0.1:{}'.format(self.graphite.server_port),
+            logging.getLogger('test_object_storage'),
+            'billing',
+            False
+        )
+        self.buckets = [
+            ('2016-09-11 00:00:00-04:00', '2016-09-12 00:00:00-04:00'),
+            ('2016-09-12 00:00:00-04:00', '2016-09-13 00:00:00-04:00'),
+            ('2016-09-13 00:00:00-04:00', '2016-09-13 12:00:00-04:00'),
+        ]
+
+    def tearDown(self):
+        self.graphite.shutdown()
+        self.graphite.server_close()
+        self.database.close()
+
+    def test_one_request_per_report(self):
+        rows = self.database.get_object_storage_by_bucket(self.buckets, ['project-a', 'project-b'])
+
+        self.assertEqual(1, len(self.graphite.requests))
+        self.assertEqual([
+            (0, 'project-a', 24),
+            (1, 'project-a', 24),
+            (2, 'project-a', 12),
+            (0, 'project-b', 24),
+            (1, 'project-b', 24),
+            (2, 'project-b', 12),
+        ], [(row['bucket'], row['projectId'], row['objects']) for row in rows])
+
+    def test_per_bucket_fetch_makes_a_request_per_bucket(self):
+        for start_date, end_date in self.buckets:
+            self.database.get_object_storage_by_project(start_date, end_date, ['project-a'])
+
+        self.assertEqual(len(self.buckets), len(self.graphite.requests))
+
+    def test_per_bucket_fetch_labels_each_project(self):
+        rows = self.database.get_object_storage_by_project(self.buckets[0][0], self.buckets[0][1],
+                                                           ['project-a', 'project-b'])
+
+        self.assertEqual(['project-a', 'project-b'], [row['projectId'] for row in rows])
+
+    def test_no_buckets(self):
+        self.assertEqual([], self.database.get_object_storage_by_bucket([], ['project-a']))
+        self.assertEqual(0, len(self.graphite.requests))
+
+    def test_unreachable_graphite_is_logged(self):
+        self.database.graphite_url = 'http://127.0.0.1:{}'.format(self.graphite.server_port)
+        self.graphite.shutdown()
+        self.graphite.server_close()
+
+        with self.assertLogs('test_object_storage', level='ERROR') as logs:
+            self.assertEqual([], self.database.get_object_storage_by_bucket(self.buckets, ['project-a']))
+
+        self.assertIn('at get_object_storage_by_bucket: ', logs.output[0])
+        self.assertIn('Connection', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
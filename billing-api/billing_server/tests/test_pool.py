@@ -0,0 +1,42 @@
+import logging
+import unittest
+
+from billing_server.billing import pool, usage_queries
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        pool.dispose()
+
+    def tearDown(self):
+        pool.dispose()
+
+    def test_engine_is_shared_per_url(self):
+        self.assertIs(pool.get_engine('sqlite://'), pool.get_engine('sqlite://'))
+
+    def test_collaboratory_returns_connection_on_close(self):
+        database = usage_queries.Collaboratory(
+            'sqlite://',
+            'http://localhost:8080',
+            logging.getLogger('test_pool'),
+            'billing',
+            False
+        )
+        self.assertTrue(database.database.open)
+        database.close()
+        self.assertFalse(database.database.open)
+
+        # closing twice must not try to return the connection again
+        database.close()
+
+    def test_status_reports_waits(self):
+        connection, waited = pool.connect('sqlite://')
+        connection.close()
+        status = pool.status('sqlite://')
+        self.assertGreaterEqual(status['waits'], 1)
+        self.assertGreaterEqual(status['wait_seconds_max'], waited)
+
+
+if __name__ == '__main__':
+    unittest.main()
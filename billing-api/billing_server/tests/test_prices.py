@@ -0,0 +1,83 @@
+import json
+import os
+import time
+import unittest
+from datetime import datetime
+
+from billing_server.billing import app
+
+
+class HostTimezone:
+    # Runs a block as if the server's own timezone were the given one
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.previous = os.environ.get('TZ')
+        os.environ['TZ'] = self.name
+        time.tzset()
+
+    def __exit__(self, *exc_info):
+        if self.previous is None:
+            del os.environ['TZ']
+
+        else:
+            os.environ['TZ'] = self.previous
+
+        time.tzset()
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_price_matrix(self):
+        response = self.client.get('/prices?dates=2016-01-01,2020-05-10&projects=oicr_demo_ironman,other')
+        body = response.get_json()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['2016-01-01', '2020-05-10'], body['dates'])
+        self.assertEqual(['oicr_demo_ironman', 'other'], body['projects'])
+        self.assertEqual(2, len(body['prices']))
+        self.assertEqual([[0, 0], [0.9, 0]], body['discounts'])
+
+        for date, prices in zip(body['dates'], body['prices']):
+            self.assertEqual(prices, json.loads(self.client.get('/price?date=' + date).data))
+
+    def test_price_reads_dates_in_the_report_timezone(self):
+        # 2016-11-03 starts a price period; read as UTC midnight it would fall in the previous one
+        expected = app.pricing.lookup_json(app.timezone.localize(datetime(2016, 11, 3)))
+
+        with HostTimezone('UTC'):
+            self.assertEqual(json.loads(expected), json.loads(self.client.get('/price?date=2016-11-03').data))
+
+    def test_prices_match_price_on_period_boundaries(self):
+        # First days of a price period and of a discount period, on a host that isn't in the report timezone
+        dates = ['2016-11-03', '2016-12-22', '2020-05-01', '2020-06-01']
+
+        with HostTimezone('UTC'):
+            body = self.client.get('/prices?dates={}&projects=oicr_demo_ironman'.format(','.join(dates))).get_json()
+
+            for date, prices, discounts in zip(dates, body['prices'], body['discounts']):
+                single = json.loads(self.client.get('/price?date={}&projects=oicr_demo_ironman'.format(date)).data)
+
+                self.assertEqual(dict(prices, discount=discounts[0]), single['oicr_demo_ironman'])
+
+    def test_cache_headers(self):
+        response = self.client.get('/prices?dates=2016-01-01&projects=other')
+        etag = response.headers['ETag']
+
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('max-age=', response.headers['Cache-Control'])
+
+        cached = self.client.get('/prices?dates=2016-01-01&projects=other', headers={'If-None-Match': etag})
+        self.assertEqual(304, cached.status_code)
+
+        other = self.client.get('/prices?dates=2016-01-02&projects=other')
+        self.assertNotEqual(etag, other.headers['ETag'])
+
+    def test_dates_are_required(self):
+        self.assertEqual(400, self.client.get('/prices?projects=other').status_code)
+        self.assertEqual(400, self.client.get('/prices?dates=yesterday-ish').status_code)
@@ -0,0 +1,104 @@
+import json
+import unittest
+from datetime import datetime
+
+import pytz
+
+from billing_server.billing.pricing import DiscountIndex, PricingIndex
+
+TIMEZONE = pytz.timezone('America/Toronto')
+
+
+def period(start, end, price):
+    return {
+        'period_start': start,
+        'period_end': end,
+        'cpu_price': price,
+        'volume_price': price / 2,
+        'image_price': price,
+        'object_storage_price': price,
+    }
+
+
+def local(*args):
+    return TIMEZONE.localize(datetime(*args))
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.pricing = PricingIndex([
+            period('2013-01-01', '2016-11-03', 0.04),
+            period('2016-11-03', '2016-12-22', 0.06),
+            period('2016-12-22', '2018-01-01', 0.08),
+        ], TIMEZONE)
+
+    def test_lookup(self):
+        self.assertEqual(0.04, self.pricing.lookup(local(2012, 1, 1)).cpu_price)
+        self.assertEqual(0.04, self.pricing.lookup(local(2016, 11, 2, 23, 59)).cpu_price)
+        self.assertEqual(0.06, self.pricing.lookup(local(2016, 11, 3)).cpu_price)
+        self.assertEqual(0.08, self.pricing.lookup(local(2017, 6, 1)).cpu_price)
+        self.assertEqual(0.08, self.pricing.lookup(local(2020, 1, 1)).cpu_price)
+
+    def test_lookups_share_period_objects(self):
+        self.assertIs(self.pricing.lookup(local(2016, 11, 4)), self.pricing.lookup(local(2016, 12, 1)))
+        self.assertIs(self.pricing.lookup_json(local(2016, 11, 4)), self.pricing.lookup_json(local(2016, 12, 1)))
+
+    def test_lookup_json(self):
+        self.assertEqual(
+            {'cpuPrice': 0.06, 'imagePrice': 0.06, 'volumePrice': 0.03, 'objectsPrice': 0.06},
+            json.loads(self.pricing.lookup_json(local(2016, 12, 1)))
+        )
+
+    def test_rejects_bad_config(self):
+        with self.assertRaisesRegex(ValueError, 'at least one'):
+            PricingIndex([], TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'overlap'):
+            PricingIndex([period('2013-01-01', '2016-11-03', 1), period('2016-01-01', '2017-01-01', 1)], TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'overlap'):
+            PricingIndex([period('2016-11-03', '2017-01-01', 1), period('2013-01-01', '2016-11-03', 1)], TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'ends before it starts'):
+            PricingIndex([period('2017-01-01', '2016-01-01', 1)], TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'missing cpu_price'):
+            broken = period('2013-01-01', '2016-11-03', 1)
+            del broken['cpu_price']
+            PricingIndex([broken], TIMEZONE)
+
+    def test_discounts(self):
+        discounts = DiscountIndex({
+            'dated': [
+                {'period_start': '2020-06', 'period_end': '2020-06', 'discount': 0.7},
+                {'period_start': '2020-05', 'period_end': '2020-05', 'discount': 0.9},
+                {'discount': 0.1},
+            ],
+            'always': [{'discount': 0.8}],
+            'open_ended': [{'period_start': '2021-01', 'discount': 0.5}],
+        }, TIMEZONE)
+
+        self.assertEqual(0.1, discounts.lookup('dated', local(2020, 4, 30, 23, 59)))
+        self.assertEqual(0.9, discounts.lookup('dated', local(2020, 5, 1)))
+        self.assertEqual(0.9, discounts.lookup('dated', local(2020, 5, 31, 23, 59)))
+        self.assertEqual(0.7, discounts.lookup('dated', local(2020, 6, 15)))
+        self.assertEqual(0.1, discounts.lookup('dated', local(2020, 7, 1)))
+        self.assertEqual(0.8, discounts.lookup('always', local(2020, 7, 1)))
+        self.assertEqual(0, discounts.lookup('open_ended', local(2020, 12, 31)))
+        self.assertEqual(0.5, discounts.lookup('open_ended', local(2030, 1, 1)))
+        self.assertEqual(0, discounts.lookup('unknown', local(2020, 7, 1)))
+
+    def test_rejects_bad_discounts(self):
+        with self.assertRaisesRegex(ValueError, 'overlap'):
+            DiscountIndex({'project': [
+                {'period_start': '2020-05', 'period_end': '2020-07', 'discount': 0.9},
+                {'period_start': '2020-06', 'period_end': '2020-06', 'discount': 0.7},
+            ]}, TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'between 0 and 1'):
+            DiscountIndex({'project': [{'discount': 90}]}, TIMEZONE)
+
+        with self.assertRaisesRegex(ValueError, 'ends before it starts'):
+            DiscountIndex({'project': [{'period_start': '2020-06', 'period_end': '2020-05', 'discount': 0.5}]},
+                          TIMEZONE)
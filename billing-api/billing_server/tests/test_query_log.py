@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import date
+
+import mock
+import pytz
+
+from billing_server.billing import query_log, user_directory
+from billing_server.billing.rollup import RollupStore
+from billing_server.billing.usage_queries import Collaboratory
+from .mock_openstack_database_setup import create_user, initialize_database, teardown_database
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.collaboratory = Collaboratory('sqlite://', 'http://localhost:8080', mock.Mock(), 'billing', False)
+        initialize_database(self.collaboratory)
+        create_user(self.collaboratory, '1', 'Articuno', '{}')
+        create_user(self.collaboratory, '2', 'Zapdos')
+        self.entries = []
+        query_log.add_listener(self.entries.append)
+
+    def tearDown(self):
+        query_log.remove_listener(self.entries.append)
+        query_log.configure()
+        teardown_database(self.collaboratory)
+        self.collaboratory.close()
+        user_directory.reset()
+
+    def test_statements_are_described(self):
+        query_log.configure(threshold=None)
+
+        extras = self.collaboratory.get_users_extras(['1', '2'])
+
+        self.assertEqual({'1': {}, '2': None}, extras)
+        self.assertEqual(1, len(self.entries))
+        self.assertEqual('get_users_extras', self.entries[0]['method'])
+        self.assertEqual(2, self.entries[0]['rows'])
+        self.assertEqual({'user_ids': 2}, self.entries[0]['in_lists'])
+        self.assertIn('keystone.user', self.entries[0]['sql'])
+        self.collaboratory.logger.warning.assert_not_called()
+
+    def test_user_directory_queries_are_described(self):
+        query_log.configure(threshold=None)
+
+        self.collaboratory.users.refresh(full=True)
+        self.collaboratory.users.lookup('nobody')
+
+        self.assertEqual([('UserDirectory.refresh', 0), ('UserDirectory.lookup', 0)],
+                         [(entry['method'], entry['rows']) for entry in self.entries])
+
+    def test_rollup_queries_are_described(self):
+        query_log.configure(threshold=None)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = RollupStore(os.path.join(directory, 'usage.sqlite'), pytz.timezone('America/Toronto'))
+            store.rebuild(self.collaboratory, date(2016, 9, 12), date(2016, 9, 13))
+
+        self.assertEqual(['query_instance_core_hours_by_bucket', 'query_volume_gigabyte_hours_by_bucket',
+                          'query_image_storage_gigabyte_hours_by_bucket'],
+                         [entry['method'] for entry in self.entries])
+        self.assertEqual(2, self.entries[0]['buckets'])
+
+    def test_describe(self):
+        entry = query_log.describe('query_instance_core_hours_by_bucket', 'SELECT 1', {
+            'billing_projects': ['a', 'b', 'c'],
+            'user_projects': ('d',),
+            'user_id': 'user',
+            'bucket_start_0': '2016-09-01 00:00:00-04:00',
+            'bucket_end_0': '2016-09-02 00:00:00-04:00',
+            'bucket_start_1': '2016-09-02 00:00:00-04:00',
+            'bucket_end_1': '2016-09-03 00:00:00-04:00',
+        }, 1.23456, 10)
+
+        self.assertEqual({'billing_projects': 3, 'user_projects': 1}, entry['in_lists'])
+        self.assertEqual(2, entry['buckets'])
+        self.assertEqual('2016-09-01 00:00:00-04:00', entry['start_date'])
+        self.assertEqual('2016-09-03 00:00:00-04:00', entry['end_date'])
+        self.assertEqual(1.2346, entry['duration'])
+
+    def test_slow_queries_are_logged_as_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.log')
+            query_log.configure(threshold=0, path=path)
+            self.collaboratory.get_user_extras('1')
+
+            with open(path) as log:
+                line = json.loads(log.readline())
+
+            query_log.configure()
+
+        self.assertEqual('get_user_extras', line['method'])
+        self.assertEqual(1, line['rows'])
+        self.assertNotIn('sql', line)
+
+    def test_slow_queries_go_to_the_logger_without_a_path(self):
+        query_log.configure(threshold=0)
+
+        self.collaboratory.get_project_billing_map()
+
+        self.collaboratory.logger.warning.assert_called_once()
+        self.assertIn('"method": "get_project_billing_map"', self.collaboratory.logger.warning.call_args[0][0])
@@ -0,0 +1,94 @@
+import logging
+import unittest
+
+from billing_server.billing import query_log, query_plans, user_directory
+from billing_server.billing.usage_queries import Collaboratory
+from .mock_openstack_database_setup import initialize_database, teardown_database
+
+SQL = '''
+    SELECT user_id, project_id, SUM(vcpus)
+    FROM nova.instances
+    WHERE created_at < :end_date AND project_id IN :billing_projects
+    GROUP BY user_id, project_id
+'''
+
+
+def plan_row(table, access, key=None, extra=None):
+    return {
+        'id': 1, 'select_type': 'SIMPLE', 'table': table, 'type': access, 'possible_keys': None,
+        'key': key, 'key_len': None, 'ref': None, 'rows': 1234, 'filtered': 100.0, 'Extra': extra,
+    }
+
+
+class Test(unittest.TestCase):
+
+    def test_flags_scans_filesorts_and_temporary_tables(self):
+        plan = [
+            plan_row('<derived2>', 'ALL'),
+            plan_row('instances', 'ALL', extra='Using where; Using temporary; Using filesort'),
+        ]
+
+        self.assertEqual(
+            [('full_scan', 'nova.instances'), ('filesort', 'instances'), ('temporary', 'instances')],
+            query_plans.findings(SQL, plan)
+        )
+
+    def test_indexed_access_is_not_flagged(self):
+        self.assertEqual([], query_plans.findings(SQL, [plan_row('instances', 'range', key='project_id')]))
+
+    def test_suggests_missing_indexes_only(self):
+        found = [('full_scan', 'nova.instances'), ('full_scan', 'glance.images'), ('filesort', 'instances')]
+
+        self.assertEqual(
+            ['CREATE INDEX billing_project_id_created_at_deleted_at ON nova.instances '
+             '(project_id, created_at, deleted_at);'],
+            query_plans.suggest_indexes(found, {'glance.images': [('owner',)]})
+        )
+
+    def test_analyze_prefix(self):
+        self.assertEqual('ANALYZE', query_plans.analyze_prefix('10.3.27-MariaDB-0+deb10u1'))
+        self.assertEqual('EXPLAIN ANALYZE', query_plans.analyze_prefix('8.0.23'))
+        self.assertIsNone(query_plans.analyze_prefix('5.7.33-log'))
+
+    def test_report_leaves_out_row_estimates(self):
+        plan = [plan_row('instances', 'ALL', extra='Using where')]
+        found = query_plans.findings(SQL, plan)
+        report = query_plans.format_report([('get_instance_core_hours', plan, found, [], None)])
+
+        self.assertEqual([
+            '== get_instance_core_hours',
+            'id  select_type  table      type  key  ref  Extra',
+            '1   SIMPLE       instances  ALL   -    -    Using where',
+            '! full table scan of nova.instances',
+            '',
+        ], report.split('\n'))
+        self.assertNotIn('1234', report)
+
+    def test_capture_collects_the_statements_of_a_call(self):
+        def fake_method():
+            for number in range(2):
+                query_log.record(query_log.describe('fake_method', 'SELECT {}'.format(number), {}, 0, 0))
+
+        entries = query_plans.capture(fake_method)
+
+        self.assertEqual(['SELECT 0', 'SELECT 1'], [entry['sql'] for entry in entries])
+        self.assertEqual([], query_plans.capture(lambda: None))
+
+    def test_explain_binds_project_lists(self):
+        database = Collaboratory('sqlite://', 'http://localhost:8080', logging.getLogger('test_query_plans'),
+                                 'billing', False)
+        initialize_database(database)
+
+        try:
+            entries = query_plans.capture(database.query_instance_core_hours_by_bucket,
+                                          [('2016-09-01 00:00:00', '2016-09-02 00:00:00')], ['a', 'b'], [], 'user')
+            plan, analyzed = query_plans.explain(database.connection, entries[0])
+
+        finally:
+            teardown_database(database)
+            database.close()
+            user_directory.reset()
+
+        self.assertEqual({'billing_projects': 2, 'user_projects': 1}, entries[0]['in_lists'])
+        self.assertTrue(plan)
+        self.assertIsNone(analyzed)
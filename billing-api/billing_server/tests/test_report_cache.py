@@ -0,0 +1,140 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+import mock
+from prometheus_client import REGISTRY
+
+from billing_server import billing
+from billing_server.billing import app, get_cached_usage
+from billing_server.billing.buckets import Bucket
+from billing_server.billing.report_cache import ReportCache, ReportCacheKey
+from billing_server.billing.rollup import RollupStore
+from billing_server.billing.usage import UsageRecord
+
+
+def key(start_date, end_date, billing_projects=('project',), user_projects=()):
+    return ReportCacheKey('requester', billing_projects, user_projects, 'requester', 'daily', start_date, end_date)
+
+
+def bucket_range(start_date, end_date):
+    return Bucket(0, start_date, end_date, None)
+
+
+def fake_usage(database, date_ranges, billing_projects, user_projects, user):
+    return [UsageRecord(bucket, 'cpu', user, 'project', user, 1) for bucket in date_ranges]
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.report_cache = app.report_cache
+        self.rollup = app.rollup
+        app.report_cache = ReportCache(max_entries=100)
+
+    def tearDown(self):
+        app.report_cache = self.report_cache
+        app.rollup = self.rollup
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ReportCache(max_entries=2)
+        cache.put(key('2016-09-01', '2016-09-02'), ['a'])
+        cache.put(key('2016-09-02', '2016-09-03'), ['b'])
+        cache.get(key('2016-09-01', '2016-09-02'))
+        cache.put(key('2016-09-03', '2016-09-04'), ['c'])
+
+        self.assertEqual(['a'], cache.get(key('2016-09-01', '2016-09-02')))
+        self.assertIsNone(cache.get(key('2016-09-02', '2016-09-03')))
+        self.assertEqual(
+            {'entries': 2, 'rows': 2, 'hits': 2, 'misses': 1, 'evictions': 1, 'hit_rate': 0.6667},
+            cache.stats()
+        )
+
+    def test_total_rows_are_bounded(self):
+        cache = ReportCache(max_entries=100, max_rows=5)
+        cache.put(key('2016-09-01', '2016-09-02'), ['a', 'b'])
+        cache.put(key('2016-09-02', '2016-09-03'), ['c', 'd'])
+        cache.put(key('2016-09-03', '2016-09-04'), ['e', 'f'])
+
+        self.assertIsNone(cache.get(key('2016-09-01', '2016-09-02')))
+        self.assertEqual(4, cache.stats()['rows'])
+
+        # A bucket bigger than the whole cache is left out rather than emptying it
+        cache.put(key('2016-09-04', '2016-09-05'), list('ghijkl'))
+        self.assertIsNone(cache.get(key('2016-09-04', '2016-09-05')))
+        self.assertEqual(2, cache.stats()['entries'])
+
+        # Replacing an entry doesn't count its old rows twice
+        cache.put(key('2016-09-03', '2016-09-04'), ['e'])
+        self.assertEqual(3, cache.stats()['rows'])
+
+    def test_invalidation(self):
+        cache = ReportCache()
+        cache.put(key('2016-09-01', '2016-09-02'), ['a'])
+        cache.put(key('2016-09-02', '2016-09-03'), ['b'])
+        cache.put(key('2016-09-02', '2016-09-03', ('',), ('other',)), ['c'])
+
+        self.assertEqual(1, cache.invalidate_range('2016-09-01 12:00', '2016-09-02'))
+        self.assertEqual(['b'], cache.get(key('2016-09-02', '2016-09-03')))
+        self.assertEqual(2, cache.invalidate())
+        self.assertEqual(0, cache.stats()['entries'])
+        self.assertEqual(0, cache.stats()['rows'])
+
+    def test_only_finished_buckets_are_cached(self):
+        now = datetime.now(app.timezone).replace(microsecond=0)
+        date_ranges = [
+            bucket_range(now - timedelta(days=3), now - timedelta(days=2)),
+            bucket_range(now - timedelta(days=2), now - timedelta(hours=1)),
+        ]
+        report_key = ('requester', ('project',), (), 'requester', 'daily')
+
+        with mock.patch.object(billing, 'get_usage', side_effect=fake_usage) as get_usage:
+            first = get_cached_usage(None, date_ranges, ['project'], [], 'requester', report_key)
+            second = get_cached_usage(None, date_ranges, ['project'], [], 'requester', report_key)
+
+        self.assertEqual(first, second)
+        self.assertEqual([date_ranges[0].start_date, date_ranges[1].start_date],
+                         [record.bucket.start_date for record in second])
+
+        # The bucket that ended an hour ago is inside the safety margin, so it's the only one queried again
+        self.assertEqual(date_ranges, get_usage.call_args_list[0][0][1])
+        self.assertEqual(date_ranges[1:], get_usage.call_args_list[1][0][1])
+        self.assertEqual(1, app.report_cache.stats()['entries'])
+
+    def test_buckets_of_days_the_rollup_changed_are_queried_again(self):
+        now = datetime.now(app.timezone).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        date_ranges = [
+            bucket_range(app.timezone.localize(now - timedelta(days=days)),
+                         app.timezone.localize(now - timedelta(days=days - 1)))
+            for days in (4, 3)
+        ]
+        report_key = ('requester', ('project',), (), 'requester', 'daily')
+        hits = REGISTRY.get_sample_value('billing_report_cache_lookups_total', {'result': 'hit'}) or 0
+
+        with tempfile.TemporaryDirectory() as directory:
+            app.rollup = RollupStore(os.path.join(directory, 'usage.sqlite'), app.timezone)
+            app.report_cache_checked_at = time.time()
+
+            with mock.patch.object(billing, 'get_usage', side_effect=fake_usage) as get_usage:
+                get_cached_usage(None, date_ranges, ['project'], [], 'requester', report_key)
+                get_cached_usage(None, date_ranges, ['project'], [], 'requester', report_key)
+                self.assertEqual(1, get_usage.call_count)
+
+                # rollup.py re-rated the later day; only its bucket is dropped
+                app.rollup.record_changes([(now - timedelta(days=3)).date().isoformat()])
+                get_cached_usage(None, date_ranges, ['project'], [], 'requester', report_key)
+
+        self.assertEqual(date_ranges[1:], get_usage.call_args_list[1][0][1])
+        self.assertEqual(hits + 3, REGISTRY.get_sample_value('billing_report_cache_lookups_total', {'result': 'hit'}))
+
+    def test_reports_of_different_requesters_are_kept_apart(self):
+        now = datetime.now(app.timezone).replace(microsecond=0)
+        date_ranges = [bucket_range(now - timedelta(days=3), now - timedelta(days=2))]
+
+        with mock.patch.object(billing, 'get_usage', side_effect=fake_usage) as get_usage:
+            get_cached_usage(None, date_ranges, ['project'], [], 'a', ('a', ('project',), (), 'a', 'daily'))
+            get_cached_usage(None, date_ranges, ['project'], [], 'b', ('b', ('project',), (), 'b', 'daily'))
+
+        self.assertEqual(2, get_usage.call_count)
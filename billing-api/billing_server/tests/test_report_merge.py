@@ -0,0 +1,88 @@
+import unittest
+from datetime import datetime
+
+from dateutil.parser import parse
+
+from billing_server.billing import app, get_bucket_functions, merge_usage
+from billing_server.billing.buckets import Bucket
+from billing_server.billing.pricing import PricePeriod
+from billing_server.billing.usage import UsageRecord
+
+PERIOD = PricePeriod(
+    period_start=app.timezone.localize(datetime(2016, 1, 1)),
+    period_end=app.timezone.localize(datetime(2017, 1, 1)),
+    cpu_price=0.5,
+    volume_price=0.25,
+    image_price=0.1,
+    object_storage_price=0.2,
+)
+
+
+class Test(unittest.TestCase):
+
+    def usage(self, from_date, user, project_id, resource, quantity):
+        bucket = Bucket(0, parse(from_date), None, PERIOD)
+
+        return UsageRecord(bucket, resource, user, project_id, user, quantity)
+
+    def test_merges_rows_in_the_same_bucket(self):
+        same_bucket, next_bucket, start_of_bucket = get_bucket_functions('weekly')
+        responses = [
+            self.usage('2016-09-12 00:00:00-04:00', 'user', 'project', 'cpu', 10),
+            self.usage('2016-09-13 00:00:00-04:00', 'user', 'project', 'cpu', 4),
+            self.usage('2016-09-13 00:00:00-04:00', 'user', 'project', 'volume', 8),
+            self.usage('2016-09-13 00:00:00-04:00', None, 'project', 'image', 2),
+            self.usage('2016-09-19 00:00:00-04:00', 'user', 'project', 'cpu', 1),
+            self.usage('2016-09-14 00:00:00-04:00', None, 'project', 'objects', 1.5),
+        ]
+
+        report = merge_usage(responses, next_bucket, start_of_bucket)
+
+        self.assertEqual(3, len(report))
+        self.assertEqual('2016-09-12T00:00:00-04:00', report[0]['fromDate'])
+        self.assertEqual('2016-09-19T00:00:00-04:00', report[0]['toDate'])
+        self.assertEqual('user', report[0]['username'])
+        self.assertEqual(14, report[0]['cpu'])
+        self.assertEqual(7, report[0]['cpuCost'])
+        self.assertEqual(8, report[0]['volume'])
+        self.assertEqual(2, report[0]['volumeCost'])
+        self.assertEqual(2, report[1]['image'])
+        self.assertEqual(0.2, report[1]['imageCost'])
+        self.assertEqual(1.5, report[1]['objects'])
+        self.assertEqual(None, report[1]['user'])
+        self.assertNotIn('username', report[1])
+        self.assertEqual('2016-09-19T00:00:00-04:00', report[2]['fromDate'])
+        self.assertEqual(1, report[2]['cpu'])
+
+    def test_keeps_users_and_projects_apart(self):
+        same_bucket, next_bucket, start_of_bucket = get_bucket_functions('daily')
+        responses = [
+            self.usage('2016-09-12 00:00:00-04:00', 'a', 'project', 'cpu', 1),
+            self.usage('2016-09-12 00:00:00-04:00', 'b', 'project', 'cpu', 2),
+            self.usage('2016-09-12 00:00:00-04:00', 'a', 'other', 'cpu', 3),
+            self.usage('2016-09-12 12:00:00-04:00', 'a', 'project', 'cpu', 4),
+        ]
+
+        report = merge_usage(responses, next_bucket, start_of_bucket)
+
+        self.assertEqual([('a', 'project', 5), ('b', 'project', 2), ('a', 'other', 3)],
+                         [(entry['user'], entry['projectId'], entry['cpu']) for entry in report])
+        self.assertEqual('2016-09-13T00:00:00-04:00', report[0]['toDate'])
+
+    def test_storage_is_only_billed_per_project(self):
+        same_bucket, next_bucket, start_of_bucket = get_bucket_functions('daily')
+        responses = [
+            self.usage('2016-09-12 00:00:00-04:00', None, 'project', 'cpu', 1),
+            self.usage('2016-09-12 00:00:00-04:00', 'a', 'project', 'image', 2),
+            self.usage('2016-09-12 00:00:00-04:00', 'a', 'project', 'volume', None),
+        ]
+
+        report = merge_usage(responses, next_bucket, start_of_bucket)
+
+        self.assertNotIn('cpu', report[0])
+        self.assertNotIn('image', report[1])
+        self.assertNotIn('volume', report[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime
+
+from billing_server.billing import app, divide_time_range, dump_cursor, load_cursor, parse_page_size
+from billing_server.billing.error import BadRequestError
+
+
+def local(*args):
+    return app.timezone.localize(datetime(*args))
+
+
+class Test(unittest.TestCase):
+
+    def pages(self, start_date, end_date, bucket_size, page_size):
+        pages = []
+        while start_date < end_date:
+            date_ranges = divide_time_range(start_date, end_date, bucket_size, page_size)[0]
+            pages.append(date_ranges)
+            start_date = date_ranges[-1].end_date
+
+        return pages
+
+    def test_without_page_size_oldest_buckets_are_dropped(self):
+        date_ranges = divide_time_range(local(2019, 1, 1), local(2020, 1, 1), 'daily')[0]
+
+        self.assertGreater(len(date_ranges), 60)
+        self.assertLess(len(date_ranges), 70)
+        self.assertEqual(local(2020, 1, 1), date_ranges[-1].end_date)
+
+    def test_pages_cover_the_whole_range(self):
+        pages = self.pages(local(2019, 1, 1), local(2020, 1, 1), 'daily', 30)
+        date_ranges = [bucket for page in pages for bucket in page]
+
+        self.assertEqual(13, len(pages))
+        self.assertEqual(local(2019, 1, 1), date_ranges[0].start_date)
+        self.assertEqual(local(2020, 1, 1), date_ranges[-1].end_date)
+
+        for previous, bucket in zip(date_ranges, date_ranges[1:]):
+            self.assertEqual(previous.end_date, bucket.start_date)
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(10, parse_page_size('10'))
+        self.assertEqual(app.config['REPORT_MAX_BUCKETS'], parse_page_size('100000'))
+        self.assertIsNone(parse_page_size(None))
+
+        with self.assertRaises(BadRequestError):
+            parse_page_size('0')
+
+        with self.assertRaises(BadRequestError):
+            parse_page_size('lots')
+
+    def test_cursor_round_trip(self):
+        report_args = {'bucket': 'daily', 'next': '2019-02-01 00:00:00-05:00', 'pageSize': 31}
+        cursor = dump_cursor(report_args)
+
+        self.assertEqual(report_args, load_cursor(cursor))
+
+        with self.assertRaises(BadRequestError):
+            load_cursor(cursor[:-2] + 'xx')
@@ -0,0 +1,213 @@
+import logging
+import os
+import tempfile
+import unittest
+from datetime import date, datetime
+
+import pytz
+
+from billing_server.billing import usage_queries, user_directory
+from billing_server.billing.rollup import RollupStore
+from .mock_openstack_database_setup import (
+    create_image, create_instance, execute, initialize_database, teardown_database
+)
+
+
+class FakeDatabase:
+    # Rates every day it's asked about at 24 core hours, and records which days those were
+
+    def __init__(self, earliest=None):
+        self.earliest = earliest
+        self.rated = []
+
+    def get_usage_changes_since(self, resource, watermark):
+        return {'changed': 0 if self.earliest is None else 1, 'earliest': self.earliest, 'open': 1}
+
+    def query_instance_core_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        self.rated.extend(buckets)
+        return [{'bucket': index, 'user': 'user', 'projectId': 'project', 'cpu': 24} for index in range(len(buckets))]
+
+    def query_volume_gigabyte_hours_by_bucket(self, buckets, billing_projects, user_projects, user_id):
+        return []
+
+    def query_image_storage_gigabyte_hours_by_bucket(self, buckets, projects):
+        return []
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = RollupStore(os.path.join(self.directory.name, 'usage.sqlite'), pytz.timezone('America/Toronto'))
+        self.store.store_days('cpu', ['2016-09-12', '2016-09-13'], [
+            ('2016-09-12', 'user', 'project', 24),
+            ('2016-09-12', 'other', 'project', 4),
+            ('2016-09-13', 'user', 'project', 10),
+            ('2016-09-13', 'user', 'elsewhere', 7),
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_day_bucket_matches_report_bounds(self):
+        self.assertEqual(('2016-09-12 00:00:00-04:00', '2016-09-13 00:00:00-04:00'),
+                         self.store.day_bucket(date(2016, 9, 12)))
+
+    def test_only_whole_computed_days_are_covered(self):
+        buckets = [
+            ('2016-09-12 00:00:00-04:00', '2016-09-13 00:00:00-04:00'),
+            ('2016-09-13 00:00:00-04:00', '2016-09-13 12:00:00-04:00'),
+            ('2016-09-14 00:00:00-04:00', '2016-09-15 00:00:00-04:00'),
+        ]
+        self.assertEqual({0: ['2016-09-12']}, self.store.covered_buckets('cpu', buckets))
+        self.assertEqual({}, self.store.covered_buckets('volume', buckets))
+
+    def test_longer_buckets_are_not_covered(self):
+        # Days were each rounded up when stored, so their sum would overbill a longer bucket
+        buckets = [('2016-09-12 00:00:00-04:00', '2016-09-14 00:00:00-04:00')]
+        self.assertEqual({}, self.store.covered_buckets('cpu', buckets))
+
+    def test_sum_buckets_filters_projects(self):
+        rows = self.store.sum_buckets('cpu', {0: ['2016-09-12', '2016-09-13']}, ['project'], [''], 'user')
+        self.assertEqual({('user', 'project', 34), ('other', 'project', 4)},
+                         set((row['user'], row['projectId'], row['cpu']) for row in rows))
+
+        rows = self.store.sum_buckets('cpu', {0: ['2016-09-12'], 1: ['2016-09-13']}, [''], ['elsewhere'], 'user')
+        self.assertEqual([(1, 'user', 'elsewhere', 7)],
+                         [(row['bucket'], row['user'], row['projectId'], row['cpu']) for row in rows])
+
+    def test_collaboratory_only_queries_uncovered_buckets(self):
+        database = usage_queries.Collaboratory(
+            'sqlite://',
+            'http://localhost:8080',
+            logging.getLogger('test_rollup'),
+            'billing',
+            False,
+            rollup=self.store
+        )
+        queried = []
+
+        def query(buckets):
+            queried.extend(buckets)
+            return [{'bucket': 0, 'user': 'user', 'projectId': 'project', 'cpu': 3}]
+
+        buckets = [
+            ('2016-09-12 00:00:00-04:00', '2016-09-13 00:00:00-04:00'),
+            ('2016-09-13 00:00:00-04:00', '2016-09-14 00:00:00-04:00'),
+            ('2016-09-14 00:00:00-04:00', '2016-09-14 09:30:00-04:00'),
+        ]
+        rows = database._by_bucket('cpu', query, buckets, ['project'], [''], 'user')
+        database.close()
+
+        self.assertEqual([buckets[2]], queried)
+        self.assertEqual([(0, 'other', 4), (0, 'user', 24), (1, 'user', 10), (2, 'user', 3)],
+                         [(row['bucket'], row['user'], row['cpu']) for row in rows])
+
+    def test_monthly_bucket_matches_live_query(self):
+        database = usage_queries.Collaboratory(
+            'sqlite://',
+            'http://localhost:8080',
+            logging.getLogger('test_rollup'),
+            'billing',
+            False
+        )
+        initialize_database(database)
+        # A 100 MiB image held for all of October is rounded up to a gigabyte-hour per day, but only once a month
+        create_image(database, 'project', 100 * 2 ** 20, '2016-09-01 00:00:00', None)
+
+        try:
+            self.store.rebuild(database, date(2016, 10, 1), date(2016, 10, 31))
+            month = [('2016-10-01 00:00:00-04:00', '2016-11-01 00:00:00-04:00')]
+            days = [self.store.day_bucket(date(2016, 10, day)) for day in range(1, 32)]
+            live = database.get_image_storage_gigabyte_hours_by_bucket(month, ['project'])
+            live_days = database.get_image_storage_gigabyte_hours_by_bucket(days, ['project'])
+
+            database.rollup = self.store
+            self.assertEqual([float(row['image']) for row in live],
+                             [float(row['image']) for row in
+                              database.get_image_storage_gigabyte_hours_by_bucket(month, ['project'])])
+            self.assertEqual([float(row['image']) for row in live_days],
+                             [float(row['image']) for row in
+                              database.get_image_storage_gigabyte_hours_by_bucket(days, ['project'])])
+        finally:
+            teardown_database(database)
+            database.close()
+            user_directory.reset()
+
+    def test_update_re_rates_instances_updated_after_the_watermark(self):
+        database = usage_queries.Collaboratory(
+            'sqlite://',
+            'http://localhost:8080',
+            logging.getLogger('test_rollup'),
+            'billing',
+            False
+        )
+        initialize_database(database)
+        create_instance('instance', database, 'user', 'project', 2, '2016-09-01 00:00:00', None)
+
+        try:
+            self.store.rebuild(database, date(2016, 9, 10), date(2016, 9, 13))
+            self.assertEqual(4, len(self.store.stored_rows('cpu', ['2016-09-10', '2016-09-11', '2016-09-12',
+                                                                   '2016-09-13'])))
+
+            # An instance that goes to error is no longer billed for any day, including the ones rolled up already
+            execute(database, "UPDATE nova.instances SET vm_state = 'error', updated_at = '2016-09-15 09:00:00'")
+            summary = self.store.update(database, now=self.store.timezone.localize(datetime(2016, 9, 15, 10, 30)))
+
+            # From the day the instance was created through today
+            self.assertEqual(15, summary['days'])
+            self.assertEqual(4, summary['changed']['cpu'])
+            days = [date(2016, 9, day) for day in range(1, 15)]
+            self.assertEqual({}, self.store.stored_rows('cpu', [day.isoformat() for day in days]))
+            self.assertEqual([], database.get_instance_core_hours_by_bucket(
+                [self.store.day_bucket(day) for day in days], ['project'], [], None))
+        finally:
+            teardown_database(database)
+            database.close()
+            user_directory.reset()
+
+    def test_update_requires_a_rebuild_first(self):
+        with self.assertRaises(ValueError):
+            self.store.update(FakeDatabase())
+
+    def test_update_only_rates_days_since_the_watermark(self):
+        self.store.rebuild(FakeDatabase(), date(2016, 9, 10), date(2016, 9, 13))
+        now = self.store.timezone.localize(datetime(2016, 9, 15, 10, 30))
+
+        database = FakeDatabase()
+        summary = self.store.update(database, now=now, dry_run=True)
+        self.assertEqual(2, summary['days'])
+        self.assertEqual(2, summary['changed']['cpu'])
+        self.assertEqual({}, self.store.covered_buckets('cpu', [self.store.day_bucket(date(2016, 9, 14))]))
+
+        self.store.update(database, now=now)
+        self.assertEqual([self.store.day_bucket(date(2016, 9, 14)), self.store.day_bucket(date(2016, 9, 15))],
+                         database.rated[-2:])
+        # Today is stored but isn't served to reports until it's over
+        self.assertEqual({0: ['2016-09-14']}, self.store.covered_buckets('cpu', [self.store.day_bucket(date(2016, 9, 14))]))
+        self.assertEqual({}, self.store.covered_buckets('cpu', [self.store.day_bucket(date(2016, 9, 15))]))
+
+        # A second run the same day with nothing new only recomputes today
+        database = FakeDatabase()
+        summary = self.store.update(database, now=now)
+        self.assertEqual(1, summary['days'])
+        self.assertEqual(0, summary['changed']['cpu'])
+
+    def test_only_changed_closed_days_are_recorded(self):
+        self.store.rebuild(FakeDatabase(), date(2016, 9, 10), date(2016, 9, 13))
+        days, rebuilt_at = self.store.changed_days(0)
+        self.assertEqual(['2016-09-10', '2016-09-11', '2016-09-12', '2016-09-13'], days)
+
+        # 09-14 is new and 09-15 is today, which isn't final yet
+        self.store.update(FakeDatabase(), now=self.store.timezone.localize(datetime(2016, 9, 15, 10, 30)))
+        self.assertEqual(['2016-09-14'], self.store.changed_days(rebuilt_at)[0])
+
+    def test_update_goes_back_to_the_earliest_change(self):
+        self.store.rebuild(FakeDatabase(), date(2016, 9, 10), date(2016, 9, 14))
+        now = self.store.timezone.localize(datetime(2016, 9, 15, 10, 30))
+        summary = self.store.update(FakeDatabase(earliest=datetime(2016, 9, 12, 8, 0)), now=now, dry_run=True)
+        self.assertEqual(4, summary['days'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import math
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from billing_server.billing.usage_queries import sweep_buckets
+
+
+def rate(lifetimes, buckets):
+    # What the bucketed SQL computes, one lifetime and one bucket at a time
+    totals = dict()
+    for index, (start_date, end_date) in enumerate(buckets):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+
+        for row in lifetimes:
+            size, created_at, deleted_at = row[-3:]
+
+            if created_at < end_date and (deleted_at is None or deleted_at > start_date):
+                seconds = int((min(end_date, deleted_at or end_date) - max(start_date, created_at)).total_seconds())
+                key = (index, tuple(row[:-3]))
+                totals[key] = totals.get(key, 0) + math.ceil(seconds / 3600) * size
+
+    return sorted(totals.items(), key=lambda item: (item[0][0], tuple(name or '' for name in item[0][1])))
+
+
+class Test(unittest.TestCase):
+
+    def test_rounds_up_per_bucket(self):
+        buckets = [
+            ('2016-09-12 00:00:00', '2016-09-13 00:00:00'),
+            ('2016-09-13 00:00:00', '2016-09-14 00:00:00'),
+        ]
+        lifetimes = [
+            ('1', 'project', 4, datetime(2016, 9, 12, 23, 30), datetime(2016, 9, 13, 0, 30)),
+            ('1', 'project', 2, datetime(2016, 9, 10), None),
+        ]
+
+        self.assertEqual(
+            [(0, ('1', 'project'), 4 + 48), (1, ('1', 'project'), 4 + 48)],
+            sweep_buckets(lifetimes, buckets)
+        )
+
+    def test_lifetimes_outside_every_bucket_are_ignored(self):
+        buckets = [('2016-09-12 00:00:00', '2016-09-13 00:00:00')]
+        lifetimes = [
+            ('project', 1, datetime(2016, 9, 10), datetime(2016, 9, 12)),
+            ('project', 1, datetime(2016, 9, 13), None),
+        ]
+
+        self.assertEqual([], sweep_buckets(lifetimes, buckets))
+        self.assertEqual([], sweep_buckets([], buckets))
+
+    def test_matches_the_sql_rating(self):
+        generator = random.Random(42)
+        start = datetime(2016, 9, 1)
+        boundaries = sorted({start + timedelta(hours=generator.randrange(0, 24 * 60)) for _ in range(20)})
+        buckets = [
+            (start_date.strftime('%Y-%m-%d %H:%M:%S'), end_date.strftime('%Y-%m-%d %H:%M:%S'))
+            for start_date, end_date in zip(boundaries, boundaries[1:])
+            if generator.random() < 0.8  # leave gaps, like the buckets left over after a rollup
+        ]
+
+        lifetimes = []
+        for _ in range(500):
+            created_at = start + timedelta(seconds=generator.randrange(-86400 * 10, 86400 * 70))
+            deleted_at = created_at + timedelta(seconds=generator.randrange(1, 86400 * 20))
+            lifetimes.append((
+                generator.choice(['1', '2', None]),
+                generator.choice(['a', 'b']),
+                generator.randrange(1, 2 ** 34),
+                created_at,
+                deleted_at if generator.random() < 0.7 else None,
+            ))
+
+        expected = [(bucket, group, total) for (bucket, group), total in rate(lifetimes, buckets)]
+
+        self.assertEqual(expected, sweep_buckets(lifetimes, buckets))
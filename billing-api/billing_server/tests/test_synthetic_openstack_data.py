@@ -0,0 +1,72 @@
+import logging
+import unittest
+from datetime import datetime
+
+from billing_server.billing import usage_queries, user_directory
+from .mock_openstack_database_setup import BILLING_ROLE_ID, teardown_database
+from .synthetic_openstack_data import COLUMNS, SyntheticCloud, create_schema, load_inserts
+
+
+def small_cloud(**kwargs):
+    options = dict(projects=20, users=100, instances=2000, volumes=300, images=100)
+    options.update(kwargs)
+
+    return SyntheticCloud(**options)
+
+
+class Test(unittest.TestCase):
+
+    def test_same_seed_same_rows(self):
+        for table, columns in COLUMNS:
+            self.assertEqual(list(small_cloud().rows(table)), list(small_cloud().rows(table)))
+
+        self.assertNotEqual(list(small_cloud().rows('nova.instances')),
+                            list(small_cloud(seed=7).rows('nova.instances')))
+
+    def test_tables_draw_from_their_own_streams(self):
+        self.assertEqual(list(small_cloud().rows('nova.instances')),
+                         list(small_cloud(volumes=5000).rows('nova.instances')))
+
+    def test_lifetimes_and_states(self):
+        instances = list(small_cloud(deleted_fraction=0.5, error_fraction=0.1).rows('nova.instances'))
+        deleted = [row for row in instances if row[6] is not None]
+        errors = [row for row in instances if row[4] == 'error']
+
+        self.assertAlmostEqual(0.5, len(deleted) / len(instances), delta=0.05)
+        self.assertAlmostEqual(0.1, len(errors) / len(instances), delta=0.03)
+
+        for uuid, user_id, project_id, vcpus, vm_state, created_at, deleted_at in instances:
+            self.assertTrue('2016-01-01 00:00:00' <= created_at < '2017-01-01 00:00:00')
+
+            if deleted_at is not None:
+                self.assertTrue(created_at < deleted_at <= '2017-01-01 00:00:00')
+
+    def test_every_project_has_a_billing_contact(self):
+        cloud = small_cloud()
+        billing = set(project_id for user_id, project_id, role_id in cloud.rows('keystone.assignment')
+                      if role_id == BILLING_ROLE_ID)
+
+        self.assertEqual(set(cloud.project_ids), billing)
+
+    def test_loads_into_sqlite(self):
+        cloud = small_cloud(start_date=datetime(2016, 9, 1), end_date=datetime(2016, 10, 1))
+        database = usage_queries.Collaboratory('sqlite://', 'http://localhost:8080',
+                                               logging.getLogger('test_synthetic_openstack_data'), 'billing', False)
+
+        try:
+            create_schema(database.connection)
+
+            for table, columns in COLUMNS:
+                load_inserts(database.connection, table, columns, cloud.rows(table), batch_size=300)
+
+            self.assertEqual(2000, database.connection.execute('SELECT COUNT(*) FROM nova.instances').scalar())
+            self.assertEqual(len(cloud.project_ids), len(database.get_project_id_map()))
+
+            usage = database.get_instance_core_hours('2016-09-01 00:00:00', '2016-10-01 00:00:00',
+                                                     list(cloud.project_ids), [], '')
+            self.assertGreater(sum(row['cpu'] for row in usage), 0)
+
+        finally:
+            teardown_database(database)
+            database.close()
+            user_directory.reset()
@@ -0,0 +1,143 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta, timezone
+
+import mock
+
+from billing_server.billing import app, open_session
+from billing_server.billing.auth import sessions
+from billing_server.billing.auth.token_cache import TokenCache
+from billing_server.billing.error import AuthenticationError
+
+
+def expires_in(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+class Test(unittest.TestCase):
+
+    def test_hit_for_original_and_renewed_token(self):
+        cache = TokenCache(ttl=300, renew_margin=60)
+        new_token = {'token': 'renewed', 'user_id': 'user', 'expires_at': expires_in(3600)}
+        self.assertIsNone(cache.get('original'))
+
+        cache.put('original', 'client', new_token)
+
+        self.assertEqual(('client', new_token, False), cache.get('original'))
+        self.assertEqual(('client', new_token, False), cache.get('renewed'))
+        self.assertEqual({'entries': 2, 'hits': 2, 'misses': 1, 'revalidations': 0}, cache.stats())
+
+    def test_tokens_near_expiry_are_renewed(self):
+        cache = TokenCache(ttl=300, renew_margin=600)
+        cache.put('original', 'client', {'token': 'renewed', 'user_id': 'user', 'expires_at': expires_in(500)})
+        self.assertIsNone(cache.get('original'))
+
+    def test_tokens_without_expiry_are_not_cached(self):
+        cache = TokenCache()
+        cache.put('original', 'client', {'token': 'renewed', 'user_id': 'user'})
+        self.assertIsNone(cache.get('original'))
+
+    def test_entries_are_revalidated_after_ttl_without_renewing(self):
+        cache = TokenCache(ttl=0.05, renew_margin=0)
+        new_token = {'token': 'renewed', 'user_id': 'user', 'expires_at': expires_in(3600)}
+        cache.put('original', 'client', new_token)
+        time.sleep(0.1)
+
+        # Still hours from expiry, so the renewed token is kept and only validated again
+        self.assertEqual(('client', new_token, True), cache.get('renewed'))
+
+        cache.revalidated('renewed')
+        self.assertEqual(('client', new_token, False), cache.get('original'))
+        self.assertEqual(1, cache.stats()['revalidations'])
+
+    def test_discard_forgets_both_tokens(self):
+        cache = TokenCache()
+        cache.put('original', 'client', {'token': 'renewed', 'user_id': 'user', 'expires_at': expires_in(3600)})
+
+        cache.discard('original')
+
+        self.assertIsNone(cache.get('original'))
+        self.assertIsNone(cache.get('renewed'))
+
+    def test_eviction_keeps_cache_bounded(self):
+        cache = TokenCache(max_entries=10)
+        for index in range(20):
+            cache.put('token {}'.format(index), 'client',
+                      {'token': 'renewed {}'.format(index), 'user_id': 'user', 'expires_at': expires_in(3600)})
+
+        self.assertLessEqual(cache.stats()['entries'], 10)
+        self.assertIsNotNone(cache.get('renewed 19'))
+
+
+
+class KeystoneHandler(BaseHTTPRequestHandler):
+    # Answers GET /v3/auth/tokens like Keystone: 200 for the subject token 'valid', 404 for anything else
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers['X-Auth-Token'], self.headers['X-Subject-Token']))
+        self.send_response(200 if self.headers['X-Subject-Token'] == 'valid' else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CheckTokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.keystone = HTTPServer(('127.0.0.1', 0), KeystoneHandler)
+        self.keystone.requests = []
+        threading.Thread(target=self.keystone.serve_forever, daemon=True).start()
+        self.auth_url = 'http://127.0.0.1:{}/v3'.format(self.keystone.server_port)
+
+    def tearDown(self):
+        self.keystone.shutdown()
+        self.keystone.server_close()
+
+    def test_valid_token(self):
+        sessions.check_token(self.auth_url, 'valid')
+        self.assertEqual([('/v3/auth/tokens', 'valid', 'valid')], self.keystone.requests)
+
+    def test_revoked_token(self):
+        with self.assertRaises(AuthenticationError):
+            sessions.check_token(self.auth_url, 'revoked')
+
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.token_cache = app.token_cache
+        app.token_cache = TokenCache(ttl=0.05, renew_margin=0)
+        self.new_token = {'token': 'renewed', 'user_id': 'user', 'expires_at': expires_in(3600)}
+        app.token_cache.put('original', 'client', self.new_token)
+        time.sleep(0.1)
+
+    def tearDown(self):
+        app.token_cache = self.token_cache
+
+    @mock.patch('billing_server.billing.sessions.renew_token')
+    @mock.patch('billing_server.billing.sessions.check_token')
+    def test_stale_tokens_are_checked_with_keystone(self, check_mock, renew_mock):
+        self.assertEqual(('client', self.new_token), open_session('original'))
+
+        check_mock.assert_called_once_with(app.config['AUTH_URI'], 'renewed')
+        renew_mock.assert_not_called()
+        self.assertEqual(('client', self.new_token, False), app.token_cache.get('original'))
+
+    @mock.patch('billing_server.billing.sessions.renew_token')
+    @mock.patch('billing_server.billing.sessions.check_token', side_effect=AuthenticationError('revoked'))
+    def test_revoked_tokens_are_discarded(self, check_mock, renew_mock):
+        with self.assertRaises(AuthenticationError):
+            open_session('original')
+
+        renew_mock.assert_not_called()
+        self.assertIsNone(app.token_cache.get('original'))
+        self.assertIsNone(app.token_cache.get('renewed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
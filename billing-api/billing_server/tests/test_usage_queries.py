@@ -1,14 +1,15 @@
 import logging
 import unittest
 
-from billing_server.billing import usage_queries
+from billing_server.billing import usage_queries, user_directory
 from .mock_openstack_database_setup import *
 from billing_server.billing.config import default
 class Test(unittest.TestCase):
+    database_url = default.TEST_MYSQL_URI
 
     def setUp(self):
         self.database = usage_queries.Collaboratory(
-            default.TEST_MYSQL_URI,
+            self.database_url,
             default.TEST_GRAPHITE_URI,
             logging.getLogger('test_usage_queries'),
             'billing',
@@ -19,6 +20,7 @@ class Test(unittest.TestCase):
     def tearDown(self):
         teardown_database(self.database)
         self.database.close()
+        user_directory.reset()
     # This test has been out of date
     # def test_get_username(self):
     #     user_id_1 = '1'
@@ -370,3 +372,136 @@ class Test(unittest.TestCase):
         self.assertEqual(data.__len__(), 1)
         for row in data:
             self.assertEqual(row['user'], user_id_2)
+
+    def test_bucketed_queries_match_per_bucket_queries(self):
+        user_id = '1'
+        project_id = 'thisisaproject!'
+        create_user(self.database, user_id, 'Cool Guy')
+        assign_role(self.database, user_id, project_id, True)
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, user_id, project_id, 4,
+                        '2016-09-12 04:39:13', '2016-09-14 16:48:19')
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, user_id, project_id, 2,
+                        '2016-09-13 10:10:10', None)
+        create_volume(self.database, user_id, project_id, 64,
+                      '2016-09-11 19:40:23', '2016-09-13 20:10:29')
+        create_image(self.database, project_id, 2 ** 32,
+                     '2016-09-12 01:00:00', '2016-09-15 02:00:00')
+        buckets = [
+            ('2016-09-11 00:00:00', '2016-09-12 00:00:00'),
+            ('2016-09-12 00:00:00', '2016-09-13 00:00:00'),
+            ('2016-09-13 00:00:00', '2016-09-14 00:00:00'),
+            ('2016-09-14 00:00:00', '2016-09-14 12:30:00'),
+        ]
+
+        cpu = self.database.get_instance_core_hours_by_bucket(buckets, [project_id], [], user_id)
+        volume = self.database.get_volume_gigabyte_hours_by_bucket(buckets, [project_id], [], user_id)
+        image = self.database.get_image_storage_gigabyte_hours_by_bucket(buckets, [project_id])
+
+        for index, (start_date, end_date) in enumerate(buckets):
+            expected = self.database.get_instance_core_hours(start_date, end_date, [project_id], [], user_id)
+            self.assertEqual([row['cpu'] for row in expected],
+                             [row['cpu'] for row in cpu if row['bucket'] == index])
+
+            expected = self.database.get_volume_gigabyte_hours(start_date, end_date, [project_id], [], user_id)
+            self.assertEqual([row['volume'] for row in expected],
+                             [row['volume'] for row in volume if row['bucket'] == index])
+
+            expected = self.database.get_image_storage_gigabyte_hours_by_project(start_date, end_date, [project_id])
+            self.assertEqual([row['image'] for row in expected],
+                             [row['image'] for row in image if row['bucket'] == index])
+
+    def test_sweep_engine_matches_sql(self):
+        user_id = '1'
+        project_id = 'thisisaproject!'
+        create_user(self.database, user_id, 'Cool Guy')
+        assign_role(self.database, user_id, project_id, True)
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, user_id, project_id, 4,
+                        '2016-09-12 04:39:13', '2016-09-14 16:48:19')
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, '2', project_id, 2,
+                        '2016-09-13 10:10:10', None)
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, user_id, 'other', 8,
+                        '2016-09-01 00:00:00', None)
+        create_volume(self.database, user_id, project_id, 64,
+                      '2016-09-11 19:40:23', '2016-09-13 20:10:29')
+        create_volume(self.database, '2', project_id, 16,
+                      '2016-09-13 23:59:59', None)
+        create_image(self.database, project_id, 2 ** 32,
+                     '2016-09-12 01:00:00', '2016-09-15 02:00:00')
+        create_image(self.database, project_id, 3 * 2 ** 29,
+                     '2016-09-10 01:00:00', None)
+        buckets = [
+            ('2016-09-11 00:00:00', '2016-09-12 00:00:00'),
+            ('2016-09-12 00:00:00', '2016-09-13 00:00:00'),
+            ('2016-09-13 00:00:00', '2016-09-14 00:00:00'),
+            ('2016-09-14 00:00:00', '2016-09-14 12:30:00'),
+        ]
+
+        for billing_projects, user_projects in [([project_id], []), ([], [project_id, 'other'])]:
+            sql = [
+                self.database.query_instance_core_hours_by_bucket(buckets, list(billing_projects),
+                                                                  list(user_projects), user_id),
+                self.database.query_volume_gigabyte_hours_by_bucket(buckets, list(billing_projects),
+                                                                    list(user_projects), user_id),
+                self.database.query_image_storage_gigabyte_hours_by_bucket(buckets, list(billing_projects)),
+            ]
+            sweep = [
+                self.database.sweep_instance_core_hours_by_bucket(buckets, list(billing_projects),
+                                                                  list(user_projects), user_id),
+                self.database.sweep_volume_gigabyte_hours_by_bucket(buckets, list(billing_projects),
+                                                                    list(user_projects), user_id),
+                self.database.sweep_image_storage_gigabyte_hours_by_bucket(buckets, list(billing_projects)),
+            ]
+
+            for expected, actual in zip(sql, sweep):
+                self.assertEqual([{key: float(value) if key in ('cpu', 'volume', 'image') else value
+                                   for key, value in row.items()} for row in expected],
+                                 [{key: float(value) if key in ('cpu', 'volume', 'image') else value
+                                   for key, value in row.items()} for row in actual])
+
+    def test_sweep_engine_serves_bucketed_queries(self):
+        user_id = '1'
+        project_id = 'thisisaproject!'
+        create_user(self.database, user_id, 'Cool Guy')
+        assign_role(self.database, user_id, project_id, True)
+        create_instance('eb0eb5f8-2c13-464c-8bea-aa74d09ec00f', self.database, user_id, project_id, 4,
+                        '2016-09-12 04:39:13', '2016-09-14 16:48:19')
+        create_volume(self.database, user_id, project_id, 64,
+                      '2016-09-11 19:40:23', None)
+        create_image(self.database, project_id, 2 ** 32,
+                     '2016-09-12 01:00:00', '2016-09-15 02:00:00')
+        buckets = [
+            ('2016-09-12 00:00:00', '2016-09-13 00:00:00'),
+            ('2016-09-13 00:00:00', '2016-09-14 00:00:00'),
+        ]
+
+        self.database.engine = 'sweep'
+        instance = self.database.get_instance_core_hours_by_bucket(buckets, [project_id], [], user_id)
+        volume = self.database.get_volume_gigabyte_hours_by_bucket(buckets, [project_id], [], user_id)
+        image = self.database.get_image_storage_gigabyte_hours_by_bucket(buckets, [project_id])
+
+        self.assertEqual([(0, 80.0), (1, 96.0)], [(row['bucket'], float(row['cpu'])) for row in instance])
+        self.assertEqual([(0, 1536.0), (1, 1536.0)], [(row['bucket'], float(row['volume'])) for row in volume])
+        self.assertEqual([(0, 92.0), (1, 96.0)], [(row['bucket'], float(row['image'])) for row in image])
+
+    def test_bucketed_queries_empty_buckets(self):
+        self.assertEqual([], self.database.get_instance_core_hours_by_bucket([], ['project'], [], '1'))
+
+    def test_get_users_extras_fetches_all_users_at_once(self):
+        create_user(self.database, '1', 'Articuno', '{"email": "articuno@oicr.on.ca"}')
+        create_user(self.database, '2', 'Zapdos', '{"email": "zapdos@oicr.on.ca"}')
+        create_user(self.database, '3', 'Moltres')
+        extras = self.database.get_users_extras(['1', '2', '3', '1', 'nobody'])
+
+        self.assertEqual({'email': 'articuno@oicr.on.ca'}, extras['1'])
+        self.assertEqual({'email': 'zapdos@oicr.on.ca'}, extras['2'])
+        self.assertIsNone(extras['3'])
+        self.assertIsNone(extras['nobody'])
+
+        # decoded extras are reused rather than fetched again
+        delete_user(self.database, '1')
+        self.assertEqual({'email': 'articuno@oicr.on.ca'}, self.database.get_users_extras(['1'])['1'])
+
+
+# The same tests on SQLite, through the dialect layer; no MySQL server needed
+class SQLiteTest(Test):
+    database_url = 'sqlite://'
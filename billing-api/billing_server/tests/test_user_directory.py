@@ -0,0 +1,55 @@
+import unittest
+
+from billing_server.billing import pool, user_directory
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        pool.dispose()
+        user_directory.reset()
+        # SQLite keeps one in-memory database per thread, so the schema set up here is the one the directory sees.
+        # The pool attaches keystone to every SQLite connection.
+        self.connection, waited = pool.connect('sqlite://')
+        self.connection.execute('CREATE TABLE keystone.local_user (id INTEGER, user_id VARCHAR(64), name VARCHAR(255))')
+        self.add_user(1, 'a', 'Articuno')
+        self.add_user(2, 'z', 'Zapdos')
+        self.directory = user_directory.get_directory('sqlite://')
+
+    def tearDown(self):
+        self.connection.close()
+        pool.dispose()
+        user_directory.reset()
+
+    def add_user(self, id, user_id, name):
+        self.connection.execute(
+            'INSERT INTO keystone.local_user (id, user_id, name) VALUES (?, ?, ?)', (id, user_id, name))
+
+    def test_directory_is_shared(self):
+        self.assertIs(self.directory, user_directory.get_directory('sqlite://'))
+
+    def test_get_loads_all_users_once(self):
+        self.assertEqual('Articuno', self.directory.get('a'))
+        self.assertEqual('Zapdos', self.directory.get('z'))
+        self.assertEqual(0, self.directory.stats()['lookups'])
+        self.assertGreater(self.directory.stats()['bytes'], 0)
+        self.assertIsNotNone(self.directory.stats()['refresh_seconds'])
+
+    def test_unknown_ids_are_looked_up_on_demand(self):
+        self.directory.load()
+        self.add_user(3, 'm', 'Moltres')
+        self.assertEqual('Moltres', self.directory.get('m'))
+        self.assertIsNone(self.directory.get('nobody'))
+        self.assertIsNone(self.directory.get('nobody'))
+        self.assertEqual(2, self.directory.stats()['lookups'])
+
+    def test_incremental_refresh_only_adds_new_users(self):
+        self.directory.load()
+        self.add_user(3, 'm', 'Moltres')
+        self.directory.refresh()
+        self.assertEqual(3, self.directory.stats()['users'])
+        self.assertEqual(3, self.directory.last_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
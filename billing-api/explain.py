@@ -0,0 +1,148 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+from billing_server.billing import app, dialects, divide_time_range, query_plans
+from billing_server.billing.usage_queries import Collaboratory
+
+# Prints the MySQL plan of every statement Collaboratory runs, run with representative parameters, flags full
+# scans, filesorts and temporary tables, and suggests indexes for the scanned tables. The plans leave out row
+# estimates, so the output of two runs can be diffed to catch plan changes, e.g. after an OpenStack upgrade:
+#   python explain.py --from 2020-01-01 --to 2020-02-01 > plans.txt
+
+
+def calls(database, buckets, billing_projects, user_projects, user_id):
+    # Every query runs with fresh copies of the project lists, since the methods pad empty ones
+    start_date, end_date = buckets[0][0], buckets[-1][1]
+
+    def scope():
+        return list(billing_projects), list(user_projects), user_id
+
+    return [
+        (database.get_instance_core_hours, (start_date, end_date) + scope()),
+        (database.get_volume_gigabyte_hours, (start_date, end_date) + scope()),
+        (database.get_image_storage_gigabyte_hours_by_project, (start_date, end_date, list(billing_projects))),
+        (database.query_instance_core_hours_by_bucket, (buckets,) + scope()),
+        (database.query_volume_gigabyte_hours_by_bucket, (buckets,) + scope()),
+        (database.query_image_storage_gigabyte_hours_by_bucket, (buckets, list(billing_projects))),
+        (database.sweep_instance_core_hours_by_bucket, (buckets,) + scope()),
+        (database.sweep_volume_gigabyte_hours_by_bucket, (buckets,) + scope()),
+        (database.sweep_image_storage_gigabyte_hours_by_bucket, (buckets, list(billing_projects))),
+        (database.get_user_roles, (user_id,)),
+        (database.get_usage_changes_since, ('cpu', start_date)),
+        (database.get_usage_changes_since, ('volume', start_date)),
+        (database.get_usage_changes_since, ('image', start_date)),
+        (database.get_project_billing_map, ()),
+        (database.get_project_id_map, ()),
+        (database.get_users_extras, ([user_id],)),
+    ]
+
+
+def localize(date):
+    # --from and --to may carry an offset, like the ISO dates /reports accepts; naive ones are in the report timezone
+    if date.tzinfo is None:
+        return app.timezone.localize(date)
+
+    return date
+
+
+def main():
+    today = datetime.now(app.timezone).date()
+
+    parser = argparse.ArgumentParser(description='Report the query plans of the usage queries')
+    parser.add_argument('--from', dest='from_date', help='Start of the report range (default: 30 days ago)')
+    parser.add_argument('--to', dest='to_date', help='End of the report range (default: today)')
+    parser.add_argument('--bucket', default='daily', choices=app.valid_bucket_sizes,
+                        help='Bucket size for the bucketed queries')
+    parser.add_argument('--projects', help='Comma separated billing project ids (default: the first 10 projects)')
+    parser.add_argument('--user', default='', help='User id for the user project and role queries')
+    parser.add_argument('--user-projects', default='', help='Comma separated project ids the user is billed for')
+    parser.add_argument('--analyze', action='store_true',
+                        help='Also run EXPLAIN ANALYZE (MySQL 8.0.18+) or ANALYZE (MariaDB); '
+                             'its timings differ between runs')
+    args = parser.parse_args()
+
+    start_date = localize(parse(args.from_date) if args.from_date else datetime.combine(
+        today - timedelta(days=30), datetime.min.time()))
+    end_date = localize(parse(args.to_date) if args.to_date else datetime.combine(
+        today, datetime.min.time()))
+    buckets = [bucket.bounds() for bucket in divide_time_range(start_date, end_date, args.bucket)[0]]
+
+    database = Collaboratory(
+        app.config['MYSQL_URI'],
+        app.config['GRAPHITE_URI'],
+        app.logger,
+        app.config['BILLING_ROLE'],
+        False
+    )
+
+    try:
+        if args.projects:
+            billing_projects = args.projects.split(',')
+
+        else:
+            billing_projects = sorted(row['id'] for row in database.get_project_id_map())[:10]
+
+        user_projects = [project for project in args.user_projects.split(',') if project]
+
+        analyze_with = None
+
+        if args.analyze:
+            version = dialects.execute(
+                database.connection,
+                'SELECT VERSION() AS version',
+                {}
+            ).all(as_dict=True)[0]['version']
+            analyze_with = query_plans.analyze_prefix(version)
+
+            if analyze_with is None:
+                print('MySQL {} has no EXPLAIN ANALYZE; showing the plans only'.format(version), file=sys.stderr)
+
+        existing = query_plans.existing_indexes(
+            database.connection,
+            set(table.split('.')[0] for table in query_plans.SUGGESTED_INDEXES)
+        )
+
+        reports = []
+
+        for func, call_args in calls(database, buckets, billing_projects, user_projects, args.user):
+            entries = query_plans.capture(func, *call_args)
+
+            for number, entry in enumerate(entries, 1):
+                label = entry['method']
+
+                if len(entries) > 1:
+                    label += ' #{}'.format(number)
+
+                if func.__name__ == 'get_usage_changes_since':
+                    label += ' ({})'.format(call_args[0])
+
+                plan, analyzed = query_plans.explain(database.connection, entry, analyze_with)
+                found = query_plans.findings(entry['sql'], plan)
+                reports.append((label, plan, found, query_plans.suggest_indexes(found, existing), analyzed))
+
+    finally:
+        database.close()
+
+    print(query_plans.format_report(reports))
+
+
+if __name__ == '__main__':
+    main()
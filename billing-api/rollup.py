@@ -0,0 +1,81 @@
+# Copyright (c) 2020 The Ontario Institute for Cancer Research. All rights reserved.
+#
+# This program and the accompanying materials are made available under the terms of the GNU Public License v3.0.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+# OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT
+# SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+from billing_server.billing import app
+from billing_server.billing.usage_queries import Collaboratory
+
+# Fills the usage rollup store from the OpenStack databases. Backfill a range of days once, then keep it up to
+# date from cron, e.g.
+#   */30 * * * * cd /srv/billing-api && env/bin/python rollup.py --incremental
+
+
+def main():
+    yesterday = (datetime.now(app.timezone) - timedelta(days=1)).date()
+
+    parser = argparse.ArgumentParser(description='Precompute daily usage into USAGE_ROLLUP_PATH')
+    parser.add_argument('--from', dest='from_date', help='First day to roll up, YYYY-MM-DD (default: yesterday)')
+    parser.add_argument('--to', dest='to_date', help='Last day to roll up, YYYY-MM-DD (default: yesterday)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only re-rate the days changed since the last run, through today')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='With --incremental, report how many day-rows would change without storing them')
+    args = parser.parse_args()
+
+    if app.rollup is None:
+        parser.error('USAGE_ROLLUP_PATH is not set in config.py')
+
+    if args.dry_run and not args.incremental:
+        parser.error('--dry-run only applies to --incremental')
+
+    first_day = parse(args.from_date).date() if args.from_date else yesterday
+    last_day = parse(args.to_date).date() if args.to_date else yesterday
+
+    database = Collaboratory(
+        app.config['MYSQL_URI'],
+        app.config['GRAPHITE_URI'],
+        app.logger,
+        app.config['BILLING_ROLE'],
+        False
+    )
+
+    try:
+        if args.incremental:
+            summary = app.rollup.update(database, dry_run=args.dry_run)
+
+        else:
+            rows = app.rollup.rebuild(database, first_day, last_day)
+
+    finally:
+        database.close()
+
+    if args.incremental:
+        print('{} {} days; day-rows changed: {}; still open: {}'.format(
+            'Would re-rate' if args.dry_run else 'Re-rated',
+            summary['days'],
+            summary['changed'],
+            summary['open']
+        ))
+
+    else:
+        print('Rolled up {} rows for {} to {}'.format(rows, first_day.isoformat(), last_day.isoformat()))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,4 +4,5 @@
 echo "starting api"
 service nginx restart
 source env/bin/activate
-gunicorn --log-level debug --access-logfile /srv/billing-api/logs/gunicorn/access.log --error-logfile /srv/billing-api/logs/gunicorn/error.log -w 6 -b 0.0.0.0:5000 billing_server.billing:app 
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/srv/billing-api/logs/metrics}
+gunicorn -c gunicorn.conf.py --log-level debug --access-logfile /srv/billing-api/logs/gunicorn/access.log --error-logfile /srv/billing-api/logs/gunicorn/error.log -w 6 -b 0.0.0.0:5000 billing_server.billing:app 